@@ -0,0 +1,337 @@
+# ============================================================
+# agent.py — the tool-use agent loop without Streamlit
+#
+# Prompt, tool schema and request construction are shared with the
+# app. Conversation is the loop itself (model turn -> tool calls ->
+# tool_result turn, until end_turn or MAX_ITERATIONS): messages,
+# routing, tool_result rendering, usage and trace, with no I/O.
+# Agent.run() drives it with blocking calls and batched tools through
+# Retriever.execute_tools; the app's agent_loop() adds the UI,
+# streaming and LangSmith. The model is any object with
+# create(**request) returning an Anthropic-shaped message (see llm.py),
+# so evaluation can run against a local stand-in instead of the API. With a
+# FactRouter (facts.py), single-cell table lookups are answered from
+# the fact store before the loop starts. Which model takes each turn,
+# and when the loop stops searching, is decided by a routing.Plan.
+#
+# AsyncAgent drives it for service.py: anthropic.AsyncAnthropic
+# streaming, yielding text deltas, tool calls and the final result as
+# events; tool calls start in a thread pool as soon as their input
+# JSON is complete.
+# ============================================================
+
+import asyncio, json, time
+
+from metrics import METRICS
+from routing import MAX_TOKENS, MODEL, ModelRouting, route_summary, turn_cost
+from tools import COMPACT_RESULTS, TOOLS, SentChunks, tool_result_text
+
+MAX_ITERATIONS = 8
+
+SYSTEM_PROMPT = """You are a senior financial analyst specializing in SEC 10-K filings.
+You have access to 10-K filings (Alphabet Inc., GOOGL, fiscal 2025) through two search tools.
+
+Guidelines:
+- Quantitative questions (numbers, ratios): use table_search first.
+- Qualitative questions (risks, strategy): use text_search first.
+- Comparison questions: call BOTH tools before answering.
+- Set ticker / item on a search when the question names them; leave them out otherwise.
+- fiscal_year is the year of the FILING, not of the figures asked about: a fiscal 2025 10-K also
+  reports 2024 and 2023. Leave it out unless the question names a filing (e.g. "the 2024 10-K").
+- Always cite Source number, Item, and page in your final answer.
+- Never guess numbers — say so if tools return nothing useful.
+- Use markdown formatting with **bold** key numbers and clear headers."""
+
+# prompt caching: system prompt, tool schema and the settled conversation prefix are cache breakpoints
+CACHE_CONTROL = {"type": "ephemeral"}
+SYSTEM_BLOCKS = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": CACHE_CONTROL}]
+CACHED_TOOLS  = TOOLS[:-1] + [{**TOOLS[-1], "cache_control": CACHE_CONTROL}]
+
+
+def build_request(messages, model=MODEL, max_tokens=MAX_TOKENS, tool_choice=None):
+    """messages.create kwargs. The newest message carries the third cache breakpoint, so the next
+    iteration reads everything up to and including it from cache (older markers are not kept:
+    the API allows four). tool_choice {"type": "none"} keeps the tools (and their cache) but
+    makes the turn answer."""
+    *settled, last = messages
+    content = last["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    content = list(content[:-1]) + [{**content[-1], "cache_control": CACHE_CONTROL}]
+    request = dict(model=model, max_tokens=max_tokens, system=SYSTEM_BLOCKS, tools=CACHED_TOOLS,
+                   messages=settled + [{"role": last["role"], "content": content}])
+    if tool_choice:
+        request["tool_choice"] = tool_choice
+    return request
+
+
+def usage_stats(usage):
+    return {
+        "input_tokens":       usage.input_tokens,
+        "output_tokens":      usage.output_tokens,
+        "cache_read_tokens":  getattr(usage, "cache_read_input_tokens", 0) or 0,
+        "cache_write_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+    }
+
+
+def record_llm_turn(model, seconds, usage, route="answer"):
+    """One model turn into METRICS: wall time, token counts from usage_stats() and dollar cost,
+    by model and route (routing.py). Returns the cost."""
+    cost = turn_cost(model, usage)
+    METRICS.observe("rag_llm_iteration_seconds", seconds, model=model, route=route)
+    for name, n in usage.items():
+        if n:
+            METRICS.inc("rag_llm_tokens_total", n, model=model, kind=name[:-len("_tokens")])
+    if cost:
+        METRICS.inc("rag_llm_cost_usd_total", cost, model=model, route=route)
+    return cost
+
+
+def record_tool_calls(calls, seconds):
+    """Batched calls all wait for the batch, so each one is observed with the batch wall time."""
+    for block in calls:
+        METRICS.observe("rag_tool_call_seconds", seconds, tool=block.name)
+
+
+def fast_answer(router, question):
+    """The FactRouter (facts.py) answer as an Agent.run()-shaped dict, or None: ask the agent."""
+    if router is None:
+        return None
+    t0  = time.perf_counter()
+    hit = router.answer(question)
+    METRICS.inc("rag_route_total", route="fast_path" if hit else "agent")
+    if hit is None:
+        return None
+    return {
+        "question":    question,
+        "answer":      hit["answer"],
+        "chunks":      [dict(c) for c in hit["chunks"]],
+        "trace_lines": hit["trace_lines"],
+        "iterations":  0,
+        "stop":        "fast_path",
+        "usage":       {},
+        "llm":         [],
+        "routes":      {},
+        "cost_usd":    0.0,
+        "tool_tokens": {"raw": 0, "sent": 0},
+        "llm_s":       0.0,
+        "tool_s":      0.0,
+        "elapsed_s":   time.perf_counter() - t0,
+    }
+
+
+class Conversation:
+    """The agent loop's state for one question: messages, routing plan, tool results sent so far,
+    usage, trace and outcome. Agent.run, AsyncAgent.stream and the app's agent_loop all drive it:
+
+        conv = Conversation(question, routing)
+        for turn in conv.turns():
+            response = <send conv.request(turn)>
+            if conv.settle(turn, response, seconds) != "select":
+                break   # answered: conv.done
+            calls = conv.tool_calls(response)   # conv.trace() each as it starts
+            conv.add_results(calls, <run calls>, seconds)
+        result = conv.result()
+
+    Only how a turn reaches the model and how tools run differ between them."""
+
+    def __init__(self, question, routing, max_iterations=MAX_ITERATIONS, compact=COMPACT_RESULTS):
+        self.question       = question
+        self.messages       = [{"role": "user", "content": question}]
+        self.plan           = routing.plan(question)
+        self.sent           = SentChunks(compact=compact)
+        self.max_iterations = max_iterations
+        self.iteration      = 0
+        self.chunks         = []
+        self.trace_lines    = []
+        self.usage, self.llm = {}, []
+        self.llm_s = self.tool_s = 0.0
+        self.t_start        = time.perf_counter()
+        self.stop, self.answer = "max_iterations", "Max iterations reached."
+        self.done           = False
+
+    def turns(self):
+        """routing.Turn for each model turn, until an answer or max_iterations."""
+        while not self.done and self.iteration < self.max_iterations:
+            self.iteration += 1
+            yield self.plan.next_turn(last=self.iteration == self.max_iterations)
+
+    def request(self, turn):
+        return build_request(self.messages, turn.model, **turn.options)
+
+    def settle(self, turn, response, seconds, **extra):
+        """Record a finished model turn (extra: timing keys for its "llm" record); returns its route.
+        Any stop but tool_use ends the loop."""
+        self.llm_s += seconds
+        used  = usage_stats(response.usage)
+        route = self.plan.settle(response)
+        cost  = record_llm_turn(turn.model, seconds, used, route)
+        self.llm.append({"iteration": self.iteration, "model": turn.model, "route": route,
+                         "llm_s": round(seconds, 3), **extra, "cost_usd": cost, **used})
+        for name, n in used.items():
+            self.usage[name] = self.usage.get(name, 0) + n
+        self.messages.append({"role": "assistant", "content": response.content})
+        if response.stop_reason == "end_turn":
+            texts       = [b.text for b in response.content if getattr(b, "type", "") == "text"]
+            self.stop   = "end_turn" if texts else "no_text"
+            self.answer = texts[0] if texts else "No answer returned."
+            self.done   = True
+        elif response.stop_reason != "tool_use":
+            self.stop, self.answer, self.done = response.stop_reason, "No answer returned.", True
+        return route
+
+    @staticmethod
+    def tool_calls(response):
+        return [b for b in response.content if b.type == "tool_use"]
+
+    def trace(self, tool, tool_input):
+        """Trace line for a tool call that has started; returned for the caller's UI or event."""
+        line = {"iter": self.iteration, "tool": tool, "query": tool_input.get("query", "")}
+        self.trace_lines.append(line)
+        return line
+
+    def add_results(self, calls, results, seconds=0.0):
+        """The tool_result turn for calls, from their chunks in the same order. Each result is rendered
+        here, once: repeats become back-references, new chunks are compacted toward the query."""
+        self.tool_s += seconds
+        self.sent.new_round()
+        seen, tool_results = len(self.sent.labels), []
+        for block, chunks in zip(calls, results):
+            self.chunks.extend(chunks)
+            content = tool_result_text(block.name, chunks, self.sent, block.input.get("query", ""))
+            tool_results.append({"type": "tool_result", "tool_use_id": block.id, "content": content})
+        self.messages.append({"role": "user", "content": tool_results})
+        self.plan.evidence(len(self.sent.labels) - seen)
+
+    def result(self):
+        """Agent.run()'s dict."""
+        return {
+            "question":    self.question,
+            "answer":      self.answer,
+            "chunks":      [dict(c) for c in self.chunks],
+            "trace_lines": self.trace_lines,
+            "iterations":  self.iteration,
+            "stop":        self.stop,
+            "usage":       self.usage,
+            "llm":         self.llm,
+            "routes":      route_summary(self.llm),
+            "cost_usd":    sum(t["cost_usd"] for t in self.llm),
+            "converged":   self.plan.converged,
+            "tool_tokens": {"raw": self.sent.raw_tokens, "sent": self.sent.tokens},
+            "llm_s":       self.llm_s,
+            "tool_s":      self.tool_s,
+            "elapsed_s":   time.perf_counter() - self.t_start,
+        }
+
+
+class Agent:
+    def __init__(self, retriever, llm, model=MODEL, max_iterations=MAX_ITERATIONS, router=None,
+                 routing=None, compact=COMPACT_RESULTS):
+        self.retriever      = retriever
+        self.llm            = llm
+        self.max_iterations = max_iterations
+        self.router         = router   # facts.FactRouter: confident table lookups skip the loop
+        self.routing        = routing or ModelRouting(large=model)
+        self.compact        = compact  # compact.py tool results within the token budgets
+
+    def run(self, question):
+        """Answer one question. Returns a JSON-serializable dict: answer, chunks, trace_lines,
+        iterations, stop ("end_turn" / "no_text" / "max_iterations" / other stop reason),
+        summed token usage, per-turn "llm" records with their "routes" summary and cost_usd,
+        whether the evidence converged, tool_result tokens sent vs uncompacted, and wall time split into llm_s / tool_s / elapsed_s.
+        Questions the router answers return stop "fast_path" with no model call."""
+        fast = fast_answer(self.router, question)
+        if fast is not None:
+            METRICS.observe("rag_agent_seconds", fast["elapsed_s"], outcome="fast_path")
+            return fast
+        conv = Conversation(question, self.routing, self.max_iterations, self.compact)
+        for turn in conv.turns():
+            t0       = time.perf_counter()
+            response = self.llm.create(**conv.request(turn))
+            if conv.settle(turn, response, time.perf_counter() - t0) != "select":
+                break
+            calls = conv.tool_calls(response)
+            for block in calls:
+                conv.trace(block.name, block.input)
+            t0      = time.perf_counter()
+            results = self.retriever.execute_tools(calls)
+            t_tools = time.perf_counter() - t0
+            record_tool_calls(calls, t_tools)
+            conv.add_results(calls, results, t_tools)
+
+        result = conv.result()
+        METRICS.observe("rag_agent_seconds", result["elapsed_s"], outcome=result["stop"])
+        return result
+
+
+class AsyncAgent:
+    def __init__(self, retriever, client, pool, model=MODEL, max_iterations=MAX_ITERATIONS, routing=None):
+        self.retriever      = retriever
+        self.client         = client   # anthropic.AsyncAnthropic
+        self.pool           = pool     # executor for the (blocking) retriever
+        self.max_iterations = max_iterations
+        self.routing        = routing or ModelRouting(large=model)
+
+    def _run_tool(self, name, tool_input):
+        with METRICS.time("rag_tool_call_seconds", tool=name):
+            return self.retriever.execute_tool(name, tool_input)
+
+    async def stream(self, question):
+        """Async generator of events (JSON-serializable dicts, "type" first):
+            iteration  {"iteration"}            a model turn starts
+            text       {"delta"}                streamed answer text
+            tool       {"iter","tool","query"}  a tool call has started
+            discard    {}                       the turn ended in tool_use: drop text streamed so far
+            done       Agent.run()'s dict
+        """
+        loop = asyncio.get_running_loop()
+        conv = Conversation(question, self.routing, self.max_iterations)
+        for turn in conv.turns():
+            yield {"type": "iteration", "iteration": conv.iteration}
+            blocks, tasks = {}, {}
+            t0 = time.perf_counter()
+            t_first = None
+            async with self.client.messages.stream(**conv.request(turn)) as stream:
+                async for event in stream:
+                    if event.type == "content_block_start":
+                        blocks[event.index] = {"block": event.content_block, "json": ""}
+                    elif event.type == "content_block_delta":
+                        t_first = t_first or time.perf_counter()
+                        if event.delta.type == "text_delta":
+                            yield {"type": "text", "delta": event.delta.text}
+                        elif event.delta.type == "input_json_delta":
+                            blocks[event.index]["json"] += event.delta.partial_json
+                    elif event.type == "content_block_stop":
+                        b = blocks.get(event.index)
+                        if b and b["block"].type == "tool_use":
+                            tool_input = json.loads(b["json"] or "{}")
+                            trace = conv.trace(b["block"].name, tool_input)
+                            tasks[b["block"].id] = loop.run_in_executor(
+                                self.pool, self._run_tool, b["block"].name, tool_input)
+                            yield {"type": "tool", **trace}
+                response = await stream.get_final_message()
+
+            t_llm = time.perf_counter() - t0
+            if t_first:
+                METRICS.observe("rag_llm_ttft_seconds", t_first - t0, model=turn.model)
+            route = conv.settle(turn, response, t_llm, ttft=round(t_first - t0, 3) if t_first else None)
+            if route != "select":
+                # e.g. a tool_use block cut off by max_tokens: its search was started but is not wanted
+                for task in tasks.values():
+                    task.cancel()   # still queued: never runs; already running: result dropped
+                break
+
+            yield {"type": "discard"}
+            calls = conv.tool_calls(response)
+            for block in calls:
+                if block.id not in tasks:   # not seen while streaming
+                    trace = conv.trace(block.name, block.input)
+                    tasks[block.id] = loop.run_in_executor(self.pool, self._run_tool, block.name, block.input)
+                    yield {"type": "tool", **trace}
+            t0      = time.perf_counter()
+            results = await asyncio.gather(*(tasks[b.id] for b in calls))
+            conv.add_results(calls, results, time.perf_counter() - t0)
+
+        result = conv.result()
+        METRICS.observe("rag_agent_seconds", result["elapsed_s"], outcome=result["stop"])
+        yield {"type": "done", **result}
@@ -0,0 +1,87 @@
+# ============================================================
+# answer_cache.py — persistent whole-answer cache for run_agent
+#
+# SQLite file shared by every worker on the host. The key covers
+# everything that can change an answer: normalized question, model,
+# system prompt, tool schema and corpus version. Values hold the
+# answer plus chunks and trace_lines so render_sources() works on a
+# hit. Least-recently-used rows are evicted once the stored payload
+# exceeds max_bytes. Hit/miss counters live in the same file.
+# ============================================================
+
+import hashlib, json, sqlite3, time
+from contextlib import contextmanager
+
+from query_cache import normalize_query
+
+
+class AnswerCache:
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        self.path      = path
+        self.max_bytes = max_bytes
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS answers (
+                              key       TEXT PRIMARY KEY,
+                              question  TEXT,
+                              value     TEXT NOT NULL,
+                              size      INTEGER NOT NULL,
+                              created   REAL NOT NULL,
+                              last_used REAL NOT NULL)""")
+            db.execute("CREATE INDEX IF NOT EXISTS answers_lru ON answers(last_used)")
+            db.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, n INTEGER NOT NULL)")
+            db.execute("INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            with db:   # commit / rollback
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def make_key(question, model, system_prompt, tools, corpus_version):
+        parts = [
+            normalize_query(question),
+            model,
+            hashlib.sha256(system_prompt.encode()).hexdigest(),
+            json.dumps(tools, sort_keys=True),
+            str(corpus_version),
+        ]
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def get(self, key):
+        with self._connect() as db:
+            row = db.execute("SELECT value FROM answers WHERE key = ?", (key,)).fetchone()
+            db.execute("UPDATE stats SET n = n + 1 WHERE name = ?", ("hits" if row else "misses",))
+            if row is None:
+                return None
+            db.execute("UPDATE answers SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, question, value):
+        blob = json.dumps(value)
+        now  = time.time()
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                       (key, question, blob, len(blob), now, now))
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+            for k, size in db.execute("SELECT key, size FROM answers ORDER BY last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM answers WHERE key = ?", (k,))
+                total -= size
+
+    def stats(self):
+        with self._connect() as db:
+            n       = dict(db.execute("SELECT name, n FROM stats").fetchall())
+            entries = db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        total = n.get("hits", 0) + n.get("misses", 0)
+        return {
+            "entries":  entries,
+            "hits":     n.get("hits", 0),
+            "misses":   n.get("misses", 0),
+            "hit_rate": n.get("hits", 0) / total if total else 0.0,
+        }
@@ -5,20 +5,34 @@
 #   .env:
 #       ANTHROPIC_API_KEY=sk-ant-...
 #       LANGCHAIN_API_KEY=ls__...   (optional)
-#   pip install streamlit anthropic chromadb sentence-transformers rank_bm25 langsmith python-dotenv
+#   pip install streamlit anthropic chromadb sentence-transformers numpy langsmith python-dotenv
 #   streamlit run app.py
+#
+#   RAG_SERVICE_URL=http://127.0.0.1:8700 streamlit run app.py
+#       thin client of service.py: no models or indexes load here
 # ============================================================
 
-import os, re, time, uuid
+import os, json, time, uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional
 from dotenv import load_dotenv
 load_dotenv()
 
 import streamlit as st
 import anthropic
-import chromadb
-from chromadb.utils import embedding_functions
-from rank_bm25 import BM25Okapi
+
+from agent import (MAX_ITERATIONS, MODEL, SYSTEM_PROMPT, Conversation, fast_answer, record_tool_calls,
+                   usage_stats)
+from answer_cache import AnswerCache
+from metrics import METRICS, METRICS_FILE, METRICS_PORT, FileSink, serve
+from query_cache import QueryCache
+from routing import ModelRouting
+from samples import SAMPLE_QS
+from service_client import ServiceBusy, ServiceClient, ServiceError
+from singleflight import LeaderGone, SingleFlight
+from tools import TOOLS, chunk_key, item_label
+# retrieval, rerank and facts are imported by the local-mode resources below, so the thin
+# client (RAG_SERVICE_URL) runs without chromadb, torch or sentence-transformers
 
 # ── LangSmith ────────────────────────────────────────────────
 os.environ["LANGCHAIN_TRACING_V2"] = "true"
@@ -243,49 +257,14 @@ code {
 # CONSTANTS
 # ─────────────────────────────────────────────────────────────
 import os
-BASE_DIR    = os.path.dirname(os.path.abspath(__file__))
-CHROMA_PATH = os.path.join(BASE_DIR, "alphabet_10k_db")
-COLLECTION_NAME = "langchain"
-MODEL           = "claude-opus-4-5"
-
-TOOLS = [
-    {
-        "name": "text_search",
-        "description": "Search narrative 10-K sections: risk factors, MD&A, strategy, competition.",
-        "input_schema": {"type":"object","properties":{"query":{"type":"string"}},"required":["query"]},
-    },
-    {
-        "name": "table_search",
-        "description": "Search financial TABLES: income statement, balance sheet, cash flow, footnotes.",
-        "input_schema": {"type":"object","properties":{"query":{"type":"string"}},"required":["query"]},
-    },
-]
-
-SYSTEM_PROMPT = """You are a senior financial analyst specializing in SEC 10-K filings.
-You have access to Alphabet Inc.'s 2025 10-K filing through two search tools.
-
-Guidelines:
-- Quantitative questions (numbers, ratios): use table_search first.
-- Qualitative questions (risks, strategy): use text_search first.
-- Comparison questions: call BOTH tools before answering.
-- Always cite Source number, Item, and page in your final answer.
-- Never guess numbers — say so if tools return nothing useful.
-- Use markdown formatting with **bold** key numbers and clear headers."""
-
-SAMPLE_QS = [
-    "💰 What were total revenues for fiscal 2024?",
-    "🤖 What are the main AI competition risks?",
-    "💵 Is cash sufficient to cover long-term debt?",
-    "📈 What was Google Services operating income?",
-    "🧾 What are unrecognized tax benefits?",
-    "🏗️ What is the capex plan for 2025?",
-    "🔄 Share repurchase details for fiscal 2024?",
-    "📚 What does ASU 2016-13 refer to?",
-]
+BASE_DIR          = os.path.dirname(os.path.abspath(__file__))
+ANSWER_CACHE_PATH = os.path.join(BASE_DIR, "answer_cache.sqlite3")
+STREAMING         = os.environ.get("STREAMING", "1") != "0"   # stream agent turns token by token
+SERVICE_URL       = os.environ.get("RAG_SERVICE_URL", "").strip()   # set: questions go to service.py
 
 # ── color map for tool types ──────────────────────────────────
-TOOL_COLORS  = {"text_search": "#06b6d4",  "table_search": "#f59e0b"}
-TOOL_ICONS   = {"text_search": "🔍",        "table_search": "📊"}
+TOOL_COLORS  = {"text_search": "#06b6d4",  "table_search": "#f59e0b", "fact_lookup": "#22c55e"}
+TOOL_ICONS   = {"text_search": "🔍",        "table_search": "📊",   "fact_lookup": "⚡"}
 TYPE_COLORS  = {"text": "#06b6d4",          "table": "#f59e0b"}
 TYPE_ICONS   = {"text": "📝",               "table": "📊"}
 TYPE_LABELS  = {"text": "TEXT",             "table": "TABLE"}
@@ -295,15 +274,53 @@ TYPE_LABELS  = {"text": "TEXT",             "table": "TABLE"}
 # ─────────────────────────────────────────────────────────────
 @st.cache_resource(show_spinner="⚡ Loading retrieval engine…")
 def load_retriever():
-    client   = chromadb.PersistentClient(path=CHROMA_PATH)
-    embed_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name="BAAI/bge-m3", normalize_embeddings=True)
-    col = client.get_collection(name=COLLECTION_NAME, embedding_function=embed_fn)
-    res = col.get(include=["documents","metadatas"])
-    def _tok(t):
-        return re.sub(r"[^a-z0-9\s]"," ",t.lower()).split()
-    bm25 = BM25Okapi([_tok(d) for d in res["documents"]])
-    return col, bm25, res["documents"], res["metadatas"], _tok
+    # process-wide, like every cache_resource: embedding LRU, search cache and leg pool are shared
+    from retrieval import Retriever
+    return Retriever.load(query_cache=get_query_cache(), reranker=get_reranker(), leg_pool=get_leg_pool())
+
+@st.cache_resource
+def get_query_cache():
+    # process-wide: shared by every Streamlit session in this worker
+    return QueryCache(max_entries=512, ttl=900, sim_threshold=0.95)
+
+@st.cache_resource(show_spinner="⚡ Loading reranker…")
+def get_reranker():
+    from rerank import Reranker
+    from retrieval import RERANK, RERANK_BUDGET
+    return Reranker(budget=RERANK_BUDGET) if RERANK else None
+
+@st.cache_resource
+def get_answer_cache():
+    return AnswerCache(ANSWER_CACHE_PATH, max_bytes=64 * 1024 * 1024)
+
+@st.cache_resource
+def get_leg_pool():
+    from retrieval import TOOL_WORKERS
+    return ThreadPoolExecutor(max_workers=2 * TOOL_WORKERS, thread_name_prefix="leg")
+
+@st.cache_resource
+def start_metrics():
+    # once per process: METRICS itself is module-level, exporters must not be started per rerun
+    sinks = {}
+    if METRICS_PORT:
+        sinks["http"] = serve(METRICS_PORT)
+    if METRICS_FILE:
+        sinks["file"] = FileSink(METRICS_FILE)
+    return sinks
+
+@st.cache_resource(show_spinner="⚡ Loading table facts…")
+def get_fact_router():
+    from facts import FAST_PATH, FactRouter
+    return FactRouter.for_retriever(load_retriever()) if FAST_PATH else None
+
+@st.cache_resource
+def get_question_flight():
+    # process-wide, so concurrent sessions asking the same question share one agent loop
+    return SingleFlight("question")
+
+@st.cache_resource
+def get_service():
+    return ServiceClient(SERVICE_URL)
 
 @st.cache_resource
 def get_anthropic():
@@ -313,62 +330,31 @@ def get_anthropic():
         st.stop()
     return anthropic.Anthropic(api_key=key)
 
-collection, bm25, corpus_docs, corpus_meta, _tok = load_retriever()
-anthropic_client = get_anthropic()
-
-# ─────────────────────────────────────────────────────────────
-# RETRIEVAL
-# ─────────────────────────────────────────────────────────────
-def hybrid_search(query, content_type=None, top_n=5, fetch=20, k=60):
-    where = {"content_type": content_type} if content_type else None
-    kw    = dict(query_texts=[query],
-                 n_results=min(fetch, collection.count()),
-                 include=["documents","metadatas"])
-    if where:
-        kw["where"] = where
-    dr          = collection.query(**kw)
-    dense_docs  = dr["documents"][0]
-    dense_metas = dr["metadatas"][0]
-
-    tokens = _tok(query)
-    scores = bm25.get_scores(tokens)
-    sparse = sorted(
-        [(s,i) for i,(s,m) in enumerate(zip(scores,corpus_meta))
-         if not content_type or m.get("content_type")==content_type],
-        reverse=True)[:fetch]
-
-    rrf, rrf_data = {}, {}
-    for rank,(doc,meta) in enumerate(zip(dense_docs,dense_metas)):
-        key           = doc[:120]
-        rrf[key]      = rrf.get(key,0) + 1/(rank+k)
-        rrf_data[key] = {"content":doc,"metadata":meta}
-    for rank,(_,idx) in enumerate(sparse):
-        key           = corpus_docs[idx][:120]
-        rrf[key]      = rrf.get(key,0) + 1/(rank+k)
-        rrf_data[key] = {"content":corpus_docs[idx],"metadata":corpus_meta[idx]}
-
-    ranked = sorted(rrf, key=rrf.__getitem__, reverse=True)
-    return [rrf_data[k] for k in ranked[:top_n]]
-
-
-def execute_tool(name, tool_input):
-    q = tool_input["query"]
-    if name == "text_search":
-        chunks = hybrid_search(q, content_type="text", top_n=5) or hybrid_search(q, top_n=5)
-    elif name == "table_search":
-        chunks = hybrid_search(q, content_type="table", top_n=5) or hybrid_search(q, top_n=5)
-    else:
-        return f"Unknown tool: {name}", []
-    if not chunks:
-        return "No relevant content found.", []
-    parts = []
-    for i,c in enumerate(chunks,1):
-        m = c["metadata"]
-        parts.append(
-            f"[{i}] Item {m.get('item_number','?')} | "
-            f"page {m.get('page','?')} | {m.get('content_type','?')}\n"
-            f"{c['content'].strip()}")
-    return "\n\n---\n\n".join(parts), chunks
+service = get_service() if SERVICE_URL else None
+if service is None:
+    retriever        = load_retriever()
+    collection       = retriever.collection
+    embed_fn         = retriever.embed_fn
+    corpus_version   = retriever.corpus_version
+    query_cache      = retriever.query_cache
+    reranker         = retriever.reranker
+    hybrid_search, hybrid_search_batch = retriever.hybrid_search, retriever.hybrid_search_batch
+    execute_tools    = retriever.execute_tools
+    anthropic_client = get_anthropic()
+    answer_cache     = get_answer_cache()
+    question_flight  = get_question_flight()
+    fact_router      = get_fact_router()
+    routing          = ModelRouting()
+metrics_sinks    = start_metrics()
+
+def engine_stats():
+    """Index, cache and latency figures for the sidebar, from this process or from the service."""
+    if service is not None:
+        return service.stats()
+    engine = retriever.stats()
+    engine["coalesced"]["question"] = question_flight.stats()
+    return {**engine, "answer_cache": answer_cache.stats(), "latency": METRICS.summary(),
+            "cost": METRICS.counters("rag_llm_cost_usd_total")}
 
 # ─────────────────────────────────────────────────────────────
 # LANGSMITH
@@ -379,25 +365,25 @@ def ls_start(run_id, name, run_type, inputs, parent_id=None):
         ls_client.create_run(id=run_id, name=name, run_type=run_type,
                              project_name="alphabet-10k-rag",
                              inputs=inputs, parent_run_id=parent_id)
-    except Exception: pass
+    except Exception: METRICS.inc("rag_langsmith_errors_total", op="create")
 
 def ls_end(run_id, outputs=None):
     if not LANGSMITH_ON: return
     try:
         ls_client.update_run(run_id, outputs=outputs or {}, end_time=time.time())
-    except Exception: pass
+    except Exception: METRICS.inc("rag_langsmith_errors_total", op="update")
 
 # ─────────────────────────────────────────────────────────────
 # RAG SOURCES PANEL  — pure Streamlit, styled via CSS variables
 # ─────────────────────────────────────────────────────────────
-def render_sources(chunks: list, trace_lines: list, elapsed: float = None):
+def render_sources(chunks: list, trace_lines: list, elapsed: float = None, ttft: float = None):
     if not chunks and not trace_lines:
         return
 
     # deduplicate
     seen, unique = set(), []
     for c in chunks:
-        k = c["content"][:100]
+        k = chunk_key(c)
         if k not in seen:
             seen.add(k)
             unique.append(c)
@@ -405,6 +391,7 @@ def render_sources(chunks: list, trace_lines: list, elapsed: float = None):
     title = (
         f"🗂  {len(unique)} sources · {len(trace_lines)} searches"
         + (f" · ⚡ {elapsed}s" if elapsed else "")
+        + (f" · first token {ttft}s" if ttft else "")
     )
 
     with st.expander(title, expanded=True):
@@ -426,7 +413,7 @@ def render_sources(chunks: list, trace_lines: list, elapsed: float = None):
         for i, c in enumerate(unique, 1):
             m      = c["metadata"]
             ctype  = m.get("content_type", m.get("type","text"))
-            item   = m.get("item_number", m.get("section","—"))
+            item   = item_label(m.get("item_number")) or m.get("section","—")
             page   = m.get("page","—")
             prev   = c["content"][:300].replace("\n"," ").strip()
 
@@ -438,7 +425,7 @@ def render_sources(chunks: list, trace_lines: list, elapsed: float = None):
             r1.write(icon)
             r2.write(f"**Source {i}**")
             r3.write(f"`{label}`")
-            r4.caption(f"Item {item}")
+            r4.caption(item)
             r5.caption(f"pg {page}")
 
             # Preview as blockquote
@@ -455,86 +442,245 @@ def render_sources(chunks: list, trace_lines: list, elapsed: float = None):
 # ─────────────────────────────────────────────────────────────
 # AGENT LOOP
 # ─────────────────────────────────────────────────────────────
-def run_agent(question, status_ph, answer_ph):
-    messages    = [{"role":"user","content":question}]
-    iteration   = 0
-    all_chunks  = []
-    trace_lines = []
+def run_tools(calls, parent_id):
+    """The tool_use blocks of one turn through one batched execute_tools() call, with one LangSmith
+    child run per block."""
+    tids = [str(uuid.uuid4()) for _ in calls]
+    for tid, block in zip(tids, calls):
+        ls_start(tid, block.name, "tool", {"query":block.input.get("query",""),"tool":block.name},
+                 parent_id=parent_id)
+    t0      = time.perf_counter()
+    results = execute_tools(calls)
+    record_tool_calls(calls, time.perf_counter() - t0)
+    for tid, chunks in zip(tids, results):
+        ls_end(tid, outputs={"num_chunks":len(chunks),
+                             "timings":getattr(chunks, "timings", {}),
+                             "batch":len(calls)})
+    return results
+
+def draw_trace(status_ph, trace_lines):
+    with status_ph.container():
+        for tl in trace_lines:
+            icon = TOOL_ICONS.get(tl["tool"],"🔧")
+            st.write(f"{icon} `{tl['tool']}` → *\"{tl['query'][:70]}\"*")
+
+def stream_turn(conv, turn, status_ph, answer_ph):
+    """Stream one assistant turn (a routing.Turn) of an agent.Conversation. Text deltas render into
+    answer_ph as they arrive and each tool_use block is traced as soon as its input JSON is complete;
+    the tools run after the turn, in one batch. Returns (final message, timing dict)."""
+    blocks = {}
+    text, last_draw = "", 0.0
+    t0 = time.perf_counter()
+    t_first = t_text = None
+
+    with anthropic_client.messages.stream(**conv.request(turn)) as stream:
+        for event in stream:
+            if event.type == "content_block_start":
+                blocks[event.index] = {"block": event.content_block, "json": ""}
+            elif event.type == "content_block_delta":
+                t_first = t_first or time.perf_counter()
+                if event.delta.type == "text_delta":
+                    t_text = t_text or time.perf_counter()
+                    text  += event.delta.text
+                    if time.perf_counter() - last_draw > 0.05:
+                        answer_ph.markdown(text + " ▌")
+                        last_draw = time.perf_counter()
+                elif event.delta.type == "input_json_delta":
+                    blocks[event.index]["json"] += event.delta.partial_json
+            elif event.type == "content_block_stop":
+                b = blocks.get(event.index)
+                if b and b["block"].type == "tool_use":
+                    conv.trace(b["block"].name, json.loads(b["json"] or "{}"))
+                    draw_trace(status_ph, conv.trace_lines)
+        response = stream.get_final_message()
+
+    t_end = time.perf_counter()
+    gen   = t_end - (t_first or t_end)
+    timing = {
+        "ttft":         round((t_first or t_end) - t0, 3),
+        "ttft_text":    round(t_text - t0, 3) if t_text else None,
+        "tokens_per_s": round(response.usage.output_tokens / gen, 1) if gen > 0 else None,
+        "t_text":       t_text,
+    }
+    return response, timing
+
+def run_agent_remote(question, status_ph, answer_ph, stats):
+    """run_agent against service.py: renders its SSE events the way the local loop renders turns."""
+    trace_lines, text, last_draw = [], "", 0.0
+    t_start = time.perf_counter()
+    try:
+        for event in service.ask(question):
+            kind = event["type"]
+            if kind == "iteration":
+                draw_trace(status_ph, trace_lines)
+            elif kind == "text":
+                if stats["ttft"] is None:
+                    stats["ttft"] = round(time.perf_counter() - t_start, 3)
+                text += event["delta"]
+                if time.perf_counter() - last_draw > 0.05:
+                    answer_ph.markdown(text + " ▌")
+                    last_draw = time.perf_counter()
+            elif kind == "tool":
+                trace_lines.append({k: event[k] for k in ("iter", "tool", "query")})
+                draw_trace(status_ph, trace_lines)
+            elif kind == "discard":   # drop any streamed preamble ("Let me search…")
+                text = ""
+                answer_ph.empty()
+            elif kind == "done":
+                status_ph.empty()
+                if stats["ttft"] is None:
+                    stats["ttft"] = round(time.perf_counter() - t_start, 3)
+                stats.update(outcome=event["stop"], llm=event.get("llm", []))
+                with answer_ph.container():
+                    st.write(event["answer"])
+                return event["answer"], event["chunks"], event["trace_lines"]
+    except ServiceBusy as e:
+        status_ph.empty()
+        stats["outcome"] = "shed"
+        answer_ph.warning(f"The service is at capacity — try again in {e.retry_after:g}s.")
+        return "The service is at capacity; please retry shortly.", [], trace_lines
+    except ServiceError as e:
+        status_ph.empty()
+        stats["outcome"] = "error"
+        answer_ph.error(f"Service error: {e}")
+        return f"Service error: {e}", [], trace_lines
+    stats["outcome"] = "no_text"
+    return "No answer returned.", [], trace_lines
+
+def run_agent(question, status_ph, answer_ph, stats=None):
+    stats       = {} if stats is None else stats
+    t_start     = time.perf_counter()
+    stats.update(ttft=None, llm=[], outcome=None)
+    if service is not None:
+        return run_agent_remote(question, status_ph, answer_ph, stats)
 
     root_id = str(uuid.uuid4())
     ls_start(root_id, "10k_rag_agent", "chain", {"question": question})
 
-    while iteration < 8:
-        iteration += 1
-
+    # single-cell table lookups: answered from the fact store, no model call
+    fast = fast_answer(fact_router, question)
+    if fast:
+        status_ph.empty()
+        stats["ttft"] = round(time.perf_counter() - t_start, 3)
+        with answer_ph.container():
+            st.write(fast["answer"])
+        ls_end(root_id, outputs={"answer":fast["answer"][:400],"route":"fast_path"})
+        stats["outcome"] = "fast_path"
+        return fast["answer"], fast["chunks"], fast["trace_lines"]
+
+    cache_key = AnswerCache.make_key(question, routing.key, SYSTEM_PROMPT, TOOLS, corpus_version)
+    cached    = answer_cache.get(cache_key)
+    if cached:
+        status_ph.empty()
+        stats["ttft"] = round(time.perf_counter() - t_start, 3)
+        with answer_ph.container():
+            st.write(cached["answer"])
+        ls_end(root_id, outputs={"answer":cached["answer"][:400],"cache":"hit"})
+        stats["outcome"] = "cache_hit"
+        return cached["answer"], cached["chunks"], cached["trace_lines"]
+
+    # the same question already running in another session: wait for its answer instead of a second loop
+    if question_flight.in_flight(cache_key):
+        status_ph.info("⏳ This question is already being answered in another session — sharing that answer…")
+    args = (question, status_ph, answer_ph, stats, root_id, cache_key, t_start)
+    try:
+        (answer, chunks, trace_lines), shared = question_flight.do(cache_key, agent_loop, *args)
+    except LeaderGone:   # that session was rerun or closed mid-answer
+        (answer, chunks, trace_lines), shared = question_flight.do(cache_key, agent_loop, *args)
+    if shared:
+        status_ph.empty()
+        stats.update(ttft=round(time.perf_counter() - t_start, 3), outcome="coalesced")
+        with answer_ph.container():
+            st.write(answer)
+        ls_end(root_id, outputs={"answer":answer[:400],"coalesced":True})
+    return answer, chunks, trace_lines
+
+def agent_loop(question, status_ph, answer_ph, stats, root_id, cache_key, t_start):
+    """agent.Conversation with the UI: streamed turns, live tool trace and LangSmith runs."""
+    conv = Conversation(question, routing, MAX_ITERATIONS)
+    stats["llm"] = conv.llm
+
+    for turn in conv.turns():
+        iteration = conv.iteration
         with status_ph.container():
             st.spinner(f"Thinking… iteration {iteration}")
-            for tl in trace_lines:
+            for tl in conv.trace_lines:
                 icon = TOOL_ICONS.get(tl["tool"], "🔧")
                 st.write(f"{icon} `{tl['tool']}` → *\"{tl['query'][:70]}\"*")
 
         llm_id = str(uuid.uuid4())
         ls_start(llm_id, f"llm_{iteration}", "llm",
-                 {"model":MODEL, "iteration":iteration}, parent_id=root_id)
-
-        response = anthropic_client.messages.create(
-            model=MODEL, max_tokens=4096,
-            system=SYSTEM_PROMPT, tools=TOOLS, messages=messages)
-        messages.append({"role":"assistant","content":response.content})
-
-        ls_end(llm_id, outputs={
-            "stop_reason":   response.stop_reason,
-            "input_tokens":  response.usage.input_tokens,
-            "output_tokens": response.usage.output_tokens,
-        })
-
-        if response.stop_reason == "end_turn":
-            status_ph.empty()
-            for block in response.content:
-                if hasattr(block, "text"):
-                    with answer_ph.container():
-                        st.write(block.text)
-                    ls_end(root_id, outputs={"answer":block.text[:400],"iterations":iteration})
-                    return block.text, all_chunks, trace_lines
-            ls_end(root_id, outputs={"answer":"none"})
-            return "No answer returned.", all_chunks, trace_lines
-
-        if response.stop_reason == "tool_use":
-            tool_results = []
-            for block in response.content:
-                if block.type == "tool_use":
-                    q = block.input.get("query","")
-                    trace_lines.append({"iter":iteration,"tool":block.name,"query":q})
-
-                    with status_ph.container():
-                        for tl in trace_lines:
-                            icon = TOOL_ICONS.get(tl["tool"],"🔧")
-                            st.write(f"{icon} `{tl['tool']}` → *\"{tl['query'][:70]}\"*")
-
-                    tid = str(uuid.uuid4())
-                    ls_start(tid, block.name, "tool",
-                             {"query":q,"tool":block.name}, parent_id=root_id)
-
-                    result_str, chunks = execute_tool(block.name, block.input)
-                    all_chunks.extend(chunks)
-                    ls_end(tid, outputs={"num_chunks":len(chunks)})
-
-                    tool_results.append({
-                        "type":"tool_result",
-                        "tool_use_id":block.id,
-                        "content":result_str,
-                    })
-            messages.append({"role":"user","content":tool_results})
+                 {"model":turn.model, "iteration":iteration}, parent_id=root_id)
+
+        t_turn = time.perf_counter()
+        if STREAMING:
+            response, timing = stream_turn(conv, turn, status_ph, answer_ph)
+            t_text = timing.pop("t_text")
+            if stats["ttft"] is None and t_text:
+                stats["ttft"] = round(t_text - t_start, 3)
+            METRICS.observe("rag_llm_ttft_seconds", timing["ttft"], model=turn.model)
         else:
+            response = anthropic_client.messages.create(**conv.request(turn))
+            timing = {}
+        route = conv.settle(turn, response, time.perf_counter() - t_turn, **timing)
+        ls_end(llm_id, outputs={"stop_reason":response.stop_reason, "route":route,
+                                **usage_stats(response.usage), **timing})
+        if route != "select":   # answered: conv.done
             break
 
-    ls_end(root_id, outputs={"answer":"max_iterations"})
-    return "Max iterations reached.", all_chunks, trace_lines
+        calls = conv.tool_calls(response)
+        answer_ph.empty()   # drop any streamed preamble ("Let me search…")
+        if not STREAMING:   # stream_turn traced them as they arrived
+            for block in calls:
+                conv.trace(block.name, block.input)
+        draw_trace(status_ph, conv.trace_lines)
+        # every search of the turn in one batch (Retriever.execute_tools), results in tool_use order
+        conv.add_results(calls, run_tools(calls, root_id))
+
+    stats["outcome"] = conv.stop
+    if conv.stop != "end_turn":
+        ls_end(root_id, outputs={"answer":conv.stop})
+        return conv.answer, conv.chunks, conv.trace_lines
+    status_ph.empty()
+    if stats["ttft"] is None:
+        stats["ttft"] = round(time.perf_counter() - t_start, 3)
+    with answer_ph.container():
+        st.write(conv.answer)
+    answer_cache.put(cache_key, question, {
+        "answer": conv.answer, "chunks": conv.chunks, "trace_lines": conv.trace_lines})
+    ls_end(root_id, outputs={"answer":conv.answer[:400],"iterations":conv.iteration,
+                             "ttft":stats["ttft"]})
+    return conv.answer, conv.chunks, conv.trace_lines
+
+# ─────────────────────────────────────────────────────────────
+# LATENCY PANEL HELPERS
+# ─────────────────────────────────────────────────────────────
+PANEL_SERIES = [("rag_stage_seconds", "stage="), ("rag_llm_ttft_seconds", "ttft "),
+                ("rag_llm_iteration_seconds", "llm "), ("rag_tool_call_seconds", "tool "),
+                ("rag_render_seconds", "render "), ("rag_agent_seconds", "agent ")]
+
+def fmt_secs(v):
+    if v is None:
+        return "—"
+    return f"{v*1000:.0f} ms" if v < 1 else f"{v:.2f} s"
+
+def series_p50(lat, name):
+    """p50 of the busiest label set of a histogram (one model in practice)."""
+    series = lat.get(name, {})
+    return max(series.values(), key=lambda s: s["count"])["p50"] if series else None
+
+def latency_rows(lat):
+    rows = []
+    for name, prefix in PANEL_SERIES:
+        for labels, s in sorted(lat.get(name, {}).items()):
+            value = " ".join(pair.split("=", 1)[-1] for pair in labels.split(",")) if labels else ""
+            rows.append(((value if prefix == "stage=" else f"{prefix}{value}").strip(), s))
+    return rows
 
 # ─────────────────────────────────────────────────────────────
 # SESSION STATE
 # ─────────────────────────────────────────────────────────────
-for k, v in [("messages",[]),("total_queries",0),("total_tools",0),("total_chunks",0)]:
+for k, v in [("messages",[]),("total_queries",0),("total_tools",0),("total_chunks",0),("total_cost",0.0)]:
     if k not in st.session_state:
         st.session_state[k] = v
 
@@ -597,7 +743,34 @@ with st.sidebar:
     st.markdown("<p style='font-family:Space Mono,monospace;font-size:.62rem;"
                 "color:#6b6b8a;text-transform:uppercase;letter-spacing:.1em;"
                 "margin:0 0 8px 0'>Index</p>", unsafe_allow_html=True)
-    st.metric("Chunks", f"{collection.count():,}")
+    try:
+        engine = engine_stats()
+    except ServiceError as e:
+        st.error(f"Service unavailable: {e}")
+        engine = None
+    if engine:
+        st.metric("Chunks", f"{engine['chunks']:,}")
+        qc = engine["search_cache"]
+        st.metric("Search cache", f"{qc['hit_rate']:.0%}",
+                  help=f"{qc['hits_exact']} exact · {qc['hits_semantic']} semantic · "
+                       f"{qc['misses']} misses · {qc['entries']} entries")
+        ac = engine["answer_cache"]
+        st.metric("Answer cache", f"{ac['hit_rate']:.0%}",
+                  help=f"{ac['hits']} hits · {ac['misses']} misses · {ac['entries']} answers stored")
+        ec = engine["embedding_cache"]
+        st.metric("Embedding cache", f"{ec['hit_rate']:.0%}",
+                  help=f"{ec['hits']} hits · {ec['misses']} embedded · {ec['entries']} query vectors")
+    if engine:
+        co = engine["coalesced"]
+        st.metric("Coalesced", f"{co['question']['coalesced'] + co['tool']['coalesced']:,}",
+                  help=f"{co['question']['coalesced']} of {co['question']['calls']} questions and "
+                       f"{co['tool']['coalesced']} of {co['tool']['calls']} tool calls joined an "
+                       f"identical request already in flight")
+    if engine and engine["rerank_cache"]:
+        rc = engine["rerank_cache"]
+        st.metric("Rerank cache", f"{rc['hit_rate']:.0%}",
+                  help=f"{rc['hits']} hits · {rc['misses']} scored · {rc['fallbacks']} budget fallbacks "
+                       f"(RRF order) · {rc['entries']} pair scores")
 
     st.markdown("<p style='font-family:Space Mono,monospace;font-size:.62rem;"
                 "color:#6b6b8a;text-transform:uppercase;letter-spacing:.1em;"
@@ -605,7 +778,38 @@ with st.sidebar:
     c1, c2 = st.columns(2)
     c1.metric("Queries",    st.session_state.total_queries)
     c2.metric("Tools",      st.session_state.total_tools)
-    st.metric("Chunks hit", st.session_state.total_chunks)
+    c1, c2 = st.columns(2)
+    c1.metric("Chunks hit", st.session_state.total_chunks)
+    c2.metric("Model cost", f"${st.session_state.total_cost:.3f}",
+              help="list-price spend of this session's model turns (routing.PRICES)")
+
+    # ── Latency (process-wide histograms, see metrics.py) ────
+    st.markdown("<p style='font-family:Space Mono,monospace;font-size:.62rem;"
+                "color:#6b6b8a;text-transform:uppercase;letter-spacing:.1em;"
+                "margin:8px 0'>Latency</p>", unsafe_allow_html=True)
+    lat = engine["latency"] if engine else {}
+    c1, c2 = st.columns(2)
+    c1.metric("LLM turn p50", fmt_secs(series_p50(lat, "rag_llm_iteration_seconds")))
+    c2.metric("Search p50",   fmt_secs(lat.get("rag_stage_seconds", {}).get("stage=total", {}).get("p50")))
+    rows = latency_rows(lat)
+    if rows:
+        with st.expander("Per stage · p50 / p95"):
+            st.markdown("| stage | n | p50 | p95 |\n|---|---:|---:|---:|\n" + "\n".join(
+                f"| {label} | {s['count']} | {fmt_secs(s['p50'])} | {fmt_secs(s['p95'])} |"
+                for label, s in rows))
+    cost = engine["cost"] if engine else {}
+    if cost:
+        with st.expander(f"Model cost · ${sum(cost.values()):.2f}"):
+            st.markdown("| model · route | $ |\n|---|---:|\n" + "\n".join(
+                f"| {' · '.join(p.split('=', 1)[-1] for p in labels.split(','))} | {v:.3f} |"
+                for labels, v in sorted(cost.items())))
+    sinks = []
+    if "http" in metrics_sinks:
+        sinks.append(f"Prometheus on :{METRICS_PORT}/metrics")
+    if "file" in metrics_sinks:
+        sinks.append(f"writing {os.path.basename(METRICS_FILE)}")
+    if sinks:
+        st.caption(" · ".join(sinks))
 
     st.divider()
 
@@ -619,7 +823,7 @@ with st.sidebar:
 
     st.divider()
     if st.button("🗑  Clear chat", use_container_width=True):
-        for k in ["messages","total_queries","total_tools","total_chunks"]:
+        for k in ["messages","total_queries","total_tools","total_chunks","total_cost"]:
             st.session_state[k] = [] if k=="messages" else 0
         st.rerun()
 
@@ -708,7 +912,8 @@ for msg in st.session_state.messages:
         with st.chat_message("assistant"):
             st.write(msg["content"])
         if msg.get("chunks"):
-            render_sources(msg["chunks"], msg.get("trace_lines",[]))
+            with METRICS.time("rag_render_seconds", part="history"):
+                render_sources(msg["chunks"], msg.get("trace_lines",[]))
 
 # ─────────────────────────────────────────────────────────────
 # INPUT BAR
@@ -740,14 +945,19 @@ if submitted and user_input.strip():
     status_ph = st.empty()
     answer_ph = st.empty()
 
-    t0 = time.time()
-    answer, chunks, trace_lines = run_agent(question, status_ph, answer_ph)
-    elapsed = round(time.time() - t0, 1)
+    t0 = time.perf_counter()
+    run_stats = {}
+    answer, chunks, trace_lines = run_agent(question, status_ph, answer_ph, stats=run_stats)
+    elapsed = round(time.perf_counter() - t0, 1)
+    METRICS.observe("rag_agent_seconds", time.perf_counter() - t0,
+                    outcome=run_stats.get("outcome") or "stopped")
 
     st.session_state.total_tools  += len(trace_lines)
     st.session_state.total_chunks += len(chunks)
+    st.session_state.total_cost   += sum(t.get("cost_usd", 0.0) for t in run_stats.get("llm", []))
 
-    render_sources(chunks, trace_lines, elapsed=elapsed)
+    with METRICS.time("rag_render_seconds", part="sources"):
+        render_sources(chunks, trace_lines, elapsed=elapsed, ttft=run_stats.get("ttft"))
 
     st.session_state.messages.append({
         "role":        "assistant",
@@ -0,0 +1,232 @@
+# ============================================================
+# bench.py — offline retrieval benchmark
+#
+#   python bench.py                                  # golden + samples + synthetic, c = 1 2 4 8
+#   python bench.py --synthetic 500 --concurrency 1 4 16
+#   python bench.py --compare eval/results/<older>.json
+#
+# Drives Retriever.hybrid_search / execute_tool (everything run_agent
+# does between model turns) with three workloads:
+#   golden     eval/golden.json questions; recall@k is the share of a
+#              question's evidence facts found in the top k, MRR the
+#              reciprocal rank of the first chunk supporting any of them
+#   samples    the app's sample questions, samples.py (latency only)
+#   synthetic  first sentence of random chunks; the source chunk is the
+#              one relevant result (known-item recall@k / MRR)
+# Reports p50/p95/p99 per stage (embed, dense, sparse, fusion, rerank,
+# total) on cold caches, and throughput at several concurrencies, and
+# writes everything as JSON under eval/results/ for comparison across
+# commits. No LLM is involved, so no API key or network is needed.
+# ============================================================
+
+import argparse, json, os, platform, subprocess, sys, time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from embedding import first_sentence
+from retrieval import STAGES, Retriever
+from samples import sample_questions
+
+BASE_DIR    = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_PATH = os.path.join(BASE_DIR, "eval", "golden.json")
+RESULTS_DIR = os.path.join(BASE_DIR, "eval", "results")
+
+
+def latency_summary(secs):
+    secs = np.asarray(secs, dtype=float)
+    if not len(secs):
+        return {"n": 0}
+    return {
+        "n":       int(len(secs)),
+        "mean_ms": float(secs.mean() * 1000),
+        "p50_ms":  float(np.percentile(secs, 50) * 1000),
+        "p95_ms":  float(np.percentile(secs, 95) * 1000),
+        "p99_ms":  float(np.percentile(secs, 99) * 1000),
+    }
+
+
+def supports(chunk, evidence):
+    """True when the chunk contains every evidence string and matches its metadata fields."""
+    text = chunk["content"].lower()
+    meta = chunk["metadata"]
+    return (all(s.lower() in text for s in evidence["contains"])
+            and all(meta.get(f) == v for f, v in evidence.items() if f != "contains"))
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=BASE_DIR,
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+class Bench:
+    def __init__(self, retriever, ks=(1, 3, 5, 10), fetch=20):
+        self.retriever = retriever
+        self.ks        = sorted(ks)
+        self.fetch     = fetch
+        self.stages    = {s: [] for s in STAGES}
+
+    def cold(self):
+        """Drop every cache the retriever has, so each timed search pays for every stage."""
+        self.retriever.query_cache.clear()
+        self.retriever.embed_fn.clear()
+        if self.retriever.reranker is not None:
+            self.retriever.reranker.clear()
+
+    def search(self, query, **kw):
+        self.cold()
+        result = self.retriever.hybrid_search(query, top_n=self.ks[-1], fetch=max(self.fetch, self.ks[-1]), **kw)
+        for stage in STAGES:
+            if stage in result.timings:
+                self.stages[stage].append(result.timings[stage])
+        return result
+
+    # ── quality ───────────────────────────────────────────────
+    def golden(self, questions):
+        recall = {k: [] for k in self.ks}
+        rr     = []
+        per_q  = []
+        for q in questions:
+            chunks = self.search(q["question"])
+            found  = [[supports(c, e) for e in q["evidence"]] for c in chunks]
+            for k in self.ks:
+                hit = [any(row[j] for row in found[:k]) for j in range(len(q["evidence"]))]
+                recall[k].append(sum(hit) / len(hit))
+            first = next((r for r, row in enumerate(found, 1) if any(row)), None)
+            rr.append(1.0 / first if first else 0.0)
+            per_q.append({"id": q["id"], "first_relevant_rank": first,
+                          "degraded": chunks.degraded})
+        return {"questions": len(questions), "mrr": float(np.mean(rr)) if rr else 0.0,
+                **{f"recall@{k}": float(np.mean(v)) if v else 0.0 for k, v in recall.items()},
+                "per_question": per_q}
+
+    def synthetic(self, n, seed=0):
+        snap    = self.retriever.snapshot
+        rng     = np.random.default_rng(seed)
+        picks   = rng.choice(len(snap.ids), size=min(n, len(snap.ids)), replace=False)
+        queries = [first_sentence(snap.docs[int(i)]) for i in picks]
+        hits    = {k: [] for k in self.ks}
+        rr      = []
+        for i, q in zip(picks, queries):
+            ids  = [c["id"] for c in self.search(q)]
+            rank = ids.index(snap.ids[int(i)]) + 1 if snap.ids[int(i)] in ids else None
+            for k in self.ks:
+                hits[k].append(rank is not None and rank <= k)
+            rr.append(1.0 / rank if rank else 0.0)
+        return [(q, snap.metas[int(i)].get("content_type")) for i, q in zip(picks, queries)], {
+            "queries": len(queries), "mrr": float(np.mean(rr)) if rr else 0.0,
+            **{f"recall@{k}": float(np.mean(v)) if v else 0.0 for k, v in hits.items()}}
+
+    # ── throughput ────────────────────────────────────────────
+    def throughput(self, calls, concurrencies):
+        """calls: [(tool name, query)] replayed through execute_tool at each concurrency."""
+        def one(call):
+            t0 = time.perf_counter()
+            self.retriever.execute_tool(call[0], {"query": call[1]})
+            return time.perf_counter() - t0
+
+        rows = []
+        for c in concurrencies:
+            self.cold()
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=c) as pool:
+                secs = list(pool.map(one, calls))
+            wall = time.perf_counter() - t0
+            rows.append({"concurrency": c, "calls": len(calls), "wall_s": wall,
+                         "qps": len(calls) / wall if wall else 0.0, **latency_summary(secs)})
+        return rows
+
+
+def compare(current, previous):
+    """Print p50/p95 per stage and quality metrics side by side with an older result file."""
+    print(f"\nvs {previous['meta'].get('commit', '?')}:")
+    for stage, now in current["stages"].items():
+        old = previous.get("stages", {}).get(stage, {})
+        for p in ("p50_ms", "p95_ms"):
+            if p in now and p in old:
+                print(f"  {stage:<8} {p:<7} {old[p]:9.2f} -> {now[p]:9.2f} ms  ({now[p] - old[p]:+.2f})")
+    for name, now in current["quality"].items():
+        old = previous.get("quality", {}).get(name, {})
+        for metric, value in now.items():
+            if isinstance(value, float) and isinstance(old.get(metric), float):
+                print(f"  {name:<9} {metric:<9} {old[metric]:.4f} -> {value:.4f}  ({value - old[metric]:+.4f})")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline retrieval benchmark (latency, recall@k, MRR, throughput).")
+    ap.add_argument("--golden",      default=GOLDEN_PATH)
+    ap.add_argument("--synthetic",   type=int, default=200, help="known-item queries drawn from chunks")
+    ap.add_argument("--k",           type=int, nargs="+", default=[1, 3, 5, 10])
+    ap.add_argument("--fetch",       type=int, default=20)
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    ap.add_argument("--out",         help="result file (default eval/results/<time>-<commit>.json)")
+    ap.add_argument("--compare",     help="earlier result file to diff against")
+    args = ap.parse_args(argv)
+
+    with open(args.golden) as f:
+        golden = json.load(f)
+
+    t0        = time.perf_counter()
+    retriever = Retriever.load()
+    load_s    = time.perf_counter() - t0
+    bench     = Bench(retriever, args.k, args.fetch)
+
+    quality = {"golden": bench.golden(golden["questions"])}
+    synth, quality["synthetic"] = bench.synthetic(args.synthetic)
+    samples = sample_questions()
+    for q in samples:
+        bench.search(q)
+
+    calls  = [(q["tool"], q["question"]) for q in golden["questions"]]
+    calls += [("text_search", q) for q in samples]
+    calls += [("table_search" if ct == "table" else "text_search", q) for q, ct in synth]
+    result = {
+        "meta": {
+            "commit":        git_commit(),
+            "timestamp":     time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python":        platform.python_version(),
+            "machine":       platform.machine(),
+            "cpus":          os.cpu_count(),
+            "chunks":        len(retriever.snapshot.ids),
+            "embed_backend": retriever.embed_fn.embedder.backend,
+            "rerank":        retriever.reranker is not None,
+            "exact_dense":   retriever.exact_index is not None,
+            "load_s":        load_s,
+            "ks":            args.k,
+            "fetch":         args.fetch,
+        },
+        "stages":     {s: latency_summary(v) for s, v in bench.stages.items() if v},
+        "quality":    quality,
+        "throughput": bench.throughput(calls, args.concurrency),
+    }
+
+    print(f"{result['meta']['chunks']:,} chunks · {result['meta']['embed_backend']} · "
+          f"rerank {'on' if result['meta']['rerank'] else 'off'} · "
+          f"{'exact' if result['meta']['exact_dense'] else 'hnsw'} dense · load {load_s:.1f}s")
+    for stage, s in result["stages"].items():
+        print(f"  {stage:<8} n={s['n']:<5} p50 {s['p50_ms']:8.2f}  p95 {s['p95_ms']:8.2f}  p99 {s['p99_ms']:8.2f} ms")
+    for name, q in quality.items():
+        ks = "  ".join(f"R@{k} {q[f'recall@{k}']:.3f}" for k in args.k)
+        print(f"  {name:<9} MRR {q['mrr']:.3f}  {ks}")
+    for row in result["throughput"]:
+        print(f"  c={row['concurrency']:<3} {row['qps']:8.1f} calls/s  p50 {row['p50_ms']:8.2f}  "
+              f"p95 {row['p95_ms']:8.2f}  p99 {row['p99_ms']:8.2f} ms")
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{result['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"wrote {out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
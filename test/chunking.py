@@ -0,0 +1,172 @@
+# ============================================================
+# chunking.py — content-aware 10-K chunking
+#
+#   tables  kept intact, prefixed with the preceding paragraph:
+#           "Table Heading: {context}\n\n{table}"
+#   text    split at # / ## headers (as MarkdownHeaderTextSplitter
+#           with strip_headers), then RecursiveCharacterTextSplitter
+#           (1000, overlap 100). Headers are walked here rather than in
+#           the splitter because it drops headers with no body, e.g.
+#           "## ITEM 1. BUSINESS" directly above "## Overview".
+# scan_blocks() is a single line-oriented pass (a table is a run of
+# lines that start and end with "|"), so chunking is linear-time and
+# streams from a file handle; it replaces the backtracking regex
+# r'(\|.*\|(?:\n\|.*\|)*)' over the whole document.
+# Every chunk carries content_type, item_number, page (start page of
+# its Item, from the filing's table of contents), section and source,
+# plus the filing key (ticker, fiscal_year, form_type) when known, so
+# many filings and companies share one collection and are selected by
+# metadata filter.
+# Chunk ids hash filing + source + content, so unchanged chunks keep
+# their id across re-ingests and only new or edited chunks need embedding.
+# ============================================================
+
+import hashlib, os, re
+from collections import deque
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+HEADER_RE = re.compile(r'^#{1,2}\s+(.+?)\s*$')
+ITEM_RE   = re.compile(r'^ITEM\s+(\d+[A-Z]?)\.', re.I)
+TOC_RE    = re.compile(r'^\|\s*Item\s+(\d+[A-Z]?)\.\s*\|.*\|\s*(\d+)\s*\|\s*$', re.I | re.M)
+
+CHUNK_SIZE    = 1000
+CHUNK_OVERLAP = 100
+FILING_FIELDS = ("ticker", "fiscal_year", "form_type")
+
+
+def toc_pages(markdown):
+    """{"1A": "9", ...} from the table-of-contents rows; first occurrence wins."""
+    pages = {}
+    for item, page in TOC_RE.findall(markdown):
+        pages.setdefault(item.upper(), page)
+    return pages
+
+
+def chunk_id(source, content, n, filing=None):
+    # n disambiguates identical chunks (boilerplate) within one source
+    key = "\0".join(str((filing or {}).get(f, "")) for f in FILING_FIELDS)
+    return hashlib.sha1(f"{key}\0{source}\0{content}\0{n}".encode()).hexdigest()
+
+
+class _Position:
+    """Item / section state carried across text and table segments in document order."""
+    def __init__(self, pages, filing=None):
+        self.pages   = pages
+        self.filing  = {f: filing[f] for f in FILING_FIELDS if (filing or {}).get(f) not in (None, "")}
+        self.item    = None
+        self.section = ""
+
+    def header(self, text):
+        self.section = re.sub(r"\s+", " ", text).strip()
+        m = ITEM_RE.match(self.section)
+        if m:
+            self.item = m.group(1).upper()
+
+    def metadata(self, content_type, source):
+        return {
+            "content_type": content_type,
+            "item_number":  f"Item {self.item}" if self.item else "",
+            "page":         self.pages.get(self.item, ""),
+            "section":      self.section,
+            "source":       source,
+            **self.filing,
+        }
+
+
+def _is_table_row(stripped):
+    return len(stripped) > 1 and stripped[0] == "|" and stripped[-1] == "|"
+
+
+def scan_blocks(lines):
+    """Single linear pass over markdown lines (no backtracking regex, O(1) state besides the block
+    being built). Yields ("header", text), ("body", text) and ("table", text, context) in order;
+    context is the preceding paragraph, plus the one before when that is only a unit line."""
+    body, table, para = [], [], []
+    paras   = deque(maxlen=2)   # last two paragraphs since the previous table
+    context = ""
+    for raw in lines:
+        line     = raw.rstrip("\r\n")
+        stripped = line.strip()
+        if _is_table_row(stripped):
+            if not table:
+                if body:
+                    yield ("body", "\n".join(body))
+                    body = []
+                if para:
+                    paras.append("\n".join(para))
+                    para = []
+                context = _context(paras)
+            table.append(line)
+            continue
+        if table:
+            yield ("table", "\n".join(table), context)
+            table = []
+            paras.clear()
+
+        m = HEADER_RE.match(line)
+        if m:
+            if body:
+                yield ("body", "\n".join(body))
+                body = []
+            if para:
+                paras.append("\n".join(para))
+                para = []
+            paras.append(m.group(1))
+            yield ("header", m.group(1))
+            continue
+
+        body.append(line)
+        if stripped:
+            para.append(stripped)
+        elif para:
+            paras.append("\n".join(para))
+            para = []
+
+    if table:
+        yield ("table", "\n".join(table), context)
+    if body:
+        yield ("body", "\n".join(body))
+
+
+def _context(paras):
+    if not paras:
+        return ""
+    if len(paras[-1]) < 40 and len(paras) > 1:
+        return f"{paras[-2]} {paras[-1]}"
+    return paras[-1]
+
+
+def iter_chunks(lines, source, filing=None):
+    """Stream (id, content, metadata) chunks for one filing from an iterable of lines, so a
+    multi-megabyte filing never has to be held in memory as a whole. `filing` is
+    {"ticker", "fiscal_year", "form_type"}; its fields are copied into every chunk's metadata."""
+    pos      = _Position({}, filing)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    seen     = {}   # content hash -> occurrences, for chunk_id
+    for block in scan_blocks(lines):
+        kind = block[0]
+        if kind == "header":
+            pos.header(block[1])
+            continue
+        if kind == "table":
+            # the table of contents precedes every Item, so pages resolve as the scan reaches them
+            for item, page in toc_pages(block[1]).items():
+                pos.pages.setdefault(item, page)
+            pieces = [(f"Table Heading: {block[2]}\n\n{block[1]}", "table")]
+        else:
+            pieces = [(p, "text") for p in splitter.split_text(block[1])] if block[1].strip() else []
+        for content, content_type in pieces:
+            h = hashlib.sha1(content.encode()).digest()
+            n = seen[h] = seen.get(h, -1) + 1
+            yield chunk_id(source, content, n, filing), content, pos.metadata(content_type, source)
+
+
+def chunk_markdown(markdown, source, filing=None):
+    """Split one filing into [(id, content, metadata)] in document order."""
+    return list(iter_chunks(markdown.splitlines(), source, filing))
+
+
+def chunk_file(path, filing=None):
+    with open(path, encoding="utf-8") as f:
+        return path, list(iter_chunks(f, os.path.basename(path), filing))
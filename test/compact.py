@@ -0,0 +1,132 @@
+# ============================================================
+# compact.py — token-budgeted rendering of chunks for tool_result
+#
+# A table chunk as stored is a markdown table padded to column width,
+# with spanning headers repeated per column: most of its characters are
+# spaces, pipes and dashes. compact_table() drops the separator row,
+# the padding and columns that are empty in every row, blanks repeated
+# spanning-header cells and writes "$ 3,362" as "$3,362".
+# trim_text() sends a narrative chunk whole when it fits its token
+# budget; over budget it keeps the sentences that share the most words
+# with the query, in document order, with "…" for gaps. A table over
+# budget keeps its header rows and the body rows nearest the query;
+# one within budget is only compacted. The chunk header with Item and
+# page (tools.format_chunks) is never trimmed, so answers can still
+# cite every source. Token counts are estimated at ~4 characters per
+# token, as llm.py does; that is close enough for budgeting.
+# ============================================================
+
+import re
+
+from facts import SEP_CELL_RE, STOPWORDS
+from sparse_index import tokenize
+
+SENTENCE_RE = re.compile(r"(?<=[.!?;])\s+(?=[A-Z(\"'$])")
+CURRENCY_RE = re.compile(r"([$€£(])\s+(?=[\d.])")
+
+
+def approx_tokens(text):
+    return (len(text) + 3) // 4
+
+
+def query_terms(query):
+    return set(tokenize(query or "")) - STOPWORDS
+
+
+def _overlap(text, terms):
+    return len(set(tokenize(text)) & terms)
+
+
+def _cells(line):
+    return [c.strip() for c in line.strip().strip("|").split("|")]
+
+
+def _row(cells):
+    while cells and not cells[-1]:
+        cells = cells[:-1]
+    return " | ".join(cells)
+
+
+def compact_table(content, terms=frozenset(), budget=None):
+    """Heading line plus one " | "-joined line per row; body rows beyond `budget` tokens are
+    dropped, lowest query overlap first."""
+    heading, lines = [], []
+    for line in content.splitlines():
+        if line.lstrip().startswith("|"):
+            lines.append(line)
+        elif line.strip():
+            heading.append(line.strip().removeprefix("Table Heading:").strip())
+    rows = [_cells(l) for l in lines]
+    rows = [r for r in rows if not all(SEP_CELL_RE.fullmatch(c) or not c for c in r)]
+    if not rows:
+        return content.strip()
+    width = max(len(r) for r in rows)
+    rows  = [r + [""] * (width - len(r)) for r in rows]
+    keep  = [j for j in range(width) if any(r[j] for r in rows)]
+    rows  = [[CURRENCY_RE.sub(r"\1", " ".join(r[j].split())) for j in keep] for r in rows]
+
+    # header rows: the markdown header plus any following rows without a row label ("| | 2024 | 2025 |")
+    n_head = 1
+    while n_head < len(rows) and not rows[n_head][0]:
+        n_head += 1
+    for r in rows[:n_head]:   # spanning headers repeat in every column they span
+        for j in range(len(r) - 1, 0, -1):
+            if r[j] and r[j] == r[j - 1]:
+                r[j] = ""
+    head = [" ".join(heading)] if heading else []
+    head += [_row(r) for r in rows[:n_head]]
+    body = [_row(r) for r in rows[n_head:]]
+
+    if budget is not None:
+        used = approx_tokens("\n".join(head + body))
+        if used > budget:
+            spend  = approx_tokens("\n".join(head))
+            ranked = sorted(range(len(body)), key=lambda i: -_overlap(body[i], terms))   # stable
+            picked = set()
+            for i in ranked:
+                cost = approx_tokens(body[i]) + 1
+                if spend + cost > budget:
+                    break
+                picked.add(i)
+                spend += cost
+            omitted = len(body) - len(picked)
+            body    = [b for i, b in enumerate(body) if i in picked] + [f"… {omitted} more rows"]
+    return "\n".join(head + body)
+
+
+def trim_text(content, terms=frozenset(), budget=None):
+    """The whole text when it fits `budget` tokens; otherwise the sentences nearest the query (word
+    overlap, then position) within the budget, in document order; "…" marks each omitted stretch."""
+    text = " ".join(content.split())
+    if budget is None or approx_tokens(text) <= budget:
+        return text
+    sentences = [" ".join(s.split()) for s in SENTENCE_RE.split(content.strip())]
+    sentences = [s for s in sentences if s]
+    ranked = sorted(range(len(sentences)), key=lambda i: -_overlap(sentences[i], terms))   # stable
+    picked, spend = [], 0
+    for i in ranked:
+        cost = approx_tokens(sentences[i]) + 1
+        if picked and budget is not None and spend + cost > budget:
+            break
+        picked.append(i)
+        spend += cost
+    picked.sort()
+    if len(picked) == 1 and budget is not None and spend > budget:   # one very long sentence
+        return sentences[picked[0]][:4 * budget].rsplit(" ", 1)[0] + " …"
+    out, prev = [], -1
+    for i in picked:
+        if i != prev + 1:
+            out.append("…")
+        out.append(sentences[i])
+        prev = i
+    if prev != len(sentences) - 1:
+        out.append("…")
+    return " ".join(out)
+
+
+def compact_chunk(chunk, terms=frozenset(), budget=None):
+    """Chunk body for a tool_result: tables compacted, narrative trimmed to the query."""
+    content = chunk["content"]
+    if chunk["metadata"].get("content_type") == "table" or content.startswith("Table Heading:"):
+        return compact_table(content, terms, budget)
+    return trim_text(content, terms, budget)
@@ -0,0 +1,166 @@
+# ============================================================
+# dense_index.py — exact dense search and HNSW configuration
+#
+# Below EXACT_MAX_DOCS chunks the dense leg skips Chroma's HNSW graph
+# and scores a memory-mapped float32 embedding matrix (part of the
+# retriever snapshot) with one matrix multiply: exact, and at a few
+# thousand chunks faster than an approximate graph walk. Above the
+# threshold, or for an empty collection, the collection's HNSW index
+# is queried as before, with the parameters in HNSW_CONFIG:
+#   space            distance (BGE-M3 vectors are normalized, so l2,
+#                    cosine and inner product rank identically)
+#   M                graph degree
+#   construction_ef  candidate list size while building
+#   search_ef        candidate list size per query (recall vs latency)
+# M and construction_ef only apply when a collection is created;
+# ingest.py sets search_ef on an existing one (Chroma has no per-query
+# setting), so loading the retriever never writes the collection config.
+# Measure recall@k against exact search, and latency, per setting:
+#
+#   python dense_index.py --k 20 --ef 16 32 64 128 --M 8 16 32
+# ============================================================
+
+import argparse, json, os, sys, time
+
+import chromadb
+import numpy as np
+
+EXACT_MAX_DOCS = int(os.environ.get("EXACT_MAX_DOCS", "5000"))
+HNSW_CONFIG    = {
+    "space":           os.environ.get("HNSW_SPACE", "l2"),
+    "M":               int(os.environ.get("HNSW_M", "16")),
+    "construction_ef": int(os.environ.get("HNSW_CONSTRUCTION_EF", "200")),
+    "search_ef":       int(os.environ.get("HNSW_SEARCH_EF", "64")),
+}
+
+
+def hnsw_metadata(config=HNSW_CONFIG):
+    """Collection metadata that sets the HNSW parameters at creation."""
+    return {f"hnsw:{name}": value for name, value in config.items()}
+
+
+def apply_search_ef(collection, search_ef=HNSW_CONFIG["search_ef"]):
+    """Set search_ef on an existing collection (a persisted config write, for ingest.py); returns False
+    when this Chroma version can't."""
+    try:
+        collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+        return True
+    except Exception:
+        return False
+
+
+class ExactIndex:
+    """Brute-force inner-product search over a (N, dim) float32 matrix of normalized embeddings."""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def usable(self, max_docs=EXACT_MAX_DOCS):
+        """True for a non-empty (N, dim) matrix of at most max_docs rows; an empty collection
+        snapshots as shape (0,)."""
+        return self.embeddings.ndim == 2 and 0 < len(self.embeddings) <= max_docs
+
+    def top_k(self, q_emb, k, rows=None):
+        return self.top_k_batch(np.asarray(q_emb, dtype=np.float32)[None, :], k, rows)[0]
+
+    def top_k_batch(self, q_embs, k, rows=None):
+        """Corpus positions of the k best docs per query, best first; `rows` restricts the search
+        to those corpus positions (a metadata filter)."""
+        q_embs = np.asarray(q_embs, dtype=np.float32)
+        if rows is None:
+            scores = q_embs @ self.embeddings.T
+        else:
+            rows   = np.asarray(rows, dtype=np.int64)
+            scores = q_embs @ self.embeddings[rows].T
+        out = []
+        for row in scores:
+            top = np.arange(len(row))
+            if len(row) > k:
+                top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top], kind="stable")]
+            out.append((top if rows is None else rows[top]).tolist())
+        return out
+
+
+# ─────────────────────────────────────────────────────────────
+# recall@k vs latency sweep
+# ─────────────────────────────────────────────────────────────
+def _percentile_ms(secs, p):
+    return float(np.percentile(secs, p) * 1000)
+
+
+def sweep(embeddings, queries, k, efs, ms, construction_ef):
+    """Build an in-memory HNSW collection per M and query it at every ef; recall is measured
+    against ExactIndex on the same vectors."""
+    exact, secs = ExactIndex(embeddings), []
+    truth = []
+    for q in queries:
+        t0 = time.perf_counter()
+        truth.append(set(exact.top_k(q, k)))
+        secs.append(time.perf_counter() - t0)
+    rows = [{"mode": "exact", "recall": 1.0,
+             "p50_ms": _percentile_ms(secs, 50), "p95_ms": _percentile_ms(secs, 95)}]
+
+    client = chromadb.EphemeralClient()
+    ids    = [str(i) for i in range(len(embeddings))]
+    for m in ms:
+        for ef in efs:
+            name = f"sweep-m{m}-ef{ef}"
+            cfg  = {**HNSW_CONFIG, "M": m, "construction_ef": construction_ef, "search_ef": ef}
+            col  = client.create_collection(name, metadata=hnsw_metadata(cfg))
+            t0   = time.perf_counter()
+            for lo in range(0, len(ids), 1000):
+                col.add(ids=ids[lo:lo+1000], embeddings=embeddings[lo:lo+1000].tolist())
+            build = time.perf_counter() - t0
+
+            recall, secs = [], []
+            for q, want in zip(queries, truth):
+                t0  = time.perf_counter()
+                got = col.query(query_embeddings=[q.tolist()], n_results=k, include=[])["ids"][0]
+                secs.append(time.perf_counter() - t0)
+                recall.append(len(want & {int(i) for i in got}) / len(want))
+            rows.append({"mode": "hnsw", "M": m, "search_ef": ef, "construction_ef": construction_ef,
+                         "recall": float(np.mean(recall)), "build_s": build,
+                         "p50_ms": _percentile_ms(secs, 50), "p95_ms": _percentile_ms(secs, 95)})
+            client.delete_collection(name)
+    return rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="recall@k vs latency: exact search and HNSW settings.")
+    ap.add_argument("--db",              default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                              "alphabet_10k_db"))
+    ap.add_argument("--collection",      default="langchain")
+    ap.add_argument("--k",               type=int, default=20)
+    ap.add_argument("--queries",         type=int, default=200)
+    ap.add_argument("--ef",              type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    ap.add_argument("--M",               type=int, nargs="+", default=[HNSW_CONFIG["M"]])
+    ap.add_argument("--construction-ef", type=int, default=HNSW_CONFIG["construction_ef"])
+    ap.add_argument("--noise",           type=float, default=0.05,
+                    help="queries are sampled chunk vectors plus this much gaussian noise, renormalized")
+    ap.add_argument("--json",            help="also write the rows to this file")
+    args = ap.parse_args(argv)
+
+    col  = chromadb.PersistentClient(path=args.db).get_collection(args.collection)
+    embs = np.asarray(col.get(include=["embeddings"])["embeddings"], dtype=np.float32)
+    rng  = np.random.default_rng(0)
+    qs   = embs[rng.choice(len(embs), size=min(args.queries, len(embs)), replace=False)]
+    qs   = qs + rng.normal(scale=args.noise, size=qs.shape).astype(np.float32)
+    qs  /= np.linalg.norm(qs, axis=1, keepdims=True)
+
+    rows = sweep(embs, qs, args.k, args.ef, args.M, args.construction_ef)
+    print(f"{len(embs):,} vectors · {len(qs)} queries · recall@{args.k}")
+    for r in rows:
+        label = "exact" if r["mode"] == "exact" else f"M={r['M']:<3} ef={r['search_ef']:<4}"
+        print(f"  {label:<16} recall {r['recall']:.4f}   p50 {r['p50_ms']:7.2f} ms   p95 {r['p95_ms']:7.2f} ms")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"num_vectors": len(embs), "k": args.k, "rows": rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+# ============================================================
+# embedding.py — selectable BGE-M3 query-embedding backend
+#
+#   torch   sentence-transformers, fp32 (what ingest.py embeds with)
+#   onnx    ONNX Runtime, fp32 export
+#   int8    ONNX Runtime, dynamically quantized to int8 (exported
+#           once into EMBED_EXPORT_DIR, reused afterwards)
+# Documents in the collection stay fp32; only query vectors change,
+# so a backend is safe to use when its dense top-k matches torch's.
+# Check that before switching:
+#
+#   python embedding.py --backend int8 --k 20 --threads 4
+#
+# Every backend runs on CPU and is warmed up at load, so the first
+# user query does not pay for lazy init. `threads` sizes the ONNX
+# Runtime session of one embedder; torch has only a process-wide
+# setting, which would also cap the reranker and every other torch
+# user, so the torch backend keeps the runtime default unless the
+# caller opts in with set_torch_threads() (the parity CLI does).
+# CachedEmbedder memoizes query vectors in a bounded LRU keyed by the
+# normalized text; the app shares one per process, so repeated tool
+# queries across turns and sessions are embedded once.
+# ============================================================
+
+import argparse, os, sys, threading, time
+from collections import OrderedDict
+
+import chromadb
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+from query_cache import normalize_query
+
+EMBED_MODEL      = "BAAI/bge-m3"
+BACKENDS         = ("torch", "onnx", "int8")
+BASE_DIR         = os.path.dirname(os.path.abspath(__file__))
+EMBED_EXPORT_DIR = os.path.join(BASE_DIR, "bge_m3_onnx")
+QUANT_CONFIG     = "avx2"   # arm64 / avx512 / avx512_vnni are faster where the CPU has them
+
+WARMUP_TEXTS = [
+    "What were total revenues?",
+    "What are the main AI competition risks described in the risk factors section of the filing?",
+]
+
+
+def _session_options(threads):
+    import onnxruntime   # only needed for the onnx / int8 backends
+    opts = onnxruntime.SessionOptions()
+    if threads:
+        opts.intra_op_num_threads = threads
+        opts.inter_op_num_threads = 1
+    return opts
+
+
+def export_int8(model_name=EMBED_MODEL, out_dir=EMBED_EXPORT_DIR, config=QUANT_CONFIG):
+    """Export `model_name` to ONNX and quantize it (dynamic int8) into out_dir; returns the file name."""
+    file_name = f"onnx/model_qint8_{config}.onnx"
+    if not os.path.exists(os.path.join(out_dir, file_name)):
+        model = SentenceTransformer(model_name, device="cpu", backend="onnx")
+        model.save_pretrained(out_dir)
+        export_dynamic_quantized_onnx_model(model, config, out_dir)
+    return file_name
+
+
+def set_torch_threads(threads):
+    """Process-wide: intra-op threads of every torch model in this process, not just one embedder."""
+    torch.set_num_threads(threads)
+
+
+class QueryEmbedder:
+    """Callable like Chroma's embedding functions: list of texts -> (n, dim) float32, L2-normalized."""
+
+    def __init__(self, backend="torch", model_name=EMBED_MODEL, threads=None, warmup=True):
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown embedding backend {backend!r}; expected one of {BACKENDS}")
+        self.backend = backend
+        self.threads = threads
+        t0 = time.perf_counter()
+        if backend == "torch":   # `threads` is per ONNX session; see set_torch_threads()
+            self.model = SentenceTransformer(model_name, device="cpu")
+        else:
+            kwargs = {"provider": "CPUExecutionProvider", "session_options": _session_options(threads)}
+            path   = model_name
+            if backend == "int8":
+                kwargs["file_name"] = export_int8(model_name)
+                path = EMBED_EXPORT_DIR
+            self.model = SentenceTransformer(path, device="cpu", backend="onnx", model_kwargs=kwargs)
+        self.load_seconds   = time.perf_counter() - t0
+        self.warmup_seconds = 0.0
+        if warmup:
+            t0 = time.perf_counter()
+            self(WARMUP_TEXTS)
+            self.warmup_seconds = time.perf_counter() - t0
+
+    def __call__(self, input):
+        return self.model.encode(list(input), normalize_embeddings=True, convert_to_numpy=True,
+                                 show_progress_bar=False).astype(np.float32, copy=False)
+
+
+class CachedEmbedder:
+    """LRU of query vectors in front of an embedder; only the misses of a call are embedded,
+    in one batch."""
+
+    def __init__(self, embedder, max_entries=4096):
+        self.embedder    = embedder
+        self.max_entries = max_entries
+        self._vectors    = OrderedDict()   # normalized text -> float32 vector
+        self._lock       = threading.Lock()
+        self.hits        = 0
+        self.misses      = 0
+
+    def __call__(self, input):
+        texts = list(input)
+        keys  = [normalize_query(t) for t in texts]
+        out   = [None] * len(texts)
+        todo  = {}   # key -> first index needing it
+        with self._lock:
+            for i, key in enumerate(keys):
+                vec = self._vectors.get(key)
+                if vec is not None:
+                    self._vectors.move_to_end(key)
+                    out[i] = vec
+                    self.hits += 1
+                elif key in todo:
+                    self.hits += 1
+                else:
+                    todo[key] = i
+                    self.misses += 1
+        if todo:
+            vecs = self.embedder([texts[i] for i in todo.values()])
+            with self._lock:
+                for key, vec in zip(todo, vecs):
+                    self._vectors[key] = vec
+                    self._vectors.move_to_end(key)
+                while len(self._vectors) > self.max_entries:
+                    self._vectors.popitem(last=False)
+            fresh = dict(zip(todo, vecs))
+            out   = [fresh[k] if v is None else v for k, v in zip(keys, out)]
+        return np.stack(out) if out else np.zeros((0, 0), np.float32)
+
+    def clear(self):
+        with self._lock:
+            self._vectors.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries":  len(self._vectors),
+            "hits":     self.hits,
+            "misses":   self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# ─────────────────────────────────────────────────────────────
+# recall-parity check
+# ─────────────────────────────────────────────────────────────
+def first_sentence(doc):
+    """A chunk's first sentence (table chunks: their heading), used as a synthetic query for it."""
+    text = " ".join(doc.replace("Table Heading:", " ").split())
+    return text.split(". ")[0][:200]
+
+
+def parity_queries(docs, n, seed=0):
+    """First sentence of n random chunks: a cheap query set that covers the corpus without
+    hand labelling."""
+    rng   = np.random.default_rng(seed)
+    picks = rng.choice(len(docs), size=min(n, len(docs)), replace=False)
+    return [first_sentence(docs[int(i)]) for i in picks]
+
+
+def check_parity(collection, reference, candidate, queries, k=20):
+    """recall@k of candidate's dense results against reference's, plus per-query embed latency."""
+    def run(embedder):
+        embs, secs = [], []
+        for q in queries:
+            t0 = time.perf_counter()
+            embs.append(embedder([q])[0])
+            secs.append(time.perf_counter() - t0)
+        res = collection.query(query_embeddings=[e.tolist() for e in embs], n_results=k, include=[])
+        return np.stack(embs), res["ids"], np.asarray(secs)
+
+    ref_embs, ref_ids, ref_secs = run(reference)
+    cand_embs, cand_ids, cand_secs = run(candidate)
+    recall = [len(set(r) & set(c)) / max(len(r), 1) for r, c in zip(ref_ids, cand_ids)]
+    return {
+        "queries":       len(queries),
+        "k":             k,
+        "recall_mean":   float(np.mean(recall)),
+        "recall_min":    float(np.min(recall)),
+        "top1_agree":    float(np.mean([bool(r) and bool(c) and r[0] == c[0] for r, c in zip(ref_ids, cand_ids)])),
+        "cosine_mean":   float(np.mean(np.sum(ref_embs * cand_embs, axis=1))),
+        "ref_p50_ms":    float(np.percentile(ref_secs, 50) * 1000),
+        "cand_p50_ms":   float(np.percentile(cand_secs, 50) * 1000),
+        "ref_load_s":    reference.load_seconds,
+        "cand_load_s":   candidate.load_seconds,
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Check a query-embedding backend against fp32 torch.")
+    ap.add_argument("--backend",    default="int8", choices=BACKENDS)
+    ap.add_argument("--db",         default=os.path.join(BASE_DIR, "alphabet_10k_db"))
+    ap.add_argument("--collection", default="langchain")
+    ap.add_argument("--k",          type=int, default=20)
+    ap.add_argument("--queries",    type=int, default=200)
+    ap.add_argument("--threads",    type=int, default=None, help="ONNX session and process-wide torch threads")
+    ap.add_argument("--min-recall", type=float, default=0.95)
+    args = ap.parse_args(argv)
+
+    if args.threads:
+        set_torch_threads(args.threads)   # a standalone run, so the process-wide setting is fine
+    col     = chromadb.PersistentClient(path=args.db).get_collection(args.collection)
+    queries = parity_queries(col.get(include=["documents"])["documents"], args.queries)
+    report  = check_parity(col, QueryEmbedder("torch", threads=args.threads),
+                           QueryEmbedder(args.backend, threads=args.threads), queries, args.k)
+    for name, value in report.items():
+        print(f"  {name:<12} {value:.4f}" if isinstance(value, float) else f"  {name:<12} {value}")
+    ok = report["recall_mean"] >= args.min_recall
+    print(f"{args.backend}: {'PASS' if ok else 'FAIL'} (recall@{args.k} {report['recall_mean']:.3f}, "
+          f"required {args.min_recall})")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
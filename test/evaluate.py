@@ -0,0 +1,216 @@
+# ============================================================
+# evaluate.py — parallel, offline evaluation over the golden dataset
+#
+#   python evaluate.py                          # deterministic stub, no network
+#   python evaluate.py --llm ollama --model llama3.1 --workers 4
+#   python evaluate.py --llm anthropic --workers 8 --rpm 50
+#   python evaluate.py --llm anthropic --no-routing --no-early-stop
+#
+# Runs every golden question through Agent (the run_agent loop without
+# UI) on a bounded worker pool. Model calls go through RateLimited, so
+# concurrency never exceeds --rpm and 429s back off instead of failing
+# the run. Per-question results are cached in an AnswerCache keyed by
+# question, llm:model, system prompt, tool schema and corpus version:
+# re-runs only execute questions whose inputs changed (--fresh to
+# ignore it). Metrics are computed in one pass once all answers exist:
+#   context_recall  evidence facts supported by the retrieved chunks
+#   faithfulness    answer sentences whose numbers all occur in the
+#                   retrieved context and whose words mostly do
+#   answer_recall   ground-truth numbers that occur in the answer
+# plus iterations, tokens and latency percentiles. Table lookups the
+# fact store answers skip the model (stop "fast_path"); --no-fast-path
+# sends every question through the loop, for comparing the two.
+# Model routing (routing.py) is reported per route — turns, seconds,
+# tokens and list-price dollars — next to the quality scores, so a
+# policy can be compared against --no-routing / --no-early-stop.
+# Tool results are compacted within token budgets (compact.py);
+# --no-compact sends the raw chunks, to measure the input_tokens saved. Results are written
+# as JSON under eval/results/, with the per-stage histogram summary
+# (metrics.py) of the questions that actually ran.
+# ============================================================
+
+import argparse, json, os, re, sys, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from agent import MODEL, SYSTEM_PROMPT, Agent
+from answer_cache import AnswerCache
+from facts import FactRouter
+from bench import GOLDEN_PATH, RESULTS_DIR, git_commit, latency_summary, supports
+from llm import RateLimited, make_llm
+from metrics import METRICS
+from retrieval import Retriever
+from routing import SMALL_MODEL, ModelRouting
+from sparse_index import tokenize
+from tools import TOOLS
+
+BASE_DIR   = os.path.dirname(os.path.abspath(__file__))
+CACHE_PATH = os.path.join(BASE_DIR, "eval", "results_cache.sqlite3")
+NUMBER_RE  = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+
+def numbers(text):
+    return {n.replace(",", "") for n in NUMBER_RE.findall(text)}
+
+
+def sentences(text):
+    return [s for s in re.split(r"(?<=[.!?])\s+|\n+", text) if len(tokenize(s)) >= 3]
+
+
+def score(results, questions, support_threshold=0.6):
+    """Batch metrics over all answered questions; returns (per-question rows, summary)."""
+    rows = []
+    for r, q in zip(results, questions):
+        context = "\n".join(c["content"] for c in r["chunks"])
+        ctx_num = numbers(context)
+        ctx_tok = set(tokenize(context))
+
+        evidence = [any(supports(c, e) for c in r["chunks"]) for e in q["evidence"]]
+        claims   = sentences(r["answer"])
+        grounded = [numbers(s) <= ctx_num
+                    and len(set(tokenize(s)) & ctx_tok) >= support_threshold * len(set(tokenize(s)))
+                    for s in claims]
+        gt_num   = numbers(q["ground_truth"])
+        ans_num  = numbers(r["answer"])
+        rows.append({
+            "id":             q["id"],
+            "context_recall": sum(evidence) / len(evidence) if evidence else 0.0,
+            "faithfulness":   sum(grounded) / len(grounded) if grounded else 0.0,
+            "answer_recall":  len(gt_num & ans_num) / len(gt_num) if gt_num else 0.0,
+            "iterations":     r["iterations"],
+            "stop":           r["stop"],
+            "tools":          len(r["trace_lines"]),
+            "input_tokens":   r["usage"].get("input_tokens", 0),
+            "output_tokens":  r["usage"].get("output_tokens", 0),
+            "cost_usd":       r.get("cost_usd", 0.0),
+            "tool_tokens":    r.get("tool_tokens", {}).get("sent", 0),
+            "tool_tokens_raw": r.get("tool_tokens", {}).get("raw", 0),
+            "converged":      r.get("converged", False),
+            "elapsed_s":      r["elapsed_s"],
+            "cached":         r.get("cached", False),
+        })
+
+    metric = lambda name: float(np.mean([row[name] for row in rows])) if rows else 0.0
+    routes = {}
+    for r in results:
+        for route, s in r.get("routes", {}).items():
+            acc = routes.setdefault(route, dict.fromkeys(s, 0))
+            for k, v in s.items():
+                acc[k] += v
+    fresh  = [r["elapsed_s"] for r, row in zip(results, rows) if not row["cached"]]
+    return rows, {
+        "questions":      len(rows),
+        "context_recall": metric("context_recall"),
+        "faithfulness":   metric("faithfulness"),
+        "answer_recall":  metric("answer_recall"),
+        "iterations":     metric("iterations"),
+        "tools":          metric("tools"),
+        "input_tokens":   int(sum(row["input_tokens"] for row in rows)),
+        "output_tokens":  int(sum(row["output_tokens"] for row in rows)),
+        "cost_usd":       sum(row["cost_usd"] for row in rows),
+        "tool_tokens":    {"sent": sum(row["tool_tokens"] for row in rows),
+                           "raw":  sum(row["tool_tokens_raw"] for row in rows)},
+        "converged":      sum(row["converged"] for row in rows),
+        "routes":         routes,
+        "latency":        latency_summary(fresh),
+        "cached":         sum(row["cached"] for row in rows),
+        "fast_path":      sum(row["stop"] == "fast_path" for row in rows),
+    }
+
+
+def run(agent, questions, workers, cache, corpus_version, llm_key, fresh=False):
+    """Answer questions on a pool of `workers` threads; cached answers are reused unless fresh."""
+    results = [None] * len(questions)
+    keys    = [AnswerCache.make_key(q["question"], llm_key, SYSTEM_PROMPT, TOOLS, corpus_version)
+               for q in questions]
+    todo = []
+    for i, key in enumerate(keys):
+        hit = None if fresh else cache.get(key)
+        if hit is not None:
+            results[i] = {**hit, "cached": True}
+        else:
+            todo.append(i)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="eval") as pool:
+        futures = {pool.submit(agent.run, questions[i]["question"]): i for i in todo}
+        for n, fut in enumerate(as_completed(futures), 1):
+            i = futures[fut]
+            try:
+                results[i] = fut.result()
+            except Exception as e:   # one failed question must not sink the run
+                results[i] = {"question": questions[i]["question"], "answer": "", "chunks": [],
+                              "trace_lines": [], "iterations": 0, "stop": f"error: {e}",
+                              "usage": {}, "llm_s": 0.0, "tool_s": 0.0, "elapsed_s": 0.0}
+            else:
+                cache.put(keys[i], questions[i]["question"], results[i])
+            print(f"  [{n}/{len(todo)}] {questions[i]['id']}: {results[i]['stop']} "
+                  f"in {results[i]['elapsed_s']:.1f}s")
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Parallel offline evaluation over the golden dataset.")
+    ap.add_argument("--golden",  default=GOLDEN_PATH)
+    ap.add_argument("--llm",     default="stub", choices=["stub", "ollama", "anthropic"])
+    ap.add_argument("--model",   help=f"model name (ollama default llama3.1, anthropic {MODEL})")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--rpm",     type=float, help="max model requests per minute across workers")
+    ap.add_argument("--cache",   default=CACHE_PATH)
+    ap.add_argument("--fresh",   action="store_true", help="ignore cached per-question results")
+    ap.add_argument("--no-fast-path", action="store_true", help="send every question through the agent loop")
+    ap.add_argument("--small-model", help=f"tool-selection model (anthropic default {SMALL_MODEL}, else --model)")
+    ap.add_argument("--no-routing",   action="store_true", help="every turn on --model")
+    ap.add_argument("--no-early-stop", action="store_true", help="search until the model stops by itself")
+    ap.add_argument("--no-compact",   action="store_true", help="send raw chunks as tool results (no budgets)")
+    ap.add_argument("--out",     help="result file (default eval/results/eval-<time>-<commit>.json)")
+    args = ap.parse_args(argv)
+
+    with open(args.golden) as f:
+        questions = json.load(f)["questions"]
+
+    model     = args.model or (MODEL if args.llm == "anthropic" else "llama3.1" if args.llm == "ollama" else "stub")
+    llm       = RateLimited(make_llm(args.llm, model), rpm=args.rpm)
+    retriever = Retriever.load()
+    router    = None if args.no_fast_path else FactRouter.for_retriever(retriever)
+    small     = args.small_model or (SMALL_MODEL if args.llm == "anthropic" else model)
+    routing   = ModelRouting(large=model, small=small, adaptive=not args.no_routing,
+                             early_stop=not args.no_early_stop)
+    agent     = Agent(retriever, llm, router=router, routing=routing, compact=not args.no_compact)
+    cache     = AnswerCache(args.cache)
+
+    t0      = time.perf_counter()
+    results = run(agent, questions, args.workers, cache, retriever.corpus_version,
+                  f"{args.llm}:{routing.key}" + ("" if router else ":no-fast-path")
+                  + (":raw-results" if args.no_compact else ""), args.fresh)
+    wall    = time.perf_counter() - t0
+    rows, summary = score(results, questions)
+    summary.update(wall_s=wall, throttled=llm.throttled)
+
+    print(f"\n{args.llm}:{routing.key} · {len(questions)} questions · {args.workers} workers · {wall:.1f}s")
+    for row in rows:
+        print(f"  {row['id']:<28} ctx {row['context_recall']:.2f}  faith {row['faithfulness']:.2f}  "
+              f"ans {row['answer_recall']:.2f}  {row['tools']} tools{'  (cached)' if row['cached'] else ''}")
+    print(f"  {'mean':<28} ctx {summary['context_recall']:.2f}  faith {summary['faithfulness']:.2f}  "
+          f"ans {summary['answer_recall']:.2f}  ${summary['cost_usd']:.3f}")
+    print(f"  {'tokens':<28} {summary['input_tokens']} in / {summary['output_tokens']} out · tool results "
+          f"{summary['tool_tokens']['sent']} sent of {summary['tool_tokens']['raw']} raw")
+    for route, s in sorted(summary["routes"].items()):
+        print(f"  {'route ' + route:<28} {s['turns']} turns  {s['llm_s']:.1f}s  "
+              f"{s['input_tokens']} in / {s['output_tokens']} out  ${s['cost_usd']:.3f}")
+
+    out = args.out or os.path.join(RESULTS_DIR, f"eval-{time.strftime('%Y%m%d-%H%M%S')}-{git_commit()}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump({"meta": {"llm": args.llm, "model": model, "workers": args.workers, "rpm": args.rpm,
+                            "fast_path": router is not None, "routing": routing.key,
+                            "compact": not args.no_compact, "commit": git_commit(), "corpus_version": retriever.corpus_version},
+                   "summary": summary, "stages": METRICS.summary(), "questions": rows, "answers": [
+                       {"id": q["id"], "answer": r["answer"], "trace_lines": r["trace_lines"]}
+                       for q, r in zip(questions, results)]}, f, indent=2)
+    print(f"wrote {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
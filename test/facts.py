@@ -0,0 +1,344 @@
+# ============================================================
+# facts.py — structured fact store and a deterministic fast path
+#
+#   python facts.py                              # (re)build from src/alphabet_10k.md
+#   python facts.py "total revenues for fiscal 2024"
+#
+# Every table chunk is parsed into facts: one per numeric cell, keyed
+# by row label (plus its group row, e.g. "Operating income (loss):"),
+# column header and period (the year in the header), with unit, scale
+# ("in millions" from the table heading), Item, page, filing and the
+# id of the chunk it came from. Facts live in SQLite next to the
+# collection: ingest.py replaces a source's facts as it ingests it,
+# and FactStore.open_or_build() rebuilds them from the snapshot when
+# the table chunks changed since.
+#
+# FactRouter answers single-cell lookups ("What were total revenues in
+# 2024?") from the store in well under a millisecond, citing the table
+# chunk as Source 1. It only answers when confident:
+#   - exactly one year is named and no analysis word (why, compare,
+#     trend, ...) appears;
+#   - every word of some row label is in the question, and the label,
+#     group and table heading together cover >= min_coverage of the
+#     question's content words;
+#   - columns with more than a period in their header (Class A / B / C,
+#     Level 1 / 2, ...) only count when the question names that column;
+#   - percentage cells only count when the question asks for one or the
+#     row has nothing else (rates);
+#   - all facts scoring within `margin` of the best agree on one value.
+# Anything else returns None and the question goes to the agent.
+# ============================================================
+
+import argparse, hashlib, json, os, re, sqlite3, sys
+from contextlib import contextmanager
+
+from sparse_index import tokenize
+
+BASE_DIR   = os.path.dirname(os.path.abspath(__file__))
+FACTS_PATH = os.path.join(BASE_DIR, "alphabet_10k_facts.sqlite3")
+FAST_PATH  = os.environ.get("FAST_PATH", "1") != "0"   # answer confident table lookups without the agent
+
+YEAR_RE     = re.compile(r"\b(19[89]\d|20\d\d)\b")
+SCALE_RE    = re.compile(r"\bin (thousands|millions|billions)\b", re.I)
+SEP_CELL_RE = re.compile(r":?-{3,}:?")
+NUMBER_RE   = re.compile(r"(\()?(-)?(\d[\d,]*(?:\.\d+)?|\.\d+)(\))?(%)?")
+
+# words that carry no lookup intent; "s" is what tokenize leaves of "Alphabet's"
+STOPWORDS = {"what", "was", "were", "is", "are", "the", "a", "an", "of", "for", "in", "on", "during",
+             "fiscal", "year", "fy", "did", "does", "do", "much", "how", "many", "s", "alphabet", "its",
+             "their", "our", "company", "reported", "report", "value", "amount", "as", "at", "end", "to",
+             "by", "ended", "december", "31", "google", "alphabets", "figure", "number", "from", "with",
+             "that", "have", "had"}
+ANALYSIS    = {"why", "explain", "compare", "compared", "comparison", "versus", "vs", "trend", "trends",
+               "change", "changed", "changes", "growth", "grew", "grow", "increase", "increased",
+               "decrease", "decreased", "risk", "risks", "strategy", "impact", "sufficient", "cover",
+               "between", "difference", "driver", "drivers", "outlook", "expect", "plan", "cause"}
+PERCENT     = {"percent", "percentage"}
+OPTIONAL    = {"total"}   # "revenues in 2024" means "Total revenues"
+PERIOD_WORDS = {"year", "ended", "as", "of", "december", "31", "fiscal", "three", "month", "months"}
+
+
+def _stem(tokens):
+    return {t[:-1] if len(t) > 3 and t.endswith("s") else t for t in tokens}
+
+
+def _cells(line):
+    return [c.strip() for c in line.strip().strip("|").split("|")]
+
+
+def parse_number(cell):
+    """'$ 1,234' -> (1234.0, ''), '(127)' -> (-127.0, ''), '47%' -> (47.0, '%'); None if not a number."""
+    m = NUMBER_RE.fullmatch(cell.replace("$", "").replace(" ", ""))
+    if not m or bool(m.group(1)) != bool(m.group(4)):
+        return None
+    value = float(m.group(3).replace(",", ""))
+    return (-value if m.group(1) or m.group(2) else value), ("%" if m.group(5) else "")
+
+
+def parse_table(content):
+    """Table chunk text -> (heading, [column header], [(group, label, [cell])])."""
+    heading, _, table = content.partition("\n\n") if content.startswith("Table Heading:") else ("", "", content)
+    heading = heading.removeprefix("Table Heading:").strip()
+    rows    = [_cells(l) for l in table.splitlines() if l.strip().startswith("|")]
+    rows    = [r for r in rows if not all(SEP_CELL_RE.fullmatch(c) or not c for c in r)]
+    width   = max((len(r) for r in rows), default=0)
+    rows    = [r + [""] * (width - len(r)) for r in rows]
+
+    header = [[] for _ in range(width)]
+    body, group = [], ""
+    for r in rows:
+        if not r[0] and not body:   # header rows: empty label cell, before the first data row
+            for j, c in enumerate(r):
+                if c and (not header[j] or header[j][-1] != c):
+                    header[j].append(c)
+            continue
+        if r[0] and not any(r[1:]):   # "Revenues:" / "Google Services:" — labels the rows below
+            group = r[0].rstrip(":").strip()
+            continue
+        if r[0]:
+            body.append((group, r[0], r[1:]))
+    return heading, [" ".join(h) for h in header[1:]], body
+
+
+def table_facts(chunk_id, content, meta):
+    """Fact dicts for every numeric cell of one table chunk."""
+    heading, columns, body = parse_table(content)
+    m        = SCALE_RE.search(heading)
+    scale    = m.group(1).lower() if m else ""
+    currency = "$" in content
+    facts    = []
+    for group, label, cells in body:
+        for col, cell in zip(columns, cells):
+            parsed = parse_number(cell)
+            if parsed is None:
+                continue
+            value, unit = parsed
+            years = YEAR_RE.findall(col)
+            facts.append({
+                "chunk_id":    chunk_id,
+                "source":      meta.get("source", ""),
+                "ticker":      meta.get("ticker", ""),
+                "fiscal_year": meta.get("fiscal_year"),
+                "form_type":   meta.get("form_type", ""),
+                "item_number": meta.get("item_number", ""),
+                "page":        str(meta.get("page", "")),
+                "heading":     heading,
+                "grp":         group,
+                "label":       label,
+                "col":         col,
+                "period":      years[-1] if years else "",
+                "value":       value,
+                "raw":         cell.replace("$", "").strip(),
+                "unit":        unit or ("$" if currency else ""),
+                "scale":       "" if unit or "per share" in label.lower() else scale,
+            })
+    return facts
+
+
+SOURCE_WHERE = "source = ? AND ticker IS ? AND fiscal_year IS ? AND form_type IS ?"
+
+
+def source_key(source, filing=None):
+    """(source, ticker, fiscal_year, form_type) as table_facts() stores them."""
+    filing = filing or {}
+    return (source, filing.get("ticker") or "", filing.get("fiscal_year"), filing.get("form_type") or "")
+
+
+def corpus_fingerprint(chunks):
+    """Digest of the table chunks' ids, contents and metadata: an upsert under the same id changes it."""
+    h = hashlib.sha1()
+    for cid, content, meta in sorted(chunks, key=lambda c: c[0]):
+        h.update(f"{cid}\0{content}\0{json.dumps(meta or {}, sort_keys=True)}\0".encode())
+    return h.hexdigest()
+
+
+COLUMNS = ("chunk_id", "source", "ticker", "fiscal_year", "form_type", "item_number", "page", "heading",
+           "grp", "label", "col", "period", "value", "raw", "unit", "scale")
+
+
+class FactStore:
+    def __init__(self, path=FACTS_PATH):
+        self.path = path
+        with self._connect() as db:
+            db.execute(f"CREATE TABLE IF NOT EXISTS facts ({', '.join(COLUMNS)})")
+            db.execute("CREATE INDEX IF NOT EXISTS facts_label ON facts(label, period)")
+            db.execute("CREATE INDEX IF NOT EXISTS facts_source ON facts(source)")
+            db.execute("CREATE INDEX IF NOT EXISTS facts_item ON facts(item_number, page)")
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _insert(self, db, chunks):
+        rows = [tuple(f[c] for c in COLUMNS)
+                for cid, content, meta in chunks if meta.get("content_type") == "table"
+                for f in table_facts(cid, content, meta)]
+        db.executemany(f"INSERT INTO facts VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+        return len(rows)
+
+    def replace_source(self, source, chunks, filing=None):
+        """Swap in the facts of one ingested source ([(id, content, metadata)] as chunk_file returns)
+        of one filing: the same file name under another filing key is a different source."""
+        with self._connect() as db:
+            db.execute(SOURCE_WHERE.join(["DELETE FROM facts WHERE ", ""]), source_key(source, filing))
+            n = self._insert(db, chunks)
+            db.execute("DELETE FROM meta WHERE key = 'fingerprint'")   # set again by open_or_build
+        return n
+
+    def prune(self, keep):
+        """Drop the facts of every (source, ticker, fiscal_year, form_type) not in keep (source_key())."""
+        with self._connect() as db:
+            known = set(db.execute("SELECT DISTINCT source, ticker, fiscal_year, form_type FROM facts"))
+            for key in known - set(keep):
+                db.execute(SOURCE_WHERE.join(["DELETE FROM facts WHERE ", ""]), key)
+            db.execute("DELETE FROM meta WHERE key = 'fingerprint'")
+
+    def rebuild(self, chunks):
+        chunks = list(chunks)
+        with self._connect() as db:
+            db.execute("DELETE FROM facts")
+            n = self._insert(db, chunks)
+            fp = corpus_fingerprint(c for c in chunks if c[2].get("content_type") == "table")
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fp,))
+        return n
+
+    def fingerprint(self):
+        with self._connect() as db:
+            row = db.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        return row[0] if row else None
+
+    def facts(self):
+        with self._connect() as db:
+            return [dict(zip(COLUMNS, r)) for r in db.execute(f"SELECT {', '.join(COLUMNS)} FROM facts")]
+
+    @classmethod
+    def open_or_build(cls, snapshot, path=FACTS_PATH):
+        """The store for this corpus, rebuilt from the snapshot's table chunks unless its recorded
+        fingerprint (ids, contents and metadata) matches them. Per-source updates (ingest.py) clear the fingerprint, so the first
+        load after an ingest rebuilds once, against exactly the chunks being served."""
+        store  = cls(path)
+        tables = [i for i, m in enumerate(snapshot.metas) if (m or {}).get("content_type") == "table"]
+        chunks = [(snapshot.ids[i], snapshot.docs[i], snapshot.metas[i]) for i in tables]
+        if store.fingerprint() != corpus_fingerprint(chunks):
+            store.rebuild(chunks)
+        return store
+
+
+def _display(f):
+    if f["unit"] == "%":
+        return f"{f['raw']}"
+    number = f["raw"]
+    if number.startswith("(") and number.endswith(")"):
+        number = f"-{number[1:-1]}"
+    money = f"${number}" if f["unit"] == "$" else number
+    return f"{money} {f['scale'].rstrip('s')}".strip()
+
+
+class FactRouter:
+    def __init__(self, facts, chunk_fn=None, min_coverage=0.8, margin=0.1):
+        self.chunk_fn     = chunk_fn   # chunk id -> {"id", "content", "metadata"} for render_sources
+        self.min_coverage = min_coverage
+        self.margin       = margin
+        self.candidates   = {}         # (label, group) -> {"required", "label", "group", "heading", "facts"}
+        for f in facts:
+            if not f["period"]:
+                continue
+            c = self.candidates.setdefault((f["label"].lower(), f["grp"].lower()), {
+                "required": _stem(tokenize(f["label"])) - OPTIONAL,
+                "label":    _stem(tokenize(f["label"])),
+                "group":    _stem(tokenize(f["grp"])),
+                "heading":  set(),
+                "facts":    []})
+            c["heading"] |= _stem(tokenize(f["heading"]))
+            c["facts"].append(f)
+        self.candidates = {k: c for k, c in self.candidates.items() if c["required"]}
+
+    @classmethod
+    def for_retriever(cls, retriever, path=FACTS_PATH, **kw):
+        store = FactStore.open_or_build(retriever.snapshot, path)
+        index = retriever.snapshot.id_index
+        return cls(store.facts(), lambda cid: retriever.make_chunk(index[cid]) if cid in index else None, **kw)
+
+    def lookup(self, question):
+        """(facts, score) for a confident single-value lookup, else None."""
+        tokens = tokenize(question)
+        words  = _stem(tokens)
+        years  = set(YEAR_RE.findall(question))
+        if len(years) != 1 or words & _stem(ANALYSIS):
+            return None
+        period  = years.pop()
+        content = words - _stem(STOPWORDS) - {period} - _stem(PERCENT)
+        if not content:
+            return None
+        percent = bool(set(tokens) & PERCENT) or "%" in question
+
+        scored = []
+        for c in self.candidates.values():
+            if not c["required"] <= words:
+                continue
+            # label and group words count fully, words only found in the table heading count half
+            hit   = content & (c["label"] | c["group"])
+            score = (len(hit) + 0.5 * len(content & c["heading"] - hit)) / len(content)
+            facts = [f for f in c["facts"] if f["period"] == period
+                     and _stem(tokenize(f["col"])) - _stem(PERIOD_WORDS) - {period} <= words]
+            plain = [f for f in facts if f["unit"] != "%"]
+            facts = [f for f in facts if f["unit"] == "%"] if percent else plain or facts
+            if facts and score >= self.min_coverage:
+                scored.append((score, facts))
+        if not scored:
+            return None
+        best = max(s for s, _ in scored)
+        top  = [f for s, facts in scored if s >= best - self.margin for f in facts]
+        if len({(f["value"], f["unit"] == "%") for f in top}) != 1:
+            return None   # ambiguous: e.g. Google Cloud revenue vs Google Cloud operating income
+        # cite the filing that reports it last (a later 10-K restates earlier years), then document order
+        top.sort(key=lambda f: (-(f["fiscal_year"] or 0), f["unit"] != "$", f["item_number"], f["page"]))
+        return top, best
+
+    def answer(self, question):
+        """Agent-shaped result ({"answer", "chunks", "trace_lines", "facts"}) or None to fall back."""
+        found = self.lookup(question)
+        if found is None:
+            return None
+        facts, score = found
+        f      = facts[0]
+        label  = f"{f['grp']} — {f['label']}" if f["grp"] else f["label"]
+        chunks = [c for c in [self.chunk_fn(f["chunk_id"])] if c] if self.chunk_fn else []
+        cite   = f"Source 1, {f['item_number'] or 'Item —'}, page {f['page'] or '—'}"
+        answer = (f"**{label}** ({f['col'] or f['period']}): **{_display(f)}**\n\n"
+                  f"*{cite}" + (f" — {f['heading']}" if f["heading"] else "") + "*")
+        return {"answer": answer, "chunks": chunks, "facts": facts, "score": score,
+                "trace_lines": [{"iter": 0, "tool": "fact_lookup", "query": question}]}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Build the table fact store, or try the fast path on questions.")
+    ap.add_argument("questions", nargs="*")
+    ap.add_argument("--db", default=FACTS_PATH)
+    args = ap.parse_args(argv)
+
+    if not args.questions:
+        from chunking import chunk_file
+        from ingest import DEFAULT_SOURCES, filing_for
+        store = FactStore(args.db)
+        for path in DEFAULT_SOURCES:
+            filing    = filing_for(path)
+            _, chunks = chunk_file(path, filing)
+            print(f"{os.path.basename(path)}: {store.replace_source(os.path.basename(path), chunks, filing)} facts")
+        return 0
+
+    router = FactRouter(FactStore(args.db).facts())
+    for q in args.questions:
+        result = router.answer(q)
+        print(f"{q}\n  -> {result['answer'].splitlines()[0] if result else 'agent'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
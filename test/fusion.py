@@ -0,0 +1,26 @@
+# ============================================================
+# fusion.py — reciprocal rank fusion of the two retrieval legs
+#
+# Kept apart from retrieval.py (Chroma, the embedder, the reranker)
+# so it depends on numpy only and is tested on its own.
+#   score(d) = sum over legs of 1 / (k + rank of d in that leg)
+# Ties keep ascending corpus position, so fusion is deterministic.
+# ============================================================
+
+import numpy as np
+
+
+def rrf_positions(dense, sparse, top_n, k):
+    """Reciprocal rank fusion over corpus positions: score(d) = sum over legs of 1/(k + rank)."""
+    legs = [np.asarray(leg, dtype=np.int64) for leg in (dense, sparse)]
+    ids  = np.concatenate(legs)
+    if not len(ids):
+        return []
+    contrib   = np.concatenate([1.0 / (k + np.arange(len(leg))) for leg in legs])
+    uniq, inv = np.unique(ids, return_inverse=True)
+    scores    = np.bincount(inv, weights=contrib)
+    top       = np.arange(len(uniq))
+    if len(uniq) > top_n:
+        top = np.argpartition(-scores, top_n - 1)[:top_n]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [int(uniq[t]) for t in top]
@@ -0,0 +1,189 @@
+# ============================================================
+# ingest.py — incremental, parallel ingestion into alphabet_10k_db
+#
+#   python ingest.py                          # src/alphabet_10k.md
+#   python ingest.py filings/*.md --workers 8 --batch-size 64
+#   python ingest.py --prune                  # also drop chunks not produced by this run
+#   python ingest.py MSFT_2024_10-K.md        # filing key from the file name
+#   python ingest.py report.md --ticker MSFT --fiscal-year 2024 --form-type 10-K
+#
+# Documents are parsed and chunked in a process pool; chunks stream
+# back as each document finishes. Only chunks whose content-hash id is
+# not already in the collection are embedded (BGE-M3, batched) and
+# upserted in bulk. Chunks of a re-ingested source that no longer
+# exist are deleted; a source is a file name within one filing key, so
+# the same name under two filings never shadows the other. A run that
+# changed anything bumps the collection's content revision, so the app
+# rebuilds its snapshot on the next start.
+# Every chunk is tagged with its filing key (ticker, fiscal_year,
+# form_type): from --ticker/--fiscal-year/--form-type, else from a
+# <TICKER>_<YEAR>_<FORM>.md file name. All filings share one collection
+# and are isolated per query by metadata filters on both legs.
+# Table chunks are also parsed into the fact store (facts.py) that the
+# fast path answers single-cell lookups from.
+# ============================================================
+
+import argparse, os, re, sys, time, uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import chromadb
+import numpy as np
+from chromadb.utils import embedding_functions
+
+from chunking import FILING_FIELDS, chunk_file
+from dense_index import apply_search_ef, hnsw_metadata
+from facts import FACTS_PATH, FactStore, source_key
+from snapshot import REVISION_KEY
+
+BASE_DIR        = os.path.dirname(os.path.abspath(__file__))
+CHROMA_PATH     = os.path.join(BASE_DIR, "alphabet_10k_db")
+COLLECTION_NAME = "langchain"
+DEFAULT_SOURCES = [os.path.join(BASE_DIR, "..", "src", "alphabet_10k.md")]
+DEFAULT_FILINGS = {"alphabet_10k.md": {"ticker": "GOOGL", "fiscal_year": 2025, "form_type": "10-K"}}
+FILING_NAME_RE  = re.compile(r'^([A-Za-z.]+)_(\d{4})_([0-9A-Za-z-]+)\.md$')
+
+
+def filing_for(path, ticker=None, fiscal_year=None, form_type=None):
+    """Filing key for one source: explicit flags win, then the file name, then DEFAULT_FILINGS."""
+    name   = os.path.basename(path)
+    filing = dict(DEFAULT_FILINGS.get(name, {}))
+    m      = FILING_NAME_RE.match(name)
+    if m:
+        filing = {"ticker": m.group(1), "fiscal_year": int(m.group(2)), "form_type": m.group(3)}
+    for field, value in (("ticker", ticker), ("fiscal_year", fiscal_year), ("form_type", form_type)):
+        if value is not None:
+            filing[field] = value
+    if "ticker" in filing:
+        filing["ticker"] = filing["ticker"].upper()
+    if "form_type" in filing:
+        filing["form_type"] = filing["form_type"].upper()
+    return filing
+
+
+def _chunk(path, filing):
+    t0 = time.perf_counter()
+    path, chunks = chunk_file(path, filing)
+    return path, chunks, time.perf_counter() - t0
+
+
+class Meter:
+    """Wall-clock time and item counts per stage, reported as items/s."""
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, n, seconds):
+        count, total = self.stages.get(stage, (0, 0.0))
+        self.stages[stage] = (count + n, total + seconds)
+
+    def report(self):
+        for stage, (n, secs) in self.stages.items():
+            rate = n / secs if secs else float("inf")
+            print(f"  {stage:<8} {n:>7,} chunks  {secs:8.2f}s  {rate:10,.1f} chunks/s")
+
+
+def batches(seq, size):
+    for i in range(0, len(seq), size):
+        yield seq[i:i+size]
+
+
+def source_where(source, filing):
+    """Chroma filter for one source of one filing. File names repeat across filings (msft/10k.md,
+    aapl/10k.md), so the source alone would make one filing's chunks look stale to the other."""
+    clauses = [{"source": source}] + [{f: filing[f]} for f in FILING_FIELDS
+                                      if (filing or {}).get(f) not in (None, "")]
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def sync_source(col, embed_fn, source, filing, chunks, batch_size, meter):
+    """Embed and upsert the chunks of one source that are new; delete the ones that disappeared."""
+    existing = set(col.get(where=source_where(source, filing), include=[])["ids"])
+    fresh    = [c for c in chunks if c[0] not in existing]
+    stale    = existing - {c[0] for c in chunks}
+
+    for batch in batches(fresh, batch_size):
+        ids, docs, metas = map(list, zip(*batch))
+        t0   = time.perf_counter()
+        embs = embed_fn(docs)
+        meter.add("embed", len(batch), time.perf_counter() - t0)
+        t0   = time.perf_counter()
+        col.upsert(ids=ids, embeddings=[np.asarray(e, dtype=float).tolist() for e in embs],
+                   documents=docs, metadatas=metas)
+        meter.add("upsert", len(batch), time.perf_counter() - t0)
+
+    for batch in batches(sorted(stale), batch_size):
+        col.delete(ids=batch)
+    return len(fresh), len(stale)
+
+
+def bump_revision(col):
+    """Mark the collection contents as changed; the retriever snapshot is fingerprinted from it.
+    Chroma rejects hnsw:space in modify(), and the index keeps the space it was created with."""
+    meta = {k: v for k, v in (col.metadata or {}).items() if k != "hnsw:space"}
+    col.modify(metadata={**meta, REVISION_KEY: uuid.uuid4().hex})
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Chunk, embed and upsert 10-K markdown filings.")
+    ap.add_argument("sources", nargs="*", default=DEFAULT_SOURCES)
+    ap.add_argument("--db",         default=CHROMA_PATH)
+    ap.add_argument("--collection", default=COLLECTION_NAME)
+    ap.add_argument("--workers",    type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--batch-size", type=int, default=64)
+    ap.add_argument("--prune",      action="store_true",
+                    help="delete every chunk not produced by this run (e.g. legacy uuid ids)")
+    ap.add_argument("--ticker",      help="filing ticker for every source (default: from file name)")
+    ap.add_argument("--fiscal-year", type=int, help="filing fiscal year for every source")
+    ap.add_argument("--form-type",   help="filing form type for every source, e.g. 10-K")
+    ap.add_argument("--facts",       default=FACTS_PATH, help="table fact store (SQLite)")
+    args = ap.parse_args(argv)
+
+    client   = chromadb.PersistentClient(path=args.db)
+    embed_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
+        model_name="BAAI/bge-m3", normalize_embeddings=True)
+    # HNSW M / construction_ef only take effect for a newly created collection; search_ef is
+    # (re)applied here rather than at every app load
+    col        = client.get_or_create_collection(name=args.collection, embedding_function=embed_fn,
+                                                 metadata=hnsw_metadata())
+    apply_search_ef(col)
+    batch_size = min(args.batch_size, client.get_max_batch_size())
+    facts      = FactStore(args.facts)
+
+    meter, keep    = Meter(), set()
+    added = removed = total = 0
+    t_start        = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        filings = {p: filing_for(p, args.ticker, args.fiscal_year, args.form_type) for p in args.sources}
+        futures = [pool.submit(_chunk, p, filing) for p, filing in filings.items()]
+        for fut in as_completed(futures):
+            path, chunks, secs = fut.result()
+            meter.add("chunk", len(chunks), secs)
+            source = os.path.basename(path)
+            a, r   = sync_source(col, embed_fn, source, filings[path], chunks, batch_size, meter)
+            n_fact = facts.replace_source(source, chunks, filings[path])
+            added, removed = added + a, removed + r
+            keep.update(c[0] for c in chunks)
+            total += len(chunks)
+            filing = chunks[0][2] if chunks else {}
+            label  = " ".join(str(filing[f]) for f in ("ticker", "fiscal_year", "form_type") if f in filing)
+            print(f"{source}{f' [{label}]' if label else ''}: {len(chunks)} chunks, {a} embedded, {r} deleted, "
+                  f"{n_fact} table facts")
+
+    if args.prune:
+        orphans = sorted(set(col.get(include=[])["ids"]) - keep)
+        for batch in batches(orphans, batch_size):
+            col.delete(ids=batch)
+        removed += len(orphans)
+        facts.prune({source_key(os.path.basename(p), filing) for p, filing in filings.items()})
+        print(f"pruned {len(orphans)} chunks not in this run")
+    if added or removed:
+        bump_revision(col)
+
+    elapsed = time.perf_counter() - t_start
+    print(f"\n{len(args.sources)} sources · {total} chunks · {added} embedded · {removed} deleted · "
+          f"{col.count()} in collection · {elapsed:.1f}s · {total / elapsed:,.1f} chunks/s end to end")
+    meter.report()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
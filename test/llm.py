@@ -0,0 +1,193 @@
+# ============================================================
+# llm.py — pluggable model clients for Agent
+#
+# Each client has create(**request) taking the kwargs build_request()
+# produces (Anthropic Messages format) and returning an Anthropic-
+# shaped message: .content blocks (type text / tool_use), .stop_reason
+# and .usage.input_tokens / .output_tokens.
+#   anthropic  the real API
+#   ollama     a local model through the Ollama server; requests and
+#              replies are translated to and from its chat format
+#   stub       deterministic, offline: searches once with the question,
+#              then answers with the retrieved sentences that overlap
+#              the question most. Answers are reproducible, so a
+#              regression run only moves when retrieval moves.
+# RateLimited wraps any client with a requests-per-minute budget shared
+# by every worker thread, and retries rate-limit errors with backoff.
+# ============================================================
+
+import json, os, re, threading, time, uuid
+from types import SimpleNamespace
+
+from sparse_index import tokenize
+
+QUANT_WORDS = {"revenue", "revenues", "income", "cash", "debt", "expenditures", "capex", "margin",
+               "much", "total", "repurchases", "billion", "million", "ratio", "eps", "tax"}
+
+
+def _usage(input_tokens, output_tokens):
+    return SimpleNamespace(input_tokens=int(input_tokens), output_tokens=int(output_tokens),
+                           cache_read_input_tokens=0, cache_creation_input_tokens=0)
+
+
+def _text(block):
+    return block["text"] if isinstance(block, dict) else getattr(block, "text", "")
+
+
+def _approx_tokens(request):
+    return len(json.dumps(request, default=str)) // 4
+
+
+class AnthropicLLM:
+    name = "anthropic"
+
+    def __init__(self, api_key=None, max_retries=2):
+        import anthropic
+        self.client = anthropic.Anthropic(api_key=api_key or os.environ.get("ANTHROPIC_API_KEY"),
+                                          max_retries=max_retries)
+
+    def create(self, **request):
+        return self.client.messages.create(**request)
+
+
+class StubLLM:
+    name = "stub"
+
+    def __init__(self, max_sentences=3):
+        self.max_sentences = max_sentences
+
+    def create(self, **request):
+        messages = request["messages"]
+        question = messages[0]["content"]
+        question = question if isinstance(question, str) else " ".join(_text(b) for b in question)
+        results  = [b for m in messages if m["role"] == "user" and isinstance(m["content"], list)
+                    for b in m["content"] if isinstance(b, dict) and b.get("type") == "tool_result"]
+        if not results or request.get("tool_choice", {}).get("type") == "any":
+            return self._search(question, request)
+        return self._answer(question, [r["content"] for r in results], request)
+
+    def _search(self, question, request):
+        words = set(tokenize(question))
+        quant = bool(words & QUANT_WORDS) or bool(re.search(r"\d", question))
+        tools = ["table_search", "text_search"] if quant else ["text_search"]
+        if words & {"compare", "cover", "versus", "vs", "sufficient"}:
+            tools = ["table_search", "text_search"]
+        blocks = [SimpleNamespace(type="tool_use", id=f"toolu_stub_{i}", name=name,
+                                  input={"query": question})
+                  for i, name in enumerate(tools)]
+        return SimpleNamespace(content=blocks, stop_reason="tool_use",
+                               usage=_usage(_approx_tokens(request), 20 * len(blocks)))
+
+    def _answer(self, question, contexts, request):
+        q_words   = set(tokenize(question))
+        sentences = []
+        for ctx in contexts:
+            for part in re.split(r"(?<=[.!?])\s+|\n", ctx):
+                part = part.strip(" |-")
+                if len(part) > 20 and not part.startswith("["):
+                    sentences.append(part)
+        ranked = sorted(sentences, key=lambda s: -len(q_words & set(tokenize(s))))   # stable
+        picked = [s for s in ranked[:self.max_sentences] if q_words & set(tokenize(s))]
+        answer = " ".join(picked) if picked else "The filing excerpts do not answer this question."
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text=answer)], stop_reason="end_turn",
+                               usage=_usage(_approx_tokens(request), len(answer) // 4))
+
+
+class OllamaLLM:
+    name = "ollama"
+
+    def __init__(self, model="llama3.1", host=None, temperature=0.0):
+        import ollama
+        self.client  = ollama.Client(host=host or os.environ.get("OLLAMA_HOST"))
+        self.model   = model
+        self.options = {"temperature": temperature}
+
+    @staticmethod
+    def _messages(request):
+        out = [{"role": "system", "content": " ".join(_text(b) for b in request["system"])}]
+        for m in request["messages"]:
+            content = m["content"]
+            if isinstance(content, str):
+                out.append({"role": m["role"], "content": content})
+                continue
+            text  = " ".join(_text(b) for b in content if (b.get("type") if isinstance(b, dict) else b.type) == "text")
+            calls = [b for b in content if not isinstance(b, dict) and b.type == "tool_use"]
+            if calls:
+                out.append({"role": "assistant", "content": text,
+                            "tool_calls": [{"function": {"name": c.name, "arguments": c.input}} for c in calls]})
+                continue
+            results = [b for b in content if isinstance(b, dict) and b.get("type") == "tool_result"]
+            out.extend({"role": "tool", "content": r["content"]} for r in results)
+            if text or not results:
+                out.append({"role": m["role"], "content": text})
+        return out
+
+    def create(self, **request):
+        tools = [{"type": "function", "function": {"name": t["name"], "description": t["description"],
+                                                   "parameters": t["input_schema"]}}
+                 for t in request.get("tools", [])]
+        reply = self.client.chat(model=self.model, messages=self._messages(request), tools=tools,
+                                 options=self.options)
+        msg    = reply["message"]
+        blocks = [SimpleNamespace(type="text", text=msg.get("content") or "")] if msg.get("content") else []
+        for call in msg.get("tool_calls") or []:
+            args = call["function"]["arguments"]
+            blocks.append(SimpleNamespace(type="tool_use", id=f"toolu_{uuid.uuid4().hex[:12]}",
+                                          name=call["function"]["name"],
+                                          input=json.loads(args) if isinstance(args, str) else dict(args)))
+        stop = "tool_use" if any(b.type == "tool_use" for b in blocks) else "end_turn"
+        return SimpleNamespace(content=blocks, stop_reason=stop,
+                               usage=_usage(reply.get("prompt_eval_count") or 0, reply.get("eval_count") or 0))
+
+
+def make_llm(name, model=None):
+    if name == "stub":
+        return StubLLM()
+    if name == "ollama":
+        return OllamaLLM(model or "llama3.1")
+    if name == "anthropic":
+        return AnthropicLLM()
+    raise ValueError(f"unknown llm {name!r}; expected stub, ollama or anthropic")
+
+
+def _is_rate_limit(e):
+    return getattr(e, "status_code", None) == 429 or type(e).__name__ == "RateLimitError"
+
+
+class RateLimited:
+    """Spaces create() calls to at most rpm per minute across threads; retries 429s with
+    exponential backoff (honouring retry-after when the error carries it)."""
+
+    def __init__(self, llm, rpm=None, max_retries=5, backoff=2.0):
+        self.llm         = llm
+        self.name        = llm.name
+        self.interval    = 60.0 / rpm if rpm else 0.0
+        self.max_retries = max_retries
+        self.backoff     = backoff
+        self._next       = 0.0
+        self._lock       = threading.Lock()
+        self.throttled   = 0   # 429s seen
+
+    def _wait_turn(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now        = time.monotonic()
+            slot       = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def create(self, **request):
+        for attempt in range(self.max_retries + 1):
+            self._wait_turn()
+            try:
+                return self.llm.create(**request)
+            except Exception as e:
+                if not _is_rate_limit(e) or attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.throttled += 1
+                headers = getattr(getattr(e, "response", None), "headers", None) or {}
+                delay   = float(headers.get("retry-after") or self.backoff * 2 ** attempt)
+                time.sleep(delay)
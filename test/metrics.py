@@ -0,0 +1,242 @@
+# ============================================================
+# metrics.py — in-process latency histograms and counters
+#
+#   with METRICS.time("rag_tool_call_seconds", tool="table_search"):
+#       ...
+#   METRICS.observe("rag_stage_seconds", 0.012, stage="embed")
+#   METRICS.inc("rag_llm_tokens_total", 812, model=MODEL, kind="input")
+#   METRICS.set("rag_service_inflight", 3, route="ask")
+#
+# One process-wide registry (METRICS). Histograms use fixed buckets,
+# so an observation is a bisect and two adds under a lock: cheap
+# enough for every stage of every search, independent of LangSmith.
+# Exposed three ways:
+#   render()        Prometheus text exposition format
+#   serve(port)     GET /metrics on a daemon thread (METRICS_PORT)
+#   FileSink(path)  rewrites the same text every few seconds
+#                   (METRICS_FILE), for node_exporter's textfile
+#                   collector or a plain `watch cat`
+#   summary()       count / p50 / p95 per series, for the sidebar and
+#                   result files; quantiles are interpolated within
+#                   buckets, as histogram_quantile() does
+# ============================================================
+
+import bisect, os, threading, time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT     = int(os.environ.get("METRICS_PORT", "0")) or None   # None: no HTTP endpoint
+METRICS_FILE     = os.environ.get("METRICS_FILE") or None             # None: no file sink
+METRICS_INTERVAL = float(os.environ.get("METRICS_INTERVAL", "10"))    # seconds between file writes
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.0075, 0.01, 0.015, 0.025, 0.035, 0.05, 0.075,
+                   0.1, 0.15, 0.25, 0.35, 0.5, 0.75, 1.0, 1.5, 2.5, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0)
+
+HELP = {
+    "rag_stage_seconds":         "Retrieval stage latency: embed, dense (exact matmul or Chroma query), sparse (BM25), fusion, rerank, total.",
+    "rag_search_total":          "hybrid_search calls by outcome (cached, searched, degraded).",
+    "rag_llm_iteration_seconds": "Wall time of one model turn in the agent loop, by model and route (select, answer).",
+    "rag_llm_ttft_seconds":      "Time to the first streamed token of a model turn.",
+    "rag_llm_tokens_total":      "Model tokens by kind (input, output, cache_read, cache_write).",
+    "rag_llm_cost_usd_total":    "Model spend in US dollars at list prices, by model and route.",
+    "rag_tool_call_seconds":     "Tool call latency as seen by the agent loop.",
+    "rag_tool_result_tokens_total": "Estimated tool_result tokens: as sent (form=sent) and as the uncompacted chunks would have been (form=raw).",
+    "rag_render_seconds":        "Time spent rendering the answer and sources panel.",
+    "rag_agent_seconds":         "End-to-end question latency by outcome.",
+    "rag_langsmith_errors_total": "LangSmith create/update calls that raised.",
+    "rag_route_total":           "Questions answered by the fact-store fast path vs sent to the agent loop.",
+    "rag_flight_calls_total":    "Requests that went through single-flight coalescing, by kind (question, tool).",
+    "rag_coalesced_total":       "Requests that joined an identical request already in flight, by kind.",
+    "rag_service_inflight":      "Requests holding a service concurrency slot.",
+    "rag_service_queued":        "Requests waiting for a service concurrency slot.",
+    "rag_service_queue_seconds": "Time a service request waited for a concurrency slot.",
+    "rag_service_shed_total":    "Service requests rejected with 503 (queue full or wait timed out).",
+}
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+
+def _number(v):
+    return "+Inf" if v == float("inf") else repr(float(v))
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts  = [0] * (len(self.buckets) + 1)   # last slot: above the largest bucket
+        self.sum     = 0.0
+        self.count   = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum   += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Linear interpolation inside the bucket holding the q-th observation."""
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lo = self.buckets[i - 1] if i else 0.0
+                if i == len(self.buckets):   # overflow bucket has no upper bound
+                    return self.buckets[-1]
+                return lo + (self.buckets[i] - lo) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+class Metrics:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets     = buckets
+        self._histograms = {}   # name -> {label key: Histogram}
+        self._counters   = {}   # name -> {label key: float}
+        self._gauges     = {}   # name -> {label key: float}
+        self._lock       = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist   = series.get(key)
+            if hist is None:
+                hist = series[key] = Histogram(self.buckets)
+            hist.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series      = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    @contextmanager
+    def time(self, name, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get(name, {}).get(_labels(labels), 0)
+
+    def counters(self, name):
+        """{label string: value} for every series of counter `name`."""
+        with self._lock:
+            return {",".join(f"{k}={v}" for k, v in key): value
+                    for key, value in self._counters.get(name, {}).items()}
+
+    def summary(self, name=None):
+        """{name: {label string: {count, sum, mean, p50, p95}}} for every histogram (or just `name`)."""
+        out = {}
+        with self._lock:
+            for hname, series in self._histograms.items():
+                if name is not None and hname != name:
+                    continue
+                out[hname] = {
+                    ",".join(f"{k}={v}" for k, v in key): {
+                        "count": h.count, "sum": h.sum, "mean": h.sum / h.count if h.count else None,
+                        "p50": h.quantile(0.5), "p95": h.quantile(0.95)}
+                    for key, h in series.items()}
+        return out
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            for name in sorted(self._histograms):
+                lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} histogram"]
+                for key, h in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, n in zip(self.buckets + (float("inf"),), h.counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', _number(bound))])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {h.sum!r}")
+                    lines.append(f"{name}_count{_format_labels(key)} {h.count}")
+            for kind, metrics in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted(metrics):
+                    lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} {kind}"]
+                    for key, v in sorted(metrics[name].items()):
+                        lines.append(f"{name}{_format_labels(key)} {v}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Atomically replace `path` with the current exposition text."""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+METRICS = Metrics()
+
+
+def serve(port=METRICS_PORT, host="127.0.0.1", metrics=METRICS):
+    """Serve GET /metrics on a daemon thread. Returns the server (server.shutdown() stops it)."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):   # scrapes every few seconds would flood stderr
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+class FileSink:
+    """Rewrites `path` with render() every `interval` seconds on a daemon thread."""
+
+    def __init__(self, path=METRICS_FILE, interval=METRICS_INTERVAL, metrics=METRICS):
+        self.path     = path
+        self.interval = interval
+        self.metrics  = metrics
+        self._stop    = threading.Event()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        threading.Thread(target=self._loop, name="metrics-file", daemon=True).start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        try:
+            self.metrics.write(self.path)
+        except OSError:
+            pass   # a full disk or vanished directory must not take the app down
+
+    def close(self):
+        self._stop.set()
+        self.flush()
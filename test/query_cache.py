@@ -0,0 +1,110 @@
+# ============================================================
+# query_cache.py — two-tier result cache for hybrid_search
+#
+#   tier 1  exact:    normalized query text + search params
+#   tier 2  semantic: cosine(query embedding, cached embedding)
+#                     >= threshold, same params, same numbers
+# Numbers (years, amounts, ASU codes) must match exactly for a
+# semantic hit: "revenues 2023" and "revenues 2024" embed almost
+# identically but must never share results.
+# Entries are LRU-evicted beyond max_entries and expire after ttl
+# seconds; bind() drops everything when the corpus version changes.
+# ============================================================
+
+import re, threading, time
+from collections import OrderedDict
+
+import numpy as np
+
+from sparse_index import tokenize
+
+
+def normalize_query(query):
+    return " ".join(tokenize(query))
+
+
+def _numbers(norm):
+    return frozenset(re.findall(r"\d+", norm))
+
+
+class QueryCache:
+    def __init__(self, max_entries=512, ttl=900.0, sim_threshold=0.95):
+        self.max_entries   = max_entries
+        self.ttl           = ttl
+        self.sim_threshold = sim_threshold
+        self.version       = None
+        self._entries      = OrderedDict()   # (norm, params) -> (t, numbers, embedding, result)
+        self._lock         = threading.Lock()
+        self.hits_exact    = 0
+        self.hits_semantic = 0
+        self.misses        = 0
+
+    def bind(self, version):
+        """Attach the cache to a corpus version; a different version invalidates every entry."""
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _expired(self, t, now):
+        return self.ttl is not None and now - t > self.ttl
+
+    def get(self, query, params):
+        """Exact-tier lookup. A miss here is not counted; call get_similar() next."""
+        key = (normalize_query(query), params)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry[0], now):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.hits_exact += 1
+            return list(entry[3])
+
+    def get_similar(self, query, params, embedding):
+        """Semantic-tier lookup against entries with the same params and numbers."""
+        norm    = normalize_query(query)
+        numbers = _numbers(norm)
+        now     = time.monotonic()
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if self._expired(e[0], now)]:
+                del self._entries[key]
+            cands = [(k, e) for k, e in self._entries.items()
+                     if k[1] == params and e[1] == numbers and e[2] is not None]
+            if cands:
+                sims = np.stack([e[2] for _, e in cands]) @ embedding
+                best = int(np.argmax(sims))
+                if sims[best] >= self.sim_threshold:
+                    key, entry = cands[best]
+                    self._entries.move_to_end(key)
+                    self.hits_semantic += 1
+                    return list(entry[3])
+            self.misses += 1
+            return None
+
+    def put(self, query, params, result, embedding=None):
+        norm = normalize_query(query)
+        emb  = None if embedding is None else np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._entries[(norm, params)] = (time.monotonic(), _numbers(norm), emb, list(result))
+            self._entries.move_to_end((norm, params))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        hits  = self.hits_exact + self.hits_semantic
+        total = hits + self.misses
+        return {
+            "entries":       len(self._entries),
+            "hits_exact":    self.hits_exact,
+            "hits_semantic": self.hits_semantic,
+            "misses":        self.misses,
+            "hit_rate":      hits / total if total else 0.0,
+        }
@@ -0,0 +1,113 @@
+# ============================================================
+# rerank.py — cross-encoder rerank stage after RRF fusion
+#
+# Scores (query, chunk) pairs with a local cross-encoder on CPU, all
+# candidates of all queries in one batched forward pass. Scores are
+# cached per (normalized query, chunk id), so repeated and overlapping
+# searches only score the new pairs. The forward pass runs on a
+# worker thread under a latency budget: if it overruns, the caller
+# gets plain RRF order back (flagged as not reranked) while the pass
+# finishes in the background and fills the cache for the next call.
+# While that pass is still running, calls that need new scores get RRF
+# order at once instead of queueing behind it on the single worker.
+# Torch's thread count is process-wide and left to the caller.
+# ============================================================
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+
+from sentence_transformers import CrossEncoder
+
+from query_cache import normalize_query
+
+RERANK_MODEL = "BAAI/bge-reranker-base"
+
+
+class Reranker:
+    def __init__(self, model_name=RERANK_MODEL, budget=0.8, max_length=512, batch_size=32,
+                 max_entries=20_000):
+        self.model       = CrossEncoder(model_name, device="cpu", max_length=max_length)
+        self.budget      = budget
+        self.batch_size  = batch_size
+        self.max_entries = max_entries
+        self._scores     = OrderedDict()   # (norm query, chunk id) -> score
+        self._lock       = threading.Lock()
+        self._pool       = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self._running    = None   # future of the last forward pass
+        self.hits        = 0
+        self.misses      = 0
+        self.fallbacks   = 0
+        self.model.predict([("warm up", "warm up")])   # first real query should not pay for lazy init
+
+    def _score(self, pairs, keys):
+        scores = self.model.predict(pairs, batch_size=self.batch_size,
+                                    show_progress_bar=False)
+        with self._lock:
+            for key, s in zip(keys, scores):
+                self._scores[key] = float(s)
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+    def rerank_batch(self, queries, candidates, top_n, budget=None):
+        """Rerank candidates[i] (chunks in RRF order) for queries[i]; returns ([chunks], reranked).
+        reranked is False when the budget ran out, or another pass still holds the worker, and every
+        list is its RRF prefix instead."""
+        budget = self.budget if budget is None else budget
+        norms  = [normalize_query(q) for q in queries]
+        pairs, keys, queued = [], [], set()
+        with self._lock:
+            for q, norm, chunks in zip(queries, norms, candidates):
+                for c in chunks:
+                    key = (norm, c["id"])
+                    if key in self._scores:
+                        self._scores.move_to_end(key)
+                        self.hits += 1
+                    elif key not in queued:
+                        self.misses += 1
+                        pairs.append((q, c["content"]))
+                        keys.append(key)
+                        queued.add(key)
+
+        if pairs:
+            with self._lock:
+                busy = self._running is not None and not self._running.done()
+                if busy:
+                    self.fallbacks += 1
+                else:
+                    fut = self._running = self._pool.submit(self._score, pairs, keys)
+            if busy:
+                return [list(chunks[:top_n]) for chunks in candidates], False
+            try:
+                fut.result(timeout=budget)
+            except FuturesTimeout:
+                with self._lock:
+                    self.fallbacks += 1
+                return [list(chunks[:top_n]) for chunks in candidates], False
+
+        out = []
+        with self._lock:
+            for norm, chunks in zip(norms, candidates):
+                # stable: RRF order breaks ties
+                ranked = sorted(chunks, key=lambda c: -self._scores.get((norm, c["id"]), float("-inf")))
+                out.append(ranked[:top_n])
+        return out, True
+
+    def rerank(self, query, candidates, top_n, budget=None):
+        out, reranked = self.rerank_batch([query], [candidates], top_n, budget)
+        return out[0], reranked
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries":   len(self._scores),
+            "hits":      self.hits,
+            "misses":    self.misses,
+            "fallbacks": self.fallbacks,
+            "hit_rate":  self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,345 @@
+# ============================================================
+# retrieval.py — hybrid retrieval engine, importable without Streamlit
+#
+# Retriever owns everything hybrid_search needs: the Chroma
+# collection, the memory-mapped snapshot (corpus, BM25, embeddings),
+# the query embedder, the two-tier search cache, the optional
+# reranker and the leg thread pool. app_2.py builds one per process
+# inside st.cache_resource; benchmarks and evaluation runners build
+# their own with Retriever.load().
+#
+#   retriever = Retriever.load()
+#   chunks    = retriever.hybrid_search("total revenues 2025", content_type="table")
+#   chunks    = retriever.execute_tool("table_search", {"query": "total revenues"})
+#
+# Tools return chunks; tools.py holds their schema and renders them
+# as the tool_result text the conversation sends.
+# ============================================================
+
+import os, time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+
+import chromadb
+import numpy as np
+
+from dense_index import EXACT_MAX_DOCS
+from embedding import CachedEmbedder, QueryEmbedder
+from fusion import rrf_positions
+from metrics import METRICS
+from query_cache import QueryCache, normalize_query
+from rerank import Reranker
+from singleflight import SingleFlight
+from snapshot import RetrieverSnapshot
+from sparse_index import tokenize
+from tools import TOOL_CONTENT_TYPES, tool_filters, tool_searches
+
+BASE_DIR        = os.path.dirname(os.path.abspath(__file__))
+CHROMA_PATH     = os.path.join(BASE_DIR, "alphabet_10k_db")
+SNAPSHOT_PATH   = os.path.join(BASE_DIR, "alphabet_10k_snapshot")   # memory-mapped corpus + BM25 index, versioned per collection
+COLLECTION_NAME = "langchain"
+TOOL_WORKERS    = 4       # concurrent tool calls per worker process
+LEG_TIMEOUT     = 5.0     # seconds per retrieval leg before hybrid_search degrades to the other leg
+EMBED_BACKEND   = os.environ.get("EMBED_BACKEND", "torch")   # torch | onnx | int8, see embedding.py
+EMBED_THREADS   = int(os.environ.get("EMBED_THREADS", "0")) or None   # onnx / int8 session threads; None: runtime default
+RERANK          = os.environ.get("RERANK", "0") == "1"   # cross-encoder pass over the fused candidates; downloads the model
+RERANK_BUDGET   = 0.8     # seconds for the rerank pass before falling back to RRF order
+
+STAGES = ("embed", "dense", "sparse", "fusion", "rerank", "total")
+
+
+class SearchResult(list):
+    """Fused chunks, plus per-stage timings (seconds) and the legs that were dropped."""
+    def __init__(self, chunks=(), timings=None, degraded=()):
+        super().__init__(chunks)
+        self.timings  = timings or {}
+        self.degraded = list(degraded)
+
+
+def _timed(fn, *args):
+    t0  = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - t0
+
+
+def record_search(timings, degraded=(), calls=1):
+    """Feed one search (or one batched group of `calls` searches sharing timings) into METRICS."""
+    outcome = "cached" if "cache" in timings else "degraded" if degraded else "searched"
+    METRICS.inc("rag_search_total", calls, outcome=outcome)
+    for stage in STAGES:
+        if stage in timings:
+            METRICS.observe("rag_stage_seconds", timings[stage], stage=stage)
+
+
+def search_filters(content_type=None, filters=None):
+    """One metadata filter for both legs: {field: value or list}, None values dropped."""
+    flt = {f: v for f, v in (filters or {}).items() if v is not None}
+    if content_type:
+        flt["content_type"] = content_type
+    return flt
+
+
+def _freeze(flt):
+    return tuple(sorted((f, tuple(v) if isinstance(v, (list, tuple)) else v) for f, v in flt.items()))
+
+
+def chroma_where(flt):
+    conds = [{f: {"$in": list(v)} if isinstance(v, (list, tuple)) else v} for f, v in sorted(flt.items())]
+    if not conds:
+        return None
+    return conds[0] if len(conds) == 1 else {"$and": conds}
+
+
+class Retriever:
+    def __init__(self, collection, snapshot, embed_fn, query_cache, reranker=None, leg_pool=None,
+                 leg_timeout=LEG_TIMEOUT):
+        self.collection     = collection
+        self.snapshot       = snapshot
+        self.embed_fn       = embed_fn
+        self.sparse_index   = snapshot.sparse
+        self.corpus_docs    = snapshot.docs
+        self.corpus_meta    = snapshot.metas
+        self.corpus_version = snapshot.fingerprint
+        # small collections: exact matrix-multiply dense search on the snapshot instead of HNSW
+        self.exact_index    = snapshot.dense if snapshot.dense.usable(EXACT_MAX_DOCS) else None
+        self.query_cache    = query_cache
+        self.reranker       = reranker
+        # separate from the tool pool: tool threads block on these futures
+        self.leg_pool       = leg_pool or ThreadPoolExecutor(max_workers=2 * TOOL_WORKERS,
+                                                             thread_name_prefix="leg")
+        self.leg_timeout    = leg_timeout
+        self.tool_top_n     = 5   # chunks per tool result
+        # identical tool calls already running (same sample question from several sessions) are shared
+        self.tool_flight    = SingleFlight("tool")
+        query_cache.bind(self.corpus_version)
+
+    @classmethod
+    def load(cls, chroma_path=CHROMA_PATH, snapshot_path=SNAPSHOT_PATH, collection_name=COLLECTION_NAME,
+             embed_backend=EMBED_BACKEND, embed_threads=EMBED_THREADS, rerank=RERANK,
+             query_cache=None, reranker=None, leg_pool=None):
+        client   = chromadb.PersistentClient(path=chroma_path)
+        # query vectors are always passed explicitly, so the collection needs no embedding function
+        # warmed up before the first query; the LRU lives as long as the Retriever
+        embed_fn = CachedEmbedder(QueryEmbedder(embed_backend, threads=embed_threads), max_entries=4096)
+        # read only: search_ef is part of the collection config, set by ingest.py
+        col = client.get_collection(name=collection_name)
+        snap = RetrieverSnapshot.open_or_build(snapshot_path, col)
+        if reranker is None and rerank:
+            reranker = Reranker(budget=RERANK_BUDGET)
+        query_cache = query_cache or QueryCache(max_entries=512, ttl=900, sim_threshold=0.95)
+        return cls(col, snap, embed_fn, query_cache, reranker, leg_pool)
+
+    def stats(self):
+        """Index and cache figures (the app sidebar, service.py /stats)."""
+        return {"chunks":          self.collection.count(),
+                "search_cache":    self.query_cache.stats(),
+                "embedding_cache": self.embed_fn.stats(),
+                "rerank_cache":    self.reranker.stats() if self.reranker is not None else None,
+                "coalesced":       {"tool": self.tool_flight.stats()}}
+
+    # ── legs ──────────────────────────────────────────────────
+    def _dense_leg(self, q_emb, flt, fetch):
+        if self.exact_index is not None:
+            return self.exact_index.top_k(q_emb, fetch, self.sparse_index.positions(flt) if flt else None)
+        kw = dict(query_embeddings=[q_emb.tolist()],
+                  n_results=min(fetch, self.collection.count()),
+                  include=["distances"])   # ids only; content comes from the memory-mapped snapshot
+        if flt:
+            kw["where"] = chroma_where(flt)
+        return self._corpus_positions(self.collection.query(**kw)["ids"][0])
+
+    def _dense_batch(self, q_embs, flt, fetch):
+        """Dense leg for many queries sharing one filter (one matmul, or one multi-query Chroma call)."""
+        if self.exact_index is not None:
+            return self.exact_index.top_k_batch(q_embs, fetch,
+                                                self.sparse_index.positions(flt) if flt else None)
+        kw = dict(query_embeddings=q_embs.tolist(),
+                  n_results=min(fetch, self.collection.count()),
+                  include=["distances"])
+        if flt:
+            kw["where"] = chroma_where(flt)
+        return [self._corpus_positions(ids) for ids in self.collection.query(**kw)["ids"]]
+
+    def _sparse_leg(self, query, flt, fetch):
+        return [idx for _, idx in self.sparse_index.top_k(tokenize(query), fetch, flt)]
+
+    def _corpus_positions(self, ids):
+        index = self.snapshot.id_index
+        return [index[i] for i in ids if i in index]
+
+    def make_chunk(self, idx):
+        return {"id":self.snapshot.ids[idx], "content":self.corpus_docs[idx], "metadata":self.corpus_meta[idx]}
+
+    def rrf_fuse(self, dense, sparse, top_n, k):
+        return [self.make_chunk(i) for i in rrf_positions(dense, sparse, top_n, k)]
+
+    # ── search ────────────────────────────────────────────────
+    @staticmethod
+    def _recorded(result):
+        record_search(result.timings, result.degraded)
+        return result
+
+    def hybrid_search(self, query, content_type=None, top_n=5, fetch=20, k=60, leg_timeout=None,
+                      filters=None, rerank=True):
+        """Hybrid dense + BM25 search. `filters` ({"ticker", "fiscal_year", "item_number", ...}) is
+        applied to both legs, so results never mix filings the caller did not ask for. With the
+        reranker loaded, the top `fetch` fused candidates are cross-encoded and the best top_n kept."""
+        t0          = time.perf_counter()
+        leg_timeout = self.leg_timeout if leg_timeout is None else leg_timeout
+        flt         = search_filters(content_type, filters)
+        rerank      = rerank and self.reranker is not None
+        params      = (_freeze(flt), top_n, fetch, k, rerank)
+        cached      = self.query_cache.get(query, params)
+        if cached is not None:
+            return self._recorded(SearchResult(cached, timings={"cache": time.perf_counter() - t0}))
+
+        # sparse leg needs no embedding, so it starts first and overlaps the BGE-M3 forward pass
+        started  = {"sparse": time.perf_counter()}
+        futures  = {"sparse": self.leg_pool.submit(_timed, self._sparse_leg, query, flt, fetch)}
+        q_emb, t = _timed(lambda: np.asarray(self.embed_fn([query])[0], dtype=np.float32))
+        timings  = {"embed": t}
+
+        cached = self.query_cache.get_similar(query, params, q_emb)
+        if cached is not None:
+            timings["cache"] = time.perf_counter() - t0
+            return self._recorded(SearchResult(cached, timings=timings))
+
+        started["dense"] = time.perf_counter()
+        futures["dense"] = self.leg_pool.submit(_timed, self._dense_leg, q_emb, flt, fetch)
+
+        # degraded mode: a leg that errors or overruns its timeout is dropped, the other is fused alone
+        legs, degraded, error = {}, [], None
+        for name in ("dense", "sparse"):
+            remaining = leg_timeout - (time.perf_counter() - started[name])
+            try:
+                legs[name], timings[name] = futures[name].result(timeout=max(remaining, 0))
+            except FuturesTimeout:
+                degraded.append(name)
+            except Exception as e:
+                degraded.append(name)
+                error = error or e
+        if not legs:
+            if error:
+                raise error
+            return self._recorded(SearchResult(timings=timings, degraded=degraded))
+
+        t_fuse = time.perf_counter()
+        result = self.rrf_fuse(legs.get("dense", []), legs.get("sparse", []), fetch if rerank else top_n, k)
+        timings["fusion"] = time.perf_counter() - t_fuse
+        if rerank:
+            (result, reranked), timings["rerank"] = _timed(self.reranker.rerank, query, result, top_n)
+            if not reranked:
+                degraded.append("rerank")
+        timings["total"]  = time.perf_counter() - t0
+        if not degraded:
+            self.query_cache.put(query, params, result, q_emb)
+        return self._recorded(SearchResult(result, timings=timings, degraded=degraded))
+
+    def hybrid_search_batch(self, queries, content_types=None, top_n=5, fetch=20, k=60, filters=None,
+                            rerank=True):
+        """hybrid_search for many queries: cache lookups first, then one BGE-M3 batch for the misses,
+        and per distinct filter one batched dense search (_dense_batch) plus one vectorized BM25 pass
+        (Chroma applies a single `where` to every query in a call). `filters` is one dict per query
+        (or None). Each group is reranked in one cross-encoder pass. Returns SearchResults in order."""
+        t0            = time.perf_counter()
+        content_types = list(content_types or [None] * len(queries))
+        flts          = [search_filters(ct, f) for ct, f in zip(content_types, filters or [None] * len(queries))]
+        rerank        = rerank and self.reranker is not None
+        params        = [(_freeze(flt), top_n, fetch, k, rerank) for flt in flts]
+        results       = [None] * len(queries)
+
+        for i, q in enumerate(queries):
+            cached = self.query_cache.get(q, params[i])
+            if cached is not None:
+                results[i] = self._recorded(SearchResult(cached, timings={"cache": time.perf_counter() - t0}))
+        misses = [i for i, r in enumerate(results) if r is None]
+        if not misses:
+            return results
+
+        t_embed = time.perf_counter()
+        embs    = np.asarray(self.embed_fn([queries[i] for i in misses]), dtype=np.float32)
+        timings = {"embed": time.perf_counter() - t_embed}
+        groups  = {}
+        for i, emb in zip(misses, embs):
+            cached = self.query_cache.get_similar(queries[i], params[i], emb)
+            if cached is not None:
+                results[i] = self._recorded(
+                    SearchResult(cached, timings={**timings, "cache": time.perf_counter() - t0}))
+            else:
+                groups.setdefault(params[i][0], []).append((i, emb))
+
+        for frozen, members in groups.items():
+            idxs     = [i for i, _ in members]
+            flt      = flts[idxs[0]]
+            sparse_f = self.leg_pool.submit(_timed, self.sparse_index.top_k_batch,
+                                            [tokenize(queries[i]) for i in idxs], fetch, flt)
+            dense, t_dense   = _timed(self._dense_batch, np.stack([emb for _, emb in members]), flt, fetch)
+            sparse, t_sparse = sparse_f.result()
+
+            t_fuse = time.perf_counter()
+            fused  = [self.rrf_fuse(dense[j], [idx for _, idx in sparse[j]],
+                                    fetch if rerank else top_n, k)
+                      for j in range(len(idxs))]
+            group_timings = {**timings, "dense": t_dense, "sparse": t_sparse,
+                             "fusion": time.perf_counter() - t_fuse, "batch_size": len(idxs)}
+            degraded = []
+            if rerank:
+                (fused, reranked), group_timings["rerank"] = _timed(
+                    self.reranker.rerank_batch, [queries[i] for i in idxs], fused, top_n)
+                if not reranked:
+                    degraded.append("rerank")
+            group_timings["total"] = time.perf_counter() - t0
+            record_search(group_timings, degraded, calls=len(idxs))   # one observation per batched pass
+            for (i, emb), result in zip(members, fused):
+                if not degraded:
+                    self.query_cache.put(queries[i], params[i], result, emb)
+                results[i] = SearchResult(result, timings=group_timings, degraded=degraded)
+        return results
+
+    # ── tools ─────────────────────────────────────────────────
+    @staticmethod
+    def tool_key(name, tool_input):
+        """Calls with equal keys return equal results: same tool, normalized query and filters."""
+        return name, normalize_query(tool_input["query"]), _freeze(tool_filters(tool_input))
+
+    def execute_tool(self, name, tool_input):
+        """Chunks for one search tool call ([] for an unknown tool); tools.tool_result_text() renders them."""
+        if name not in TOOL_CONTENT_TYPES:
+            return []
+        result, _ = self.tool_flight.do(self.tool_key(name, tool_input), self._execute_tool, name, tool_input)
+        return result
+
+    def _execute_tool(self, name, tool_input):
+        q = tool_input["query"]
+        for content_type, flt in tool_searches(name, tool_input):
+            chunks = self.hybrid_search(q, content_type=content_type, top_n=self.tool_top_n, filters=flt)
+            if chunks:
+                break
+        return chunks
+
+    def execute_tools(self, calls):
+        """execute_tool for several tool_use blocks through one hybrid_search_batch call per
+        tool_searches() step, each for the calls still empty after the previous one. Calls already running elsewhere, or
+        repeated within `calls`, are computed once. Returns [chunks] in order."""
+        out   = [[] for _ in calls]
+        known = [i for i, b in enumerate(calls) if b.name in TOOL_CONTENT_TYPES]
+        keys  = [self.tool_key(calls[i].name, calls[i].input) for i in known]
+        by_key = dict(zip(keys, (calls[i] for i in known)))
+        found = self.tool_flight.do_many(keys, lambda mine: self._execute_batch([by_key[k] for k in mine]))
+        for i, result in zip(known, found):
+            out[i] = result
+        return out
+
+    def _execute_batch(self, calls):
+        steps   = [tool_searches(b.name, b.input) for b in calls]
+        found   = [[] for _ in calls]
+        pending = list(range(len(calls)))
+        for step in range(max(len(s) for s in steps)):
+            pending = [i for i in pending if not found[i] and step < len(steps[i])]
+            if not pending:
+                break
+            results = self.hybrid_search_batch([calls[i].input["query"] for i in pending],
+                                               [steps[i][step][0] for i in pending], top_n=self.tool_top_n,
+                                               filters=[steps[i][step][1] for i in pending])
+            for i, chunks in zip(pending, results):
+                found[i] = chunks
+        return found
@@ -0,0 +1,150 @@
+# ============================================================
+# routing.py — which model takes each turn of the agent loop
+#
+#   plan = ModelRouting().plan(question)
+#   turn = plan.next_turn(last=iteration == max_iterations)
+#   response = llm.create(**build_request(messages, turn.model, **turn.options))
+#   route = plan.settle(response)   # "select" / "answer"
+#   ...run tools...; plan.evidence(new_chunks)
+#
+# Deciding which search to run is a cheap decision: tool-selection
+# turns go to SMALL_MODEL. Simple questions (short, one period, no
+# comparison or analysis words) stay on it for the answer too. For the
+# rest, the small model picks the first round of searches, forced to
+# search (tool_choice any, capped at SELECT_MAX_TOKENS) so it never
+# writes an answer that would have to be thrown away; from then on the
+# large MODEL decides whether to search again or answer.
+# Early stop: a round of searches that returns no chunk the
+# conversation has not already seen means the evidence has stopped
+# changing, so the next turn must answer (tool_choice none). The last
+# allowed iteration answers too, once anything has been retrieved.
+#   MODEL_ROUTING=0  every turn on MODEL
+#   EARLY_STOP=0     search until the model stops by itself
+# With both off the loop is the single-model one, its last turn made
+# to answer. Prompt caches
+# are per model, so a model switch re-reads the prefix uncached; the
+# per-route figures below show whether the cheaper turns pay for it.
+#
+# Cost: turn_cost() prices usage_stats() with PRICES ($ per million
+# tokens); route_summary() folds per-turn records into turns, seconds,
+# tokens and dollars per route, for results and the eval report.
+# ============================================================
+
+import os
+from collections import namedtuple
+
+from facts import ANALYSIS, YEAR_RE
+from sparse_index import tokenize
+
+MODEL             = "claude-opus-4-5"   # re-exported by agent.py
+SMALL_MODEL       = os.environ.get("SMALL_MODEL", "claude-haiku-4-5")
+MODEL_ROUTING     = os.environ.get("MODEL_ROUTING", "1") != "0"
+EARLY_STOP        = os.environ.get("EARLY_STOP", "1") != "0"
+MAX_TOKENS        = 4096
+SELECT_MAX_TOKENS = 1024   # a forced search turn only writes tool calls
+SIMPLE_MAX_WORDS  = 16
+EVIDENCE_MIN_NEW  = 1      # fewer new chunks than this in a search round: evidence has converged
+
+# $ per million tokens: (input, output). Cache writes cost 1.25x input, cache reads 0.1x.
+PRICES = {
+    "claude-opus-4-5":   (5.0, 25.0),
+    "claude-sonnet-4-5": (3.0, 15.0),
+    "claude-haiku-4-5":  (1.0, 5.0),
+}
+CACHE_WRITE = 1.25
+CACHE_READ  = 0.1
+
+Turn = namedtuple("Turn", "model options")
+
+
+def price(model):
+    """PRICES entry for model, matching dated ids ("claude-haiku-4-5-20251001") by prefix; None if unknown."""
+    for name in sorted(PRICES, key=len, reverse=True):
+        if model.startswith(name):
+            return PRICES[name]
+    return None
+
+
+def turn_cost(model, usage):
+    """Dollar cost of one turn from a usage_stats() dict; 0.0 for unpriced (local, stub) models."""
+    p = price(model)
+    if p is None:
+        return 0.0
+    inp, out = p
+    return (usage.get("input_tokens", 0) * inp
+            + usage.get("output_tokens", 0) * out
+            + usage.get("cache_write_tokens", 0) * inp * CACHE_WRITE
+            + usage.get("cache_read_tokens", 0) * inp * CACHE_READ) / 1e6
+
+
+def is_simple(question):
+    words = tokenize(question)
+    return (len(words) <= SIMPLE_MAX_WORDS and len(set(YEAR_RE.findall(question))) <= 1
+            and not set(words) & ANALYSIS)
+
+
+def route_summary(turns):
+    """{route: {turns, llm_s, input_tokens, output_tokens, cost_usd}} over per-turn records
+    carrying route, llm_s, cost_usd and usage_stats() keys."""
+    out = {}
+    for t in turns:
+        r = out.setdefault(t["route"], {"turns": 0, "llm_s": 0.0, "input_tokens": 0,
+                                        "output_tokens": 0, "cost_usd": 0.0})
+        r["turns"]         += 1
+        r["llm_s"]         += t["llm_s"]
+        r["input_tokens"]  += t.get("input_tokens", 0) + t.get("cache_read_tokens", 0) \
+                              + t.get("cache_write_tokens", 0)
+        r["output_tokens"] += t.get("output_tokens", 0)
+        r["cost_usd"]      += t["cost_usd"]
+    return out
+
+
+class ModelRouting:
+    def __init__(self, large=MODEL, small=SMALL_MODEL, adaptive=MODEL_ROUTING, early_stop=EARLY_STOP):
+        self.large      = large
+        self.small      = small if adaptive else large
+        self.adaptive   = adaptive
+        self.early_stop = early_stop
+
+    @property
+    def key(self):
+        """Identifies the policy in answer-cache keys: answers differ between policies."""
+        if not self.adaptive and not self.early_stop:
+            return self.large
+        return f"{self.small}>{self.large}" + (":early_stop" if self.early_stop else "")
+
+    def plan(self, question):
+        return Plan(self, question)
+
+
+class Plan:
+    """Routing state for one question."""
+
+    def __init__(self, routing, question):
+        self.routing   = routing
+        self.simple    = is_simple(question)
+        self.rounds    = 0       # search rounds so far
+        self.converged = False   # evidence stopped changing
+
+    def next_turn(self, last=False):
+        r      = self.routing
+        answer = self.converged or (last and self.rounds > 0)
+        # a hard question's first turn: the small model picks the searches and must not answer
+        select = r.adaptive and not self.simple and not answer and not last and self.rounds == 0
+        model  = r.small if self.simple or select else r.large
+        options = {"max_tokens": SELECT_MAX_TOKENS if select else MAX_TOKENS}
+        if select:
+            options["tool_choice"] = {"type": "any"}
+        elif answer:
+            options["tool_choice"] = {"type": "none"}
+        return Turn(model, options)
+
+    def settle(self, response):
+        """Route of a finished turn: "select" if it called tools, else "answer"."""
+        return "select" if response.stop_reason == "tool_use" else "answer"
+
+    def evidence(self, new_chunks):
+        """After a search round: new_chunks is how many chunks it added to the conversation."""
+        self.rounds += 1
+        if self.routing.early_stop and new_chunks < EVIDENCE_MIN_NEW:
+            self.converged = True
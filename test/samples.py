@@ -0,0 +1,27 @@
+# ============================================================
+# samples.py — the sample questions, shared by the app and bench
+#
+# app_2.py shows them as buttons in the sidebar ("Try these"); bench.py
+# times them as a latency workload. Labels carry an emoji prefix for the
+# buttons; sample_question() strips it.
+# ============================================================
+
+SAMPLE_QS = [
+    "💰 What were total revenues for fiscal 2024?",
+    "🤖 What are the main AI competition risks?",
+    "💵 Is cash sufficient to cover long-term debt?",
+    "📈 What was Google Services operating income?",
+    "🧾 What are unrecognized tax benefits?",
+    "🏗️ What is the capex plan for 2025?",
+    "🔄 Share repurchase details for fiscal 2024?",
+    "📚 What does ASU 2016-13 refer to?",
+]
+
+
+def sample_question(label):
+    """The question of a sample label, without its emoji prefix."""
+    return label.split(" ", 1)[1]
+
+
+def sample_questions():
+    return [sample_question(q) for q in SAMPLE_QS]
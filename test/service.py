@@ -0,0 +1,291 @@
+# ============================================================
+# service.py — headless async query service
+#
+#   python service.py --port 8700
+#   RAG_SERVICE_URL=http://127.0.0.1:8700 streamlit run app_2.py
+#
+# aiohttp server over one shared Retriever per process:
+#   POST /search  {"query", "content_type"?, "top_n"?, "filters"?}
+#                 -> {"chunks", "timings", "degraded"}
+#   POST /tool    {"name", "input"} -> {"result", "chunks"}
+#   POST /ask     {"question", "stream"?: true}
+#                 -> text/event-stream of AsyncAgent events, or the
+#                    final "done" event as JSON with "stream": false
+#   GET  /stats   index, cache, latency and model cost figures (the
+#                 app sidebar)
+#   GET  /health  slot usage; GET /metrics  Prometheus text
+# The agent loop runs on anthropic.AsyncAnthropic, so one worker holds
+# many conversations while waiting on the model; retrieval is blocking
+# and runs in a TOOL_WORKERS thread pool. Each route has a Gate: at
+# most `limit` requests run, `max_queue` more wait up to `timeout`
+# seconds, and anything beyond is shed with 503 + Retry-After rather
+# than queueing unbounded latency. Limits are per worker process; scale
+# out by running more workers behind a load balancer.
+# Identical questions asked while one is being answered share that
+# run's event stream (SharedStream), and identical tool calls share
+# one search (Retriever.tool_flight). Single-cell table lookups are
+# answered from the fact store (facts.py) before any of that.
+# ============================================================
+
+import argparse, asyncio, json, os, sys, time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from agent import SYSTEM_PROMPT, AsyncAgent, fast_answer
+from answer_cache import AnswerCache
+from facts import FAST_PATH, FactRouter
+from metrics import METRICS
+from retrieval import TOOL_WORKERS, Retriever
+from routing import ModelRouting
+from singleflight import SharedStream
+from tools import TOOL_CONTENT_TYPES, TOOLS, tool_result_text
+
+BASE_DIR          = os.path.dirname(os.path.abspath(__file__))
+ANSWER_CACHE_PATH = os.path.join(BASE_DIR, "answer_cache.sqlite3")   # same file as the app
+SERVICE_PORT      = int(os.environ.get("SERVICE_PORT", "8700"))
+MAX_AGENTS        = int(os.environ.get("SERVICE_MAX_AGENTS", "16"))      # concurrent /ask per worker
+MAX_SEARCHES      = int(os.environ.get("SERVICE_MAX_SEARCHES", str(2 * TOOL_WORKERS)))
+MAX_QUEUE         = int(os.environ.get("SERVICE_MAX_QUEUE", "32"))       # waiters per route before shedding
+QUEUE_TIMEOUT     = float(os.environ.get("SERVICE_QUEUE_TIMEOUT", "5"))  # seconds a waiter may wait
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Gate:
+    """Per-route concurrency limit with a bounded, time-limited wait queue (async context manager)."""
+
+    def __init__(self, route, limit, max_queue=MAX_QUEUE, timeout=QUEUE_TIMEOUT):
+        self.route     = route
+        self.limit     = limit
+        self.max_queue = max_queue
+        self.timeout   = timeout
+        self.active    = 0
+        self.waiting   = 0
+        self._sem      = asyncio.Semaphore(limit)
+
+    def _publish(self):
+        METRICS.set("rag_service_inflight", self.active, route=self.route)
+        METRICS.set("rag_service_queued", self.waiting, route=self.route)
+
+    def _shed(self, reason):
+        METRICS.inc("rag_service_shed_total", route=self.route, reason=reason)
+        return Overloaded(f"{self.route}: {reason}")
+
+    async def __aenter__(self):
+        if self._sem.locked() and self.waiting >= self.max_queue:
+            raise self._shed("queue_full")
+        t0 = time.perf_counter()
+        self.waiting += 1
+        self._publish()
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise self._shed("timeout") from None
+        finally:
+            self.waiting -= 1
+        METRICS.observe("rag_service_queue_seconds", time.perf_counter() - t0, route=self.route)
+        self.active += 1
+        self._publish()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.active -= 1
+        self._sem.release()
+        self._publish()
+
+    def stats(self):
+        return {"limit": self.limit, "active": self.active, "waiting": self.waiting}
+
+
+def _overloaded(e, retry_after=1):
+    return web.json_response({"error": "overloaded", "detail": str(e)}, status=503,
+                             headers={"Retry-After": str(retry_after)})
+
+
+async def _body(request):
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise web.HTTPBadRequest(text="request body must be JSON")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="request body must be a JSON object")
+    return body
+
+
+def _run(request, fn, *args, **kw):
+    """Blocking retriever call on the service's thread pool."""
+    return asyncio.get_running_loop().run_in_executor(request.app["pool"], lambda: fn(*args, **kw))
+
+
+# ── routes ────────────────────────────────────────────────────
+async def search(request):
+    body  = await _body(request)
+    query = str(body.get("query", "")).strip()
+    if not query:
+        raise web.HTTPBadRequest(text="query is required")
+    try:
+        async with request.app["gates"]["search"]:
+            result = await _run(request, request.app["retriever"].hybrid_search, query,
+                                content_type=body.get("content_type"), top_n=int(body.get("top_n", 5)),
+                                filters=body.get("filters"))
+    except Overloaded as e:
+        return _overloaded(e)
+    except ValueError as e:   # unknown filter field
+        raise web.HTTPBadRequest(text=str(e))
+    return web.json_response({"chunks": list(result), "timings": result.timings,
+                              "degraded": result.degraded})
+
+
+async def tool(request):
+    body = await _body(request)
+    name = body.get("name")
+    if name not in TOOL_CONTENT_TYPES or not isinstance(body.get("input"), dict) \
+            or not body["input"].get("query"):
+        raise web.HTTPBadRequest(text=f"name must be one of {sorted(TOOL_CONTENT_TYPES)}, input.query is required")
+    try:
+        async with request.app["gates"]["search"]:
+            with METRICS.time("rag_tool_call_seconds", tool=name):
+                chunks = await _run(request, request.app["retriever"].execute_tool, name, body["input"])
+    except Overloaded as e:
+        return _overloaded(e)
+    return web.json_response({"result": tool_result_text(name, chunks, query=body["input"]["query"]),
+                              "chunks": list(chunks)})
+
+
+async def _agent_events(app, key, question):
+    agent = AsyncAgent(app["retriever"], app["anthropic"], app["pool"], routing=app["routing"])
+    async for event in agent.stream(question):
+        if event["type"] == "done" and event["stop"] == "end_turn":
+            value = {k: event[k] for k in ("answer", "chunks", "trace_lines")}
+            await asyncio.get_running_loop().run_in_executor(
+                None, app["answer_cache"].put, key, question, value)
+        yield event
+
+
+async def _answer_events(app, question):
+    """AsyncAgent events for one question: from the fact-store fast path, from the answer cache,
+    from an identical question already in flight, or from a new agent run."""
+    fast = fast_answer(app["router"], question)   # in-memory, ~0.1 ms: fine on the loop
+    if fast:
+        METRICS.observe("rag_agent_seconds", fast["elapsed_s"], outcome="fast_path")
+        yield {"type": "done", **fast}
+        return
+    key    = AnswerCache.make_key(question, app["routing"].key, SYSTEM_PROMPT, TOOLS,
+                                   app["retriever"].corpus_version)
+    # SQLite calls go to the default executor, not the retrieval pool
+    cached = await asyncio.get_running_loop().run_in_executor(None, app["answer_cache"].get, key)
+    if cached:
+        METRICS.observe("rag_agent_seconds", 0.0, outcome="cache_hit")
+        yield {"type": "done", **cached, "stop": "cache_hit", "cached": True}
+        return
+    async for event in app["questions"].subscribe(key, lambda: _agent_events(app, key, question)):
+        yield event
+
+
+async def ask(request):
+    body     = await _body(request)
+    question = str(body.get("question", "")).strip()
+    if not question:
+        raise web.HTTPBadRequest(text="question is required")
+    try:
+        async with request.app["gates"]["ask"]:
+            if not body.get("stream", True):
+                events = [e async for e in _answer_events(request.app, question)]
+                return web.json_response(events[-1])
+
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream",
+                                                   "Cache-Control": "no-cache",
+                                                   "X-Accel-Buffering": "no"})
+            await response.prepare(request)
+            events = _answer_events(request.app, question)
+            try:
+                async for event in events:
+                    await response.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode())
+            except ConnectionResetError:   # client went away: stop the loop, keep the slot accounting
+                pass
+            except Exception as e:
+                await response.write(f"event: error\ndata: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+                                     .encode())
+            finally:
+                await events.aclose()
+            await response.write_eof()
+            return response
+    except Overloaded as e:
+        return _overloaded(e, retry_after=2)
+
+
+async def stats(request):
+    app = request.app
+    engine = app["retriever"].stats()
+    engine["coalesced"]["question"] = app["questions"].stats()
+    return web.json_response({**engine, "answer_cache": app["answer_cache"].stats(),
+                              "latency": METRICS.summary(),
+                              "cost": METRICS.counters("rag_llm_cost_usd_total"),
+                              "gates": {name: g.stats() for name, g in app["gates"].items()}})
+
+
+async def health(request):
+    return web.json_response({"status": "ok", "gates": {n: g.stats() for n, g in request.app["gates"].items()}})
+
+
+async def metrics(request):
+    return web.Response(text=METRICS.render(), content_type="text/plain", charset="utf-8")
+
+
+# ── app ───────────────────────────────────────────────────────
+async def _startup(app):
+    import anthropic
+    loop             = asyncio.get_running_loop()
+    app["pool"]      = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+    # model loads take seconds; keep the loop responsive to /health meanwhile
+    app["retriever"] = await loop.run_in_executor(None, Retriever.load)
+    app["router"]    = await loop.run_in_executor(
+        None, lambda: FactRouter.for_retriever(app["retriever"]) if FAST_PATH else None)
+    app["answer_cache"] = AnswerCache(app["answer_cache_path"], max_bytes=64 * 1024 * 1024)
+    app["anthropic"] = anthropic.AsyncAnthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
+
+
+async def _cleanup(app):
+    await app["anthropic"].close()
+    app["pool"].shutdown(wait=False, cancel_futures=True)
+    app["retriever"].leg_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def make_app(max_agents=MAX_AGENTS, max_searches=MAX_SEARCHES, max_queue=MAX_QUEUE,
+             queue_timeout=QUEUE_TIMEOUT, answer_cache_path=ANSWER_CACHE_PATH):
+    app = web.Application(client_max_size=64 * 1024)
+    app["answer_cache_path"] = answer_cache_path
+    app["questions"] = SharedStream("question")
+    app["routing"]   = ModelRouting()
+    app["gates"] = {"ask":    Gate("ask", max_agents, max_queue, queue_timeout),
+                    "search": Gate("search", max_searches, max_queue, queue_timeout)}
+    app.on_startup.append(_startup)
+    app.on_cleanup.append(_cleanup)
+    app.router.add_post("/search", search)
+    app.router.add_post("/tool", tool)
+    app.router.add_post("/ask", ask)
+    app.router.add_get("/stats", stats)
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Headless hybrid-search / agent service.")
+    ap.add_argument("--host",          default="127.0.0.1")
+    ap.add_argument("--port",          type=int, default=SERVICE_PORT)
+    ap.add_argument("--max-agents",    type=int, default=MAX_AGENTS)
+    ap.add_argument("--max-searches",  type=int, default=MAX_SEARCHES)
+    ap.add_argument("--max-queue",     type=int, default=MAX_QUEUE)
+    ap.add_argument("--queue-timeout", type=float, default=QUEUE_TIMEOUT)
+    args = ap.parse_args(argv)
+    web.run_app(make_app(args.max_agents, args.max_searches, args.max_queue, args.queue_timeout),
+                host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# ============================================================
+# service_client.py — blocking client for service.py
+#
+# What app_2.py uses when RAG_SERVICE_URL is set: the UI then loads no
+# models or indexes and every question, search and sidebar figure
+# comes from the service. ask() yields the service's SSE events as
+# dicts as they arrive.
+# ============================================================
+
+import json
+
+import httpx
+
+
+class ServiceError(Exception):
+    pass
+
+
+class ServiceBusy(ServiceError):
+    """503 from the service: it shed the request; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"service overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class ServiceClient:
+    def __init__(self, base_url, timeout=10.0, ask_timeout=300.0):
+        self.base_url    = base_url.rstrip("/")
+        self.ask_timeout = ask_timeout
+        self.http        = httpx.Client(base_url=self.base_url, timeout=timeout)
+
+    @staticmethod
+    def _check(response):
+        if response.status_code == 503:
+            raise ServiceBusy(float(response.headers.get("Retry-After", "1")))
+        if response.status_code >= 400:
+            response.read()
+            raise ServiceError(f"{response.status_code}: {response.text[:200]}")
+
+    def _post(self, path, payload):
+        try:
+            response = self.http.post(path, json=payload)
+        except httpx.HTTPError as e:
+            raise ServiceError(f"{self.base_url}{path}: {e}") from e
+        self._check(response)
+        return response.json()
+
+    def search(self, query, content_type=None, top_n=5, filters=None):
+        return self._post("/search", {"query": query, "content_type": content_type, "top_n": top_n,
+                                      "filters": filters})
+
+    def execute_tool(self, name, tool_input):
+        """Chunks for one tool call, like Retriever.execute_tool; the caller renders them."""
+        return self._post("/tool", {"name": name, "input": tool_input})["chunks"]
+
+    def stats(self):
+        try:
+            response = self.http.get("/stats")
+        except httpx.HTTPError as e:
+            raise ServiceError(f"{self.base_url}/stats: {e}") from e
+        self._check(response)
+        return response.json()
+
+    def ask(self, question):
+        """Yield AsyncAgent events ({"type": ...}) for one question; the last one is "done"."""
+        try:
+            with self.http.stream("POST", "/ask", json={"question": question, "stream": True},
+                                  timeout=httpx.Timeout(self.ask_timeout, connect=5.0)) as response:
+                self._check(response)
+                for line in response.iter_lines():
+                    if line.startswith("data: "):
+                        event = json.loads(line[len("data: "):])
+                        if event["type"] == "error":
+                            raise ServiceError(event["error"])
+                        yield event
+        except httpx.HTTPError as e:
+            raise ServiceError(f"{self.base_url}/ask: {e}") from e
@@ -0,0 +1,171 @@
+# ============================================================
+# singleflight.py — coalesce identical in-flight work
+#
+# When many users ask the same thing within seconds (sample-question
+# buttons at market open), only the first request computes; the rest
+# attach to it and share its result.
+#   SingleFlight   threads: do(key, fn) / do_many(keys, fn). Used for
+#                  (tool, query, filters) searches in Retriever and
+#                  whole questions in the Streamlit app.
+#   SharedStream   asyncio: one run of an async generator per key,
+#                  every subscriber gets every event from the start.
+#                  Used for streamed /ask questions in service.py.
+# Nothing is cached: a key is shared only while its computation is
+# running, so a coalesced result is exactly as fresh as the leader's.
+# A leader that is interrupted rather than failed (KeyboardInterrupt, a
+# Streamlit rerun, a cancelled task) leaves its waiters LeaderGone.
+# Both count calls and coalesced calls, in stats() and in METRICS
+# (rag_flight_calls_total / rag_coalesced_total by kind).
+# ============================================================
+
+import asyncio, threading
+from concurrent.futures import Future
+
+from metrics import METRICS
+
+
+class LeaderGone(Exception):
+    """The computation a waiter attached to was interrupted (not failed): the waiter should run it."""
+
+
+class SingleFlight:
+    def __init__(self, kind):
+        self.kind      = kind
+        self._calls    = {}   # key -> Future of the running computation
+        self._lock     = threading.Lock()
+        self.calls     = 0
+        self.coalesced = 0
+
+    def _count(self, calls, coalesced):
+        with self._lock:
+            self.calls     += calls
+            self.coalesced += coalesced
+        METRICS.inc("rag_flight_calls_total", calls, kind=self.kind)
+        if coalesced:
+            METRICS.inc("rag_coalesced_total", coalesced, kind=self.kind)
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key, fn, *args, **kw):
+        """fn(*args, **kw), unless the same key is already running: then wait for that result.
+        Returns (result, shared). The leader's exception is raised in every waiter; if the leader is
+        interrupted instead (KeyboardInterrupt, a Streamlit rerun), waiters get LeaderGone."""
+        (result, shared), = self._run([key], lambda keys: [fn(*args, **kw)])
+        return result, shared
+
+    def do_many(self, keys, fn):
+        """fn(leader_keys) -> results, called only for the keys nobody else is computing (duplicates
+        within `keys` run once). Returns results in `keys` order. Our own keys are computed before
+        waiting on anyone else's, so two overlapping batches cannot deadlock."""
+        return [result for result, _ in self._run(keys, fn)]
+
+    def _run(self, keys, fn):
+        futures, mine = {}, []
+        with self._lock:
+            for key in keys:
+                if key in futures:
+                    continue
+                fut = self._calls.get(key)
+                if fut is None:
+                    fut = self._calls[key] = Future()
+                    mine.append(key)
+                futures[key] = fut
+        self._count(len(keys), len(keys) - len(mine))
+
+        if mine:
+            error = None
+            try:
+                results = list(fn(mine))
+                if len(results) != len(mine):
+                    raise ValueError(f"{self.kind}: fn returned {len(results)} results for {len(mine)} keys")
+                for key, result in zip(mine, results):
+                    futures[key].set_result(result)
+            except BaseException as e:
+                error = e if isinstance(e, Exception) else LeaderGone(repr(e))
+                raise
+            finally:
+                # no waiter may be left blocked on a key this call owned, whatever happened above
+                for key in mine:
+                    if not futures[key].done():
+                        futures[key].set_exception(error or LeaderGone(f"{self.kind}: no result for {key!r}"))
+                with self._lock:
+                    for key in mine:
+                        self._calls.pop(key, None)
+        return [(futures[key].result(), key not in mine) for key in keys]
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._calls),
+                    "rate": self.coalesced / self.calls if self.calls else 0.0}
+
+
+class _Run:
+    def __init__(self):
+        self.events   = []
+        self.finished = False
+        self.error    = None
+        self.task     = None   # the loop only keeps weak references to tasks
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self):
+        i = 0
+        while True:
+            while i < len(self.events):
+                yield self.events[i]
+                i += 1
+            if self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class SharedStream:
+    """asyncio counterpart of SingleFlight for event streams. The generator runs in its own task,
+    so it finishes (and e.g. fills caches) even if the subscriber that started it disconnects."""
+
+    def __init__(self, kind):
+        self.kind      = kind
+        self._runs     = {}
+        self.calls     = 0
+        self.coalesced = 0
+
+    def subscribe(self, key, factory):
+        """Async iterator over the events of factory() (an async generator), shared per key."""
+        self.calls += 1
+        METRICS.inc("rag_flight_calls_total", kind=self.kind)
+        run = self._runs.get(key)
+        if run is None:
+            run = self._runs[key] = _Run()
+            run.task = asyncio.get_running_loop().create_task(self._pump(key, run, factory()))
+        else:
+            self.coalesced += 1
+            METRICS.inc("rag_coalesced_total", kind=self.kind)
+        return run.follow()
+
+    async def _pump(self, key, run, events):
+        """Runs the generator; followers always see the end: its events, then return, the
+        generator's exception, or LeaderGone if the run was cancelled."""
+        try:
+            async for event in events:
+                run.events.append(event)
+                run.notify()
+        except Exception as e:
+            run.error = e
+        except BaseException as e:   # CancelledError (shutdown), KeyboardInterrupt
+            run.error = LeaderGone(repr(e))
+            raise
+        finally:
+            run.finished = True
+            self._runs.pop(key, None)
+            run.notify()
+
+    def stats(self):
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._runs),
+                "rate": self.coalesced / self.calls if self.calls else 0.0}
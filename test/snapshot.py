@@ -0,0 +1,184 @@
+# ============================================================
+# snapshot.py — versioned on-disk retriever snapshot
+#
+# Everything load_retriever() used to rebuild on every cold start
+# (documents, metadatas, tokenized corpus, BM25 statistics) is
+# written once per collection version and memory-mapped afterwards:
+#   <root>/v<FORMAT>-<fingerprint>/
+#       manifest.json
+#       docs.npy   doc_offsets.npy     utf-8 documents
+#       metas.npy  meta_offsets.npy    json metadatas
+#       tokens.npy tok_offsets.npy     token ids (sparse vocab)
+#       embeddings.npy                 float32 (N, dim), for ExactIndex
+#       sparse/                        SparseIndex
+# The fingerprint hashes the collection id, every chunk id (ingest's
+# ids are content hashes) and the REVISION_KEY marker ingest.py writes
+# into the collection metadata whenever a run changes the contents, so
+# a cold start reads ids only, never the corpus. Writers other than
+# ingest.py must bump the marker too. A rebuild keeps the previous
+# version, which running workers may still have memory-mapped; older
+# ones are pruned once their successor is SNAPSHOT_GRACE seconds old.
+# ============================================================
+
+import hashlib, json, os, shutil, time, uuid
+
+import numpy as np
+
+from dense_index import ExactIndex
+from sparse_index import SparseIndex, tokenize
+
+FORMAT_VERSION = 5
+REVISION_KEY   = "content_revision"   # collection metadata, bumped by ingest.py on every change
+SNAPSHOT_GRACE = float(os.environ.get("SNAPSHOT_GRACE", "3600"))   # seconds a superseded version is kept
+
+
+def collection_fingerprint(collection_id, ids, revision=None):
+    """Digest of a collection version: its id, chunk ids (independent of fetch order) and revision."""
+    h = hashlib.sha1(f"{collection_id}\1{revision or ''}".encode())
+    for i in sorted(ids):
+        h.update(b"\0" + i.encode())
+    return h.hexdigest()
+
+
+def collection_revision(collection):
+    return (collection.metadata or {}).get(REVISION_KEY)
+
+
+def prune_versions(root, keep, grace=SNAPSHOT_GRACE, now=None):
+    """Delete snapshot versions under `root` except `keep` and the one before it; any other
+    version goes once the version that replaced it has been published for `grace` seconds."""
+    now      = time.time() if now is None else now
+    versions = sorted((os.path.getmtime(os.path.join(root, n)), os.path.join(root, n))
+                      for n in os.listdir(root) if ".tmp-" not in n)
+    previous = [p for _, p in versions if p != keep][-1:]
+    for (_, path), (successor_mtime, _) in zip(versions, versions[1:]):
+        if path != keep and path not in previous and now - successor_mtime > grace:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class BlobList:
+    """Read-only sequence over a memory-mapped byte blob, decoded per item."""
+
+    def __init__(self, blob, offsets, decode):
+        self._blob    = blob
+        self._offsets = offsets
+        self._decode  = decode
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._decode(self._blob[self._offsets[i]:self._offsets[i+1]].tobytes())
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    @staticmethod
+    def pack(items, encode):
+        parts   = [encode(x) for x in items]
+        offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in parts], out=offsets[1:])
+        return np.frombuffer(b"".join(parts), dtype=np.uint8), offsets
+
+
+def _utf8(b):
+    return b.decode("utf-8")
+
+
+def _json(b):
+    return json.loads(b)
+
+
+class RetrieverSnapshot:
+    def __init__(self, path, manifest):
+        load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        self.path        = path
+        self.manifest    = manifest
+        self.fingerprint = manifest["fingerprint"]
+        self.ids         = manifest["ids"]
+        self.id_index    = {cid: i for i, cid in enumerate(self.ids)}   # chroma id -> corpus position
+        self.docs        = BlobList(load("docs"),   load("doc_offsets"),  _utf8)
+        self.metas       = BlobList(load("metas"),  load("meta_offsets"), _json)
+        self.tokens      = load("tokens")
+        self.tok_offsets = load("tok_offsets")
+        self.sparse      = SparseIndex.load(os.path.join(path, "sparse"))
+        self.dense       = ExactIndex(load("embeddings"))
+
+    def doc_tokens(self, i):
+        """Token ids of corpus doc i, in the sparse index vocabulary."""
+        return self.tokens[self.tok_offsets[i]:self.tok_offsets[i+1]]
+
+    @staticmethod
+    def version_dir(root, fingerprint):
+        return os.path.join(root, f"v{FORMAT_VERSION}-{fingerprint[:16]}")
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"snapshot at {path} has format {manifest.get('format_version')}")
+        return cls(path, manifest)
+
+    @classmethod
+    def build(cls, root, collection_id, ids, docs, metas, embeddings, revision=None, tok=tokenize):
+        fp        = collection_fingerprint(collection_id, ids, revision)
+        path      = cls.version_dir(root, fp)
+        tmp       = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+        tokenized = [tok(d) for d in docs]
+        os.makedirs(tmp)
+
+        sparse  = SparseIndex.build(os.path.join(tmp, "sparse"), ids, tokenized, metas)
+        tok_ids = [np.array([sparse.vocab[t] for t in toks], dtype=np.int32) for toks in tokenized]
+        tok_offsets = np.zeros(len(tok_ids) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in tok_ids], out=tok_offsets[1:])
+
+        arrays = {"tokens": np.concatenate(tok_ids) if tok_ids else np.zeros(0, np.int32),
+                  "tok_offsets": tok_offsets,
+                  "embeddings": np.asarray(embeddings, dtype=np.float32)}
+        arrays["docs"],  arrays["doc_offsets"]  = BlobList.pack(docs,  lambda d: d.encode("utf-8"))
+        arrays["metas"], arrays["meta_offsets"] = BlobList.pack(metas, lambda m: json.dumps(m or {}).encode())
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), arr)
+
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "fingerprint":    fp,
+            "collection_id":  str(collection_id),
+            "revision":       revision,
+            "num_docs":       len(docs),
+            "created":        time.time(),
+            "ids":            list(ids),
+        }
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        del sparse   # release the mmaps before renaming (required on Windows)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # another worker published the same version first
+            shutil.rmtree(tmp, ignore_errors=True)
+        return cls.load(path)
+
+    @classmethod
+    def open_or_build(cls, root, collection, tok=tokenize):
+        """Open the snapshot matching `collection`, building it (and pruning old versions) if needed.
+        Only ids and the revision marker are read to fingerprint; the corpus only on a rebuild."""
+        revision = collection_revision(collection)
+        fp       = collection_fingerprint(collection.id, collection.get(include=[])["ids"], revision)
+        try:
+            return cls.load(cls.version_dir(root, fp))
+        except (OSError, ValueError, KeyError):
+            pass
+
+        res  = collection.get(include=["documents", "metadatas", "embeddings"])
+        snap = cls.build(root, collection.id, res["ids"], res["documents"], res["metadatas"],
+                         res["embeddings"], revision, tok)
+        prune_versions(root, snap.path)
+        return snap
@@ -0,0 +1,256 @@
+# ============================================================
+# sparse_index.py — persisted, memory-mapped BM25 inverted index
+#
+# Replaces BM25Okapi.get_scores() (which scores every document in
+# pure Python) with term-at-a-time scoring over compact postings:
+#   offsets.npy   int64   [V+1]  posting range per term
+#   post_doc.npy  int32   [P]    internal doc id, ascending per term
+#   post_w.npy    float32 [P]    precomputed BM25 tf/length weight
+#   idf.npy       float32 [V]    Okapi IDF (rank_bm25 semantics)
+#   doc_len.npy   int32   [N]    tokens per doc
+#   doc_map.npy   int32   [N]    internal id -> corpus position
+#   vocab.json / meta.json
+# Each build is written to its own version directory under the index
+# path; the CURRENT file names the live one and is swapped atomically,
+# so a reader sees the old or the new index, never a missing one.
+# Internal ids are sorted by (ticker, fiscal_year, form_type,
+# content_type, item_number), so each filing, and each content type or
+# Item inside it, is a contiguous id range ("shard"). A filter selects
+# the matching ranges up front and scoring only touches those slices.
+# ============================================================
+
+import json, os, re, shutil, uuid
+from collections import Counter
+
+import numpy as np
+
+FORMAT_VERSION   = 3
+ARRAYS           = ["offsets", "post_doc", "post_w", "idf", "doc_len", "doc_map"]
+PARTITION_FIELDS = ("ticker", "fiscal_year", "form_type", "content_type", "item_number")
+
+
+def tokenize(text):
+    return re.sub(r"[^a-z0-9\s]", " ", text.lower()).split()
+
+
+def _partition_key(meta):
+    meta = meta or {}
+    return tuple(str(meta.get(f) or "") for f in PARTITION_FIELDS)
+
+
+class SparseIndex:
+    def __init__(self, path, meta, terms, arrays):
+        self.path       = path
+        self.meta       = meta
+        self.terms      = terms
+        self.vocab      = {t: i for i, t in enumerate(terms)}
+        self.ids        = meta["ids"]
+        self.partitions = [(tuple(p[:-2]), p[-2], p[-1]) for p in meta["partitions"]]   # (key, lo, hi)
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def __len__(self):
+        return int(self.meta["num_docs"])
+
+    # ── build / persist ───────────────────────────────────────
+    @classmethod
+    def build(cls, path, ids, tokenized, metas, k1=1.5, b=0.75, epsilon=0.25):
+        n     = len(tokenized)
+        keys  = [_partition_key(m) for m in metas]
+        order = sorted(range(n), key=keys.__getitem__)   # stable: keeps corpus order inside a partition
+
+        partitions = []
+        for internal, idx in enumerate(order):
+            if partitions and partitions[-1][:-2] == list(keys[idx]):
+                partitions[-1][-1] = internal + 1
+            else:
+                partitions.append([*keys[idx], internal, internal + 1])
+
+        doc_len = np.array([len(tokenized[i]) for i in order], dtype=np.int32)
+        avgdl   = float(doc_len.sum()) / n if n else 0.0
+
+        postings = {}
+        for internal, idx in enumerate(order):
+            for term, tf in Counter(tokenized[idx]).items():
+                postings.setdefault(term, []).append((internal, tf))
+
+        terms   = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        idf     = np.zeros(len(terms), dtype=np.float64)
+        for t, term in enumerate(terms):
+            df           = len(postings[term])
+            offsets[t+1] = offsets[t] + df
+            idf[t]       = np.log(n - df + 0.5) - np.log(df + 0.5)
+        # rank_bm25: negative IDFs (terms in > half the docs) are floored at epsilon * mean IDF
+        if len(terms):
+            idf[idf < 0] = epsilon * idf.mean()
+
+        post_doc = np.empty(int(offsets[-1]), dtype=np.int32)
+        post_tf  = np.empty(int(offsets[-1]), dtype=np.float32)
+        for t, term in enumerate(terms):
+            s, e = offsets[t], offsets[t+1]
+            post_doc[s:e], post_tf[s:e] = zip(*postings[term])
+
+        norm   = k1 * (1 - b + b * doc_len[post_doc] / avgdl) if avgdl else k1
+        post_w = (post_tf * (k1 + 1) / (post_tf + norm)).astype(np.float32)
+
+        arrays = {
+            "offsets":  offsets,
+            "post_doc": post_doc,
+            "post_w":   post_w,
+            "idf":      idf.astype(np.float32),
+            "doc_len":  doc_len,
+            "doc_map":  np.array(order, dtype=np.int32),
+        }
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "num_docs":       n,
+            "avgdl":          avgdl,
+            "k1": k1, "b": b, "epsilon": epsilon,
+            "partitions":     partitions,
+            "ids":            list(ids),
+        }
+        cls._write(path, meta, terms, arrays)
+        return cls.load(path)
+
+    @staticmethod
+    def _current(path):
+        with open(os.path.join(path, "CURRENT")) as f:
+            return f.read().strip()
+
+    @classmethod
+    def _write(cls, path, meta, terms, arrays):
+        # a fresh version directory per build, published by atomically replacing CURRENT: readers
+        # see the old or the new index, and racing builders each publish a complete one (last wins)
+        os.makedirs(path, exist_ok=True)
+        version = f"v-{uuid.uuid4().hex[:12]}"
+        tmp     = os.path.join(path, f".tmp-{version}")
+        os.makedirs(tmp)
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), arr)
+        with open(os.path.join(tmp, "vocab.json"), "w") as f:
+            json.dump(terms, f)
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(path, version))
+
+        try:
+            previous = cls._current(path)
+        except OSError:
+            previous = None
+        pointer = os.path.join(path, f".CURRENT-{version}")
+        with open(pointer, "w") as f:
+            f.write(version)
+        os.replace(pointer, os.path.join(path, "CURRENT"))
+        if previous and previous != version:
+            # open memory maps of the old version stay valid (POSIX); where removal fails it is left
+            shutil.rmtree(os.path.join(path, previous), ignore_errors=True)
+
+    @classmethod
+    def load(cls, path):
+        for attempt in range(2):   # the version CURRENT named may be pruned by a concurrent rebuild
+            version = cls._current(path)
+            data    = os.path.join(path, version)
+            try:
+                with open(os.path.join(data, "meta.json")) as f:
+                    meta = json.load(f)
+                if meta.get("format_version") != FORMAT_VERSION:
+                    raise ValueError(f"sparse index at {path} has format {meta.get('format_version')}, "
+                                     f"expected {FORMAT_VERSION}")
+                with open(os.path.join(data, "vocab.json")) as f:
+                    terms = json.load(f)
+                arrays = {name: np.load(os.path.join(data, f"{name}.npy"), mmap_mode="r")
+                          for name in ARRAYS}
+                return cls(path, meta, terms, arrays)
+            except OSError:
+                if attempt or cls._current(path) == version:
+                    raise
+
+    @classmethod
+    def open_or_build(cls, path, ids, docs, metas, tok=tokenize):
+        """Load the index at `path`, rebuilding it if missing, stale or unreadable."""
+        try:
+            index = cls.load(path)
+            if index.ids == list(ids):
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+        return cls.build(path, ids, [tok(d) for d in docs], metas)
+
+    # ── query ─────────────────────────────────────────────────
+    def ranges(self, filters=None):
+        """Internal-id ranges of the shards matching `filters` ({field: value or list of values},
+        fields from PARTITION_FIELDS; None values are ignored), adjacent ranges merged."""
+        want = {}
+        for field, value in (filters or {}).items():
+            if value is None:
+                continue
+            if field not in PARTITION_FIELDS:
+                raise ValueError(f"cannot filter sparse index on {field!r}")
+            values = value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+            want[PARTITION_FIELDS.index(field)] = {str(v) for v in values}
+        if not want:
+            return [(0, len(self))] if len(self) else []
+        out = []
+        for key, lo, hi in self.partitions:
+            if all(key[i] in values for i, values in want.items()):
+                if out and out[-1][1] == lo:
+                    out[-1] = (out[-1][0], hi)
+                else:
+                    out.append((lo, hi))
+        return out
+
+    def positions(self, filters=None):
+        """Corpus positions of the docs matching `filters`, in shard order (for other indexes that
+        reuse the shard layout, e.g. exact dense search)."""
+        rngs = self.ranges(filters)
+        if not rngs:
+            return np.zeros(0, dtype=np.int32)
+        return np.concatenate([self.doc_map[lo:hi] for lo, hi in rngs])
+
+    def top_k(self, tokens, k, filters=None):
+        """Return up to k (score, corpus_idx) pairs, best first; only docs matching a query term."""
+        return self.top_k_batch([tokens], k, filters)[0]
+
+    def top_k_batch(self, token_lists, k, filters=None):
+        """top_k for many queries in one pass: each posting list is read once per shard and added
+        to every query row that contains the term."""
+        rngs = self.ranges(filters)
+        if not rngs or k <= 0:
+            return [[] for _ in token_lists]
+        sizes  = [hi - lo for lo, hi in rngs]
+        bases  = np.cumsum([0] + sizes[:-1])
+        scores = np.zeros((len(token_lists), sum(sizes)), dtype=np.float32)
+        qf     = {}   # term id -> (rows, query term counts)
+        for row, tokens in enumerate(token_lists):
+            for term, n in Counter(tokens).items():
+                t = self.vocab.get(term)
+                if t is not None:
+                    rows, counts = qf.setdefault(t, ([], []))
+                    rows.append(row)
+                    counts.append(n)
+        for t, (rows, counts) in qf.items():
+            weight = np.asarray(counts, np.float32) * self.idf[t]
+            for (lo, hi), base in zip(rngs, bases):
+                docs, w = self._postings(t, lo, hi)
+                if len(docs):
+                    scores[np.ix_(rows, docs - lo + base)] += np.outer(weight, w)
+
+        internal = (np.arange(rngs[0][0], rngs[0][1]) if len(rngs) == 1
+                    else np.concatenate([np.arange(lo, hi) for lo, hi in rngs]))
+        return [self._select(row, k, internal) for row in scores]
+
+    def _postings(self, t, lo, hi):
+        s, e = int(self.offsets[t]), int(self.offsets[t+1])
+        docs = self.post_doc[s:e]
+        if lo or hi < len(self):
+            a, z = np.searchsorted(docs, [lo, hi])
+            return docs[a:z], self.post_w[s+a:s+z]
+        return docs, self.post_w[s:e]
+
+    def _select(self, scores, k, internal):
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(float(scores[h]), int(self.doc_map[internal[h]])) for h in hits]
@@ -0,0 +1,4 @@
+# The app's modules are flat files in the directory above; tests import them as the app does.
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
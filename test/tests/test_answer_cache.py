@@ -0,0 +1,65 @@
+import itertools
+
+import pytest
+
+import answer_cache
+from answer_cache import AnswerCache
+
+TOOLS = [{"name": "table_search", "input_schema": {"type": "object", "properties": {"query": {}}}}]
+KEY   = dict(question="What were total revenues for fiscal 2024?", model="claude-opus-4-5",
+             system_prompt="You are an analyst.", tools=TOOLS, corpus_version="abc")
+
+
+def make_key(**changes):
+    return AnswerCache.make_key(**{**KEY, **changes})
+
+
+def test_key_ignores_question_case_and_punctuation():
+    assert make_key(question="  what were TOTAL revenues for fiscal 2024 ") == make_key()
+
+
+@pytest.mark.parametrize("change", [
+    {"question": "What were total revenues for fiscal 2023?"},
+    {"model": "claude-haiku-4-5>claude-opus-4-5:early_stop"},
+    {"system_prompt": "You are a lawyer."},
+    {"tools": TOOLS + [{"name": "text_search"}]},
+    {"corpus_version": "abd"},
+])
+def test_key_changes_with_anything_that_changes_the_answer(change):
+    assert make_key(**change) != make_key()
+
+
+def test_key_ignores_tool_schema_key_order():
+    reordered = [{"input_schema": TOOLS[0]["input_schema"], "name": "table_search"}]
+    assert make_key(tools=reordered) == make_key()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return AnswerCache(str(tmp_path / "answers.sqlite3"))
+
+
+def test_put_get_round_trip_and_counters(cache):
+    value = {"answer": "**$350.0 billion**", "chunks": [{"id": "c1"}], "trace_lines": []}
+    assert cache.get(make_key()) is None
+    cache.put(make_key(), KEY["question"], value)
+    assert cache.get(make_key(question="what were total revenues for fiscal 2024")) == value
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_shared_between_instances_on_one_file(cache, tmp_path):
+    cache.put(make_key(), KEY["question"], {"answer": "a"})
+    assert AnswerCache(str(tmp_path / "answers.sqlite3")).get(make_key()) == {"answer": "a"}
+
+
+def test_least_recently_used_rows_are_evicted_past_max_bytes(tmp_path, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(answer_cache.time, "time", lambda: float(next(clock)))
+    cache = AnswerCache(str(tmp_path / "small.sqlite3"), max_bytes=250)
+    keys  = [make_key(question=f"question {i}") for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, f"question {i}", {"answer": "x" * 100})
+        if i == 1:
+            cache.get(keys[0])   # keys[0] is now more recent than keys[1]
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
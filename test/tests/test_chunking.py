@@ -0,0 +1,87 @@
+import io
+
+from chunking import chunk_id, chunk_markdown, iter_chunks, scan_blocks
+
+FILING = """# ALPHABET INC.
+
+| Item 1. | Business | 3 |
+| Item 7. | Management's Discussion and Analysis | 30 |
+
+## ITEM 7. MANAGEMENT'S DISCUSSION AND ANALYSIS
+
+Revenues grew across segments.
+
+The following table presents revenues by type.
+
+(in millions)
+
+| | 2024 | 2025 |
+|---|---|---|
+| Google Services | $ 304,930 | $ 342,010 |
+| Google Cloud | 43,229 | 58,900 |
+
+Cloud growth was driven by AI infrastructure.
+"""
+
+MSFT = {"ticker": "MSFT", "fiscal_year": 2025, "form_type": "10-K"}
+AAPL = {"ticker": "AAPL", "fiscal_year": 2025, "form_type": "10-K"}
+
+
+def test_scan_blocks_yields_headers_bodies_and_tables_in_order():
+    blocks = [b for b in scan_blocks(FILING.splitlines()) if b[0] != "body" or b[1].strip()]
+    assert [b[0] for b in blocks] == ["header", "table", "header", "body", "table", "body"]
+    assert blocks[0] == ("header", "ALPHABET INC.")
+    assert blocks[2] == ("header", "ITEM 7. MANAGEMENT'S DISCUSSION AND ANALYSIS")
+    assert blocks[4][1].splitlines()[0] == "| | 2024 | 2025 |"
+    assert blocks[4][1].count("\n") == 3
+    assert blocks[5][1].strip() == "Cloud growth was driven by AI infrastructure."
+
+
+def test_table_context_joins_a_short_unit_line_to_the_paragraph_before():
+    table = [b for b in scan_blocks(FILING.splitlines()) if b[0] == "table"][1]
+    assert table[2] == "The following table presents revenues by type. (in millions)"
+
+
+def test_scan_blocks_streams_from_a_file_handle():
+    assert list(scan_blocks(io.StringIO(FILING))) == list(scan_blocks(FILING.splitlines()))
+
+
+def test_unterminated_pipe_lines_are_text_not_tables():
+    # the old regex backtracked on long runs of "|" lines; the scanner is one pass
+    lines = ["| not a table row"] * 20_000
+    blocks = list(scan_blocks(lines))
+    assert [b[0] for b in blocks] == ["body"]
+
+
+def test_chunks_carry_item_page_and_filing():
+    chunks = chunk_markdown(FILING, "10k.md", MSFT)
+    table  = next(m for _, c, m in chunks if c.startswith("Table Heading: The following"))
+    assert table["item_number"] == "Item 7"
+    assert table["page"] == "30"
+    assert table["content_type"] == "table"
+    assert {table[f] for f in ("ticker", "fiscal_year", "form_type")} == {"MSFT", 2025, "10-K"}
+
+
+def test_chunk_ids_are_stable_across_runs():
+    assert chunk_markdown(FILING, "10k.md", MSFT) == chunk_markdown(FILING, "10k.md", MSFT)
+    assert [i for i, _, _ in chunk_markdown(FILING, "10k.md", MSFT)] \
+        == [i for i, _, _ in iter_chunks(io.StringIO(FILING), "10k.md", MSFT)]
+
+
+def test_chunk_ids_differ_by_filing_and_source():
+    ids = lambda source, filing: {i for i, _, _ in chunk_markdown(FILING, source, filing)}
+    assert not ids("10k.md", MSFT) & ids("10k.md", AAPL)
+    assert not ids("10k.md", MSFT) & ids("other.md", MSFT)
+
+
+def test_editing_one_chunk_keeps_the_other_ids():
+    before = [i for i, _, _ in chunk_markdown(FILING, "10k.md", MSFT)]
+    edited = FILING.replace("driven by AI infrastructure", "driven by AI infrastructure and Workspace")
+    after  = [i for i, _, _ in chunk_markdown(edited, "10k.md", MSFT)]
+    assert len(before) == len(after)
+    assert sum(a != b for a, b in zip(before, after)) == 1
+
+
+def test_repeated_content_gets_distinct_ids():
+    assert chunk_id("10k.md", "boilerplate", 0, MSFT) != chunk_id("10k.md", "boilerplate", 1, MSFT)
+    assert chunk_id("10k.md", "boilerplate", 0, MSFT) == chunk_id("10k.md", "boilerplate", 0, dict(MSFT))
@@ -0,0 +1,32 @@
+from compact import approx_tokens, query_terms, trim_text
+from tools import SentChunks, format_chunks
+
+TEXT = ("Google Cloud revenues increased in 2025. The increase was driven by infrastructure. "
+        "Other Bets revenues were flat. We continue to invest in AI. Headcount grew modestly.")
+
+
+def chunk(i, content):
+    return {"id": f"c{i}", "content": content,
+            "metadata": {"item_number": "Item 7", "page": i, "content_type": "text"}}
+
+
+def test_text_within_budget_is_sent_whole():
+    assert trim_text(TEXT, query_terms("cloud revenues"), budget=approx_tokens(TEXT)) == TEXT
+    assert trim_text(TEXT, query_terms("cloud revenues")) == TEXT
+
+
+def test_text_over_budget_keeps_the_sentences_nearest_the_query():
+    out = trim_text(TEXT, query_terms("cloud revenues infrastructure"), budget=25)
+    assert out.startswith("Google Cloud revenues increased in 2025.")
+    assert "Headcount" not in out and out.endswith("…")
+    assert approx_tokens(out) <= 25 + 2
+
+
+def test_every_round_gets_a_fresh_budget():
+    sent = SentChunks(call_tokens=60, round_tokens=60, conversation_tokens=1000)
+    for r in range(4):
+        sent.new_round()
+        first  = format_chunks([chunk(2 * r, TEXT)], sent, "cloud revenues")
+        second = format_chunks([chunk(2 * r + 1, TEXT)], sent, "cloud revenues")
+        assert "budget spent" not in first and "budget spent" in second
+    assert len(sent.labels) == 4   # the first call of each round
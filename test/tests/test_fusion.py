@@ -0,0 +1,43 @@
+import random
+
+from fusion import rrf_positions
+
+
+def reference(dense, sparse, k):
+    scores = {}
+    for leg in (dense, sparse):
+        for rank, pos in enumerate(leg):
+            scores[pos] = scores.get(pos, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+def test_docs_in_both_legs_rank_first():
+    assert rrf_positions([1, 2, 3], [3, 4, 1], top_n=5, k=60)[:2] == [1, 3]
+
+
+def test_order_and_scores_match_the_formula():
+    rng = random.Random(0)
+    for _ in range(50):
+        dense  = rng.sample(range(200), 20)
+        sparse = rng.sample(range(200), 20)
+        want   = reference(dense, sparse, 60)
+        got    = rrf_positions(dense, sparse, top_n=len(want), k=60)
+        assert sorted(got) == sorted(want)
+        assert [want[p] for p in got] == sorted(want.values(), reverse=True)
+        # ties keep ascending position, so fusion is deterministic
+        assert got == sorted(want, key=lambda p: (-want[p], p))
+
+
+def test_top_n_keeps_the_best():
+    rng = random.Random(1)
+    dense, sparse = rng.sample(range(100), 20), rng.sample(range(100), 20)
+    want = reference(dense, sparse, 60)
+    got  = rrf_positions(dense, sparse, top_n=5, k=60)
+    assert len(got) == 5
+    assert [want[p] for p in got] == sorted(want.values(), reverse=True)[:5]
+
+
+def test_one_empty_leg_keeps_the_other_order():
+    assert rrf_positions([7, 3, 9], [], top_n=5, k=60) == [7, 3, 9]
+    assert rrf_positions([], [4, 8], top_n=1, k=60) == [4]
+    assert rrf_positions([], [], top_n=5, k=60) == []
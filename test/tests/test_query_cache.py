@@ -0,0 +1,85 @@
+import numpy as np
+
+import query_cache
+from query_cache import QueryCache, normalize_query
+
+PARAMS = (("content_type", "table"), 5)
+EMB    = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+
+
+def unit(*v):
+    v = np.asarray(v, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+def test_normalize_query_ignores_case_and_punctuation():
+    assert normalize_query("  Total Revenues, FY-2024? ") == "total revenues fy 2024"
+
+
+def test_exact_hit_on_normalized_query_and_same_params():
+    cache = QueryCache()
+    cache.put("Total revenues 2024", PARAMS, ["r"])
+    assert cache.get("total revenues, 2024?", PARAMS) == ["r"]
+    assert cache.get("total revenues 2024", (("content_type", "text"), 5)) is None
+    assert cache.stats()["hits_exact"] == 1
+
+
+def test_semantic_hit_needs_threshold_params_and_numbers():
+    cache = QueryCache(sim_threshold=0.95)
+    cache.put("google cloud revenue 2024", PARAMS, ["cloud"], EMB)
+    assert cache.get_similar("revenue of google cloud in 2024", PARAMS, unit(1, 0.1, 0)) == ["cloud"]
+    # embeds almost identically, but another year must never share results
+    assert cache.get_similar("google cloud revenue 2023", PARAMS, EMB) is None
+    assert cache.get_similar("google cloud revenue 2024", (("content_type", "text"), 5), EMB) is None
+    assert cache.get_similar("google cloud revenue 2024", PARAMS, unit(1, 1, 0)) is None
+    s = cache.stats()
+    assert (s["hits_semantic"], s["misses"]) == (1, 3)
+
+
+def test_entries_without_embedding_are_exact_only():
+    cache = QueryCache()
+    cache.put("capex plan 2025", PARAMS, ["c"])
+    assert cache.get_similar("capex plan 2025", PARAMS, EMB) is None
+
+
+def test_bind_to_a_new_corpus_version_drops_entries():
+    cache = QueryCache()
+    cache.bind("v1")
+    cache.put("q", PARAMS, ["r"])
+    cache.bind("v1")
+    assert cache.get("q", PARAMS) == ["r"]
+    cache.bind("v2")
+    assert cache.get("q", PARAMS) is None
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(query_cache.time, "monotonic", lambda: now[0])
+    cache = QueryCache(ttl=60)
+    cache.put("q", PARAMS, ["r"], EMB)
+    now[0] += 59
+    assert cache.get("q", PARAMS) == ["r"]
+    now[0] += 2
+    assert cache.get("q", PARAMS) is None
+    assert cache.get_similar("q", PARAMS, EMB) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = QueryCache(max_entries=2)
+    cache.put("a", PARAMS, ["a"])
+    cache.put("b", PARAMS, ["b"])
+    cache.get("a", PARAMS)
+    cache.put("c", PARAMS, ["c"])
+    assert cache.get("b", PARAMS) is None
+    assert cache.get("a", PARAMS) == ["a"] and cache.get("c", PARAMS) == ["c"]
+
+
+def test_results_are_copies():
+    cache = QueryCache()
+    result = ["r"]
+    cache.put("q", PARAMS, result)
+    result.append("mutated")
+    got = cache.get("q", PARAMS)
+    got.append("mutated")
+    assert cache.get("q", PARAMS) == ["r"]
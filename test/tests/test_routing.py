@@ -0,0 +1,141 @@
+from types import SimpleNamespace
+
+import pytest
+
+from routing import MAX_TOKENS, SELECT_MAX_TOKENS, ModelRouting, is_simple, route_summary, turn_cost
+
+LARGE, SMALL = "claude-opus-4-5", "claude-haiku-4-5"
+SIMPLE = "What were total revenues in 2024?"
+HARD   = "Compare Google Cloud and Google Services operating income trends between 2023 and 2025"
+ANY, NONE = {"type": "any"}, {"type": "none"}
+
+
+def routing(adaptive, early_stop):
+    return ModelRouting(large=LARGE, small=SMALL, adaptive=adaptive, early_stop=early_stop)
+
+
+def response(stop_reason):
+    return SimpleNamespace(stop_reason=stop_reason)
+
+
+def drive(plan, new_chunks, max_iterations=8):
+    """Run the loop against a model that searches whenever it may; new_chunks[i] is what search
+    round i adds. Returns [(model, tool_choice, route)] per turn."""
+    turns, rounds = [], iter(new_chunks)
+    for iteration in range(1, max_iterations + 1):
+        turn   = plan.next_turn(last=iteration == max_iterations)
+        choice = turn.options.get("tool_choice")
+        route  = plan.settle(response("end_turn" if choice == NONE else "tool_use"))
+        turns.append((turn.model, choice, route))
+        if route == "answer":
+            break
+        plan.evidence(next(rounds, 3))
+    return turns
+
+
+def test_question_classes():
+    assert is_simple(SIMPLE)
+    assert not is_simple(HARD)
+    assert not is_simple("What were revenues in 2023 and 2024?")   # two periods
+
+
+@pytest.mark.parametrize("adaptive", [True, False])
+@pytest.mark.parametrize("early_stop", [True, False])
+def test_no_turn_is_ever_thrown_away(adaptive, early_stop):
+    for question in (SIMPLE, HARD):
+        turns = drive(routing(adaptive, early_stop).plan(question), [3, 0, 0, 0, 0, 0, 0])
+        assert turns[-1][2] == "answer"
+        assert [r for _, _, r in turns[:-1]] == ["select"] * (len(turns) - 1)
+
+
+@pytest.mark.parametrize("adaptive", [True, False])
+@pytest.mark.parametrize("early_stop", [True, False])
+def test_last_turn_answers_once_anything_was_retrieved(adaptive, early_stop):
+    plan = routing(adaptive, early_stop).plan(HARD)
+    plan.evidence(3)
+    turn = plan.next_turn(last=True)
+    assert turn.model == LARGE
+    assert turn.options == {"max_tokens": MAX_TOKENS, "tool_choice": NONE}
+
+
+@pytest.mark.parametrize("adaptive", [True, False])
+@pytest.mark.parametrize("early_stop", [True, False])
+def test_last_turn_before_any_search_is_not_forced(adaptive, early_stop):
+    turn = routing(adaptive, early_stop).plan(HARD).next_turn(last=True)
+    assert turn.model == LARGE
+    assert "tool_choice" not in turn.options
+
+
+def test_routed_early_stop_hard_question():
+    # only the first round is forced onto the small model; the large model may answer right after
+    turns = drive(routing(True, True).plan(HARD), [4, 2, 0])
+    assert turns[:2] == [(SMALL, ANY, "select"), (LARGE, None, "select")]
+    assert turns == [(SMALL, ANY, "select"), (LARGE, None, "select"), (LARGE, None, "select"),
+                     (LARGE, NONE, "answer")]
+
+
+def test_large_model_may_answer_after_the_first_round():
+    plan = routing(True, True).plan(HARD)
+    plan.settle(response("tool_use"))
+    plan.evidence(4)
+    turn = plan.next_turn()
+    assert turn.model == LARGE and "tool_choice" not in turn.options
+    assert plan.settle(response("end_turn")) == "answer"
+
+
+def test_forced_select_turns_are_capped():
+    turn = routing(True, True).plan(HARD).next_turn()
+    assert turn.options == {"max_tokens": SELECT_MAX_TOKENS, "tool_choice": ANY}
+
+
+def test_routed_without_early_stop_hands_over_after_the_first_round():
+    turns = drive(routing(True, False).plan(HARD), [4, 0, 0], max_iterations=4)
+    # no convergence without early stop: the large model searches until the last turn
+    assert turns == [(SMALL, ANY, "select"), (LARGE, None, "select"), (LARGE, None, "select"),
+                     (LARGE, NONE, "answer")]
+
+
+def test_simple_question_stays_on_the_small_model():
+    for early_stop in (True, False):
+        turns = drive(routing(True, early_stop).plan(SIMPLE), [3, 0], max_iterations=3)
+        assert {m for m, _, _ in turns} == {SMALL}
+        assert all(c != ANY for _, c, _ in turns)
+    assert drive(routing(True, True).plan(SIMPLE), [3, 0])[-1] == (SMALL, NONE, "answer")
+
+
+def test_unrouted_early_stop_answers_when_evidence_converges():
+    turns = drive(routing(False, True).plan(HARD), [5, 0])
+    assert turns == [(LARGE, None, "select"), (LARGE, None, "select"), (LARGE, NONE, "answer")]
+
+
+def test_unrouted_without_early_stop_is_the_single_model_loop():
+    turns = drive(routing(False, False).plan(HARD), [0] * 8, max_iterations=3)
+    assert turns == [(LARGE, None, "select"), (LARGE, None, "select"), (LARGE, NONE, "answer")]
+
+
+def test_settle_routes():
+    plan = routing(True, True).plan(HARD)
+    plan.next_turn()
+    assert plan.settle(response("tool_use")) == "select"
+    for stop in ("end_turn", "max_tokens", "refusal"):
+        assert plan.settle(response(stop)) == "answer"
+    assert not plan.converged
+
+
+def test_policy_keys():
+    assert routing(False, False).key == LARGE
+    assert routing(True, True).key == f"{SMALL}>{LARGE}:early_stop"
+    assert routing(True, False).key == f"{SMALL}>{LARGE}"
+    assert routing(False, True).key == f"{LARGE}>{LARGE}:early_stop"
+
+
+def test_turn_cost_and_route_summary():
+    usage = {"input_tokens": 1_000_000, "output_tokens": 100_000, "cache_read_tokens": 1_000_000,
+             "cache_write_tokens": 0}
+    assert turn_cost(SMALL, usage) == pytest.approx(1.0 + 0.5 + 0.1)
+    assert turn_cost(f"{SMALL}-20251001", usage) == turn_cost(SMALL, usage)
+    assert turn_cost("stub", usage) == 0.0
+    summary = route_summary([{"route": "select", "llm_s": 1.0, "cost_usd": 0.5, **usage},
+                             {"route": "select", "llm_s": 2.0, "cost_usd": 0.25, "input_tokens": 10}])
+    assert summary == {"select": {"turns": 2, "llm_s": 3.0, "input_tokens": 2_000_010,
+                                  "output_tokens": 100_000, "cost_usd": 0.75}}
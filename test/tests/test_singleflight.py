@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import LeaderGone, SharedStream, SingleFlight
+
+
+class Interrupted(BaseException):
+    """Stands in for KeyboardInterrupt / a Streamlit rerun stopping the leader's thread."""
+
+
+def wait_for(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def start_leader(flight, key, release, outcome):
+    """Run do(key) on a thread whose fn blocks until `release` is set, then returns or raises
+    `outcome`. Returns (thread, results list, fn call counter)."""
+    calls, results = [], []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def run():
+        try:
+            results.append(flight.do(key, fn))
+        except BaseException as e:
+            results.append(e)
+
+    t = threading.Thread(target=run)
+    t.start()
+    wait_for(lambda: flight.in_flight(key))
+    return t, results, calls
+
+
+def join_waiter(flight, key):
+    results = []
+
+    def run():
+        try:
+            results.append(flight.do(key, lambda: pytest.fail("waiter must not compute")))
+        except BaseException as e:
+            results.append(e)
+
+    t = threading.Thread(target=run)
+    t.start()
+    wait_for(lambda: flight.stats()["coalesced"] >= 1)
+    return t, results
+
+
+def test_waiter_shares_the_leaders_result():
+    flight, release = SingleFlight("test"), threading.Event()
+    leader, led, calls = start_leader(flight, "q", release, "answer")
+    waiter, waited     = join_waiter(flight, "q")
+    release.set()
+    leader.join(); waiter.join()
+    assert led == [("answer", False)]
+    assert waited == [("answer", True)]
+    assert len(calls) == 1
+    assert not flight.in_flight("q")
+    assert flight.stats() == {"calls": 2, "coalesced": 1, "in_flight": 0, "rate": 0.5}
+
+
+def test_nothing_is_cached_after_the_leader_finishes():
+    flight = SingleFlight("test")
+    assert flight.do("q", lambda: 1) == (1, False)
+    assert flight.do("q", lambda: 2) == (2, False)
+
+
+def test_leader_exception_is_raised_in_waiters():
+    flight, release = SingleFlight("test"), threading.Event()
+    leader, led, _ = start_leader(flight, "q", release, ValueError("boom"))
+    waiter, waited = join_waiter(flight, "q")
+    release.set()
+    leader.join(); waiter.join()
+    assert isinstance(led[0], ValueError)
+    assert isinstance(waited[0], ValueError) and str(waited[0]) == "boom"
+
+
+def test_interrupted_leader_gives_waiters_leader_gone():
+    flight, release = SingleFlight("test"), threading.Event()
+    leader, led, _ = start_leader(flight, "q", release, Interrupted())
+    waiter, waited = join_waiter(flight, "q")
+    release.set()
+    leader.join(); waiter.join()
+    assert isinstance(led[0], Interrupted)
+    assert isinstance(waited[0], LeaderGone)
+    # the key is free again: a retry after LeaderGone computes it
+    assert flight.do("q", lambda: "retried") == ("retried", False)
+
+
+def test_do_many_runs_duplicates_once_and_waits_on_other_batches():
+    flight, release = SingleFlight("test"), threading.Event()
+    leader, _, _ = start_leader(flight, "b", release, "B")
+    computed = []
+
+    def fn(keys):
+        computed.append(list(keys))
+        return [k.upper() for k in keys]
+
+    out = []
+    t = threading.Thread(target=lambda: out.append(flight.do_many(["a", "b", "a", "c"], fn)))
+    t.start()
+    wait_for(lambda: computed)
+    release.set()
+    t.join(); leader.join()
+    assert computed == [["a", "c"]]   # "b" belonged to the other call
+    assert out == [["A", "B", "A", "C"]]
+
+
+def test_short_result_list_fails_instead_of_dropping_keys():
+    flight = SingleFlight("test")
+    with pytest.raises(ValueError):
+        flight.do_many(["a", "b"], lambda keys: ["A"])
+    assert not flight.in_flight("b")
+    assert flight.do_many(["a", "b"], lambda keys: [k.upper() for k in keys]) == ["A", "B"]
+
+
+def test_cancelled_stream_ends_followers_with_leader_gone():
+    async def scenario():
+        started = asyncio.Event()
+
+        async def events():
+            yield "first"
+            started.set()
+            await asyncio.sleep(10)
+            yield "never"
+
+        stream = SharedStream("test")
+        follower = stream.subscribe("q", events)
+        got = [await follower.__anext__()]
+        await started.wait()
+        stream._runs["q"].task.cancel()
+        with pytest.raises(LeaderGone):
+            async for event in follower:
+                got.append(event)
+        assert got == ["first"]
+        assert stream.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
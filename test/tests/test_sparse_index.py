@@ -0,0 +1,69 @@
+import pytest
+
+from sparse_index import SparseIndex, tokenize
+
+rank_bm25 = pytest.importorskip("rank_bm25")
+
+DOCS = [
+    "Total revenues were $350 billion in fiscal 2024",
+    "Google Cloud revenues grew on AI infrastructure demand",
+    "Operating income for Google Services increased",
+    "Risk factors: competition in AI may reduce revenues",
+    "Share repurchases of Class A and Class C stock",
+    "Revenues revenues revenues from advertising",
+    "Capital expenditures for technical infrastructure",
+    "Unrecognized tax benefits and income tax positions",
+]
+METAS = [{"ticker": "GOOGL", "fiscal_year": 2025, "content_type": "table" if i % 2 else "text"}
+         for i in range(len(DOCS))]
+QUERIES = ["total revenues 2024", "AI competition risk", "income tax", "google", "no such words"]
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SparseIndex.build(str(tmp_path / "sparse"), [f"c{i}" for i in range(len(DOCS))],
+                             [tokenize(d) for d in DOCS], METAS)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_top_k_matches_rank_bm25(index, query):
+    want = rank_bm25.BM25Okapi([tokenize(d) for d in DOCS]).get_scores(tokenize(query))
+    got  = index.top_k(tokenize(query), len(DOCS))
+    assert {pos for _, pos in got} == {i for i, s in enumerate(want) if s != 0}
+    for score, pos in got:
+        assert score == pytest.approx(want[pos], rel=1e-5)
+    assert [s for s, _ in got] == sorted((s for s, _ in got), reverse=True)
+
+
+def test_top_k_truncates_to_best(index):
+    full = index.top_k(tokenize("revenues google"), len(DOCS))
+    assert index.top_k(tokenize("revenues google"), 2) == full[:2]
+
+
+def test_batch_matches_single(index):
+    tokens = [tokenize(q) for q in QUERIES]
+    assert index.top_k_batch(tokens, 3) == [index.top_k(t, 3) for t in tokens]
+
+
+def test_filters_restrict_to_matching_docs(index):
+    got  = index.top_k(tokenize("revenues"), len(DOCS), filters={"content_type": "table"})
+    want = rank_bm25.BM25Okapi([tokenize(d) for d in DOCS]).get_scores(["revenues"])
+    assert {pos for _, pos in got} == {i for i, s in enumerate(want) if s and i % 2}
+    assert set(index.positions({"content_type": "text"}).tolist()) == set(range(0, len(DOCS), 2))
+
+
+def test_rebuild_swaps_current_and_prunes_old_version(index, tmp_path):
+    path   = str(tmp_path / "sparse")
+    before = SparseIndex._current(path)
+    again  = SparseIndex.build(path, index.ids, [tokenize(d) for d in DOCS], METAS)
+    assert SparseIndex._current(path) != before
+    assert sorted(n for n in (tmp_path / "sparse").iterdir() if n.name.startswith("v-")) \
+        == [tmp_path / "sparse" / SparseIndex._current(path)]
+    assert SparseIndex.load(path).top_k(["revenues"], 3) == again.top_k(["revenues"], 3)
+
+
+def test_open_or_build_reuses_matching_index(index, tmp_path):
+    path = str(tmp_path / "sparse")
+    assert SparseIndex.open_or_build(path, index.ids, DOCS, METAS).meta == index.meta
+    other = SparseIndex.open_or_build(path, index.ids[:-1], DOCS[:-1], METAS[:-1])
+    assert other.ids == index.ids[:-1]
@@ -0,0 +1,173 @@
+# ============================================================
+# tools.py — the search tools the model calls, and their results
+#
+# The tool schema (TOOLS) and the rendering of the chunks a tool
+# returns as tool_result text, kept apart from retrieval.py so the
+# agent loop and the thin-client app import them without Chroma or
+# the embedding models. Tables are compacted and narrative trimmed to
+# the query (compact.py) only as far as needed to fit the budget:
+# TOOL_RESULT_TOKENS per call, ROUND_TOKENS per turn of tool calls,
+# so every round gets a fresh share, and CONVERSATION_TOKENS per
+# question as the overall cap, tracked on the conversation's
+# SentChunks; COMPACT_RESULTS=0 sends the chunks as stored.
+# ============================================================
+
+import hashlib, os, re
+
+from compact import approx_tokens, compact_chunk, query_terms
+from metrics import METRICS
+
+COMPACT_RESULTS     = os.environ.get("COMPACT_RESULTS", "1") != "0"   # compact.py rendering of tool results
+TOOL_RESULT_TOKENS  = int(os.environ.get("TOOL_RESULT_TOKENS", "1500"))     # per tool call
+ROUND_TOKENS        = int(os.environ.get("ROUND_TOKENS", "4500"))           # all tool results of one turn
+CONVERSATION_TOKENS = int(os.environ.get("CONVERSATION_TOKENS", "16000"))   # all tool results of one question
+
+# optional filing filters the model can set on either search tool
+FILTER_PROPERTIES = {
+    "ticker":      {"type": "string",  "description": "Company ticker, e.g. GOOGL."},
+    "fiscal_year": {"type": "integer",
+                    "description": "Fiscal year of the FILING (the report's own year, e.g. 2025), not the "
+                                   "period asked about: a 2025 10-K also reports 2024 and 2023 figures."},
+    "item":        {"type": "string",  "description": "10-K Item to restrict to, e.g. 7 or 1A."},
+}
+SEARCH_SCHEMA = {"type": "object",
+                 "properties": {"query": {"type": "string"}, **FILTER_PROPERTIES},
+                 "required": ["query"]}
+
+TOOLS = [
+    {
+        "name": "text_search",
+        "description": "Search narrative 10-K sections: risk factors, MD&A, strategy, competition.",
+        "input_schema": SEARCH_SCHEMA,
+    },
+    {
+        "name": "table_search",
+        "description": "Search financial TABLES: income statement, balance sheet, cash flow, footnotes.",
+        "input_schema": SEARCH_SCHEMA,
+    },
+]
+
+TOOL_CONTENT_TYPES = {"text_search": "text", "table_search": "table"}
+
+
+def chunk_key(c):
+    # chunks cached before chunk ids existed fall back to a content hash
+    return c.get("id") or hashlib.sha1(c["content"].encode()).hexdigest()
+
+
+class SentChunks:
+    """Chunks already sent to the model in one conversation, so later tool results can refer back,
+    and the tool_result tokens the current round and the conversation have left (compact.py)."""
+    def __init__(self, compact=COMPACT_RESULTS, call_tokens=TOOL_RESULT_TOKENS, round_tokens=ROUND_TOKENS,
+                 conversation_tokens=CONVERSATION_TOKENS):
+        self.labels       = {}   # chunk key -> "[i] of search n"
+        self.searches     = 0
+        self.compact      = compact
+        self.call_tokens  = call_tokens
+        self.round_tokens = round_tokens
+        self.round_left   = round_tokens
+        self.remaining    = conversation_tokens
+        self.raw_tokens   = 0    # what the uncompacted results would have cost
+        self.tokens       = 0    # what was sent
+
+    def new_round(self):
+        """Start the tool results of the next turn: the round budget is refilled, the conversation's is not."""
+        self.round_left = self.round_tokens
+
+    def budget(self):
+        return max(min(self.call_tokens, self.round_left, self.remaining), 0)
+
+
+def format_chunks(chunks, sent=None, query=""):
+    """Render chunks as a tool_result string; with `sent`, repeats become one-line back-references.
+    Unless sent.compact is off, bodies are compacted and trimmed toward `query` (compact.py) within
+    the per-call budget and what is left of the round's and the conversation's; headers (Item, page) always stay.
+    A chunk is registered in sent.labels only once its body is sent: one omitted for budget is not
+    referred back to and does not count as evidence, and a later search can still send it."""
+    if sent is not None:
+        sent.searches += 1
+    compact = sent.compact if sent is not None else COMPACT_RESULTS
+    budget  = TOOL_RESULT_TOKENS if sent is None else sent.budget()
+    terms   = query_terms(query)
+    parts, raw, new = [], [], []
+    for i,c in enumerate(chunks,1):
+        m      = c["metadata"]
+        header = (f"[{i}] {item_label(m.get('item_number')) or 'Item ?'} | "
+                  f"page {m.get('page','?')} | {m.get('content_type','?')}")
+        raw.append(f"{header}\n{c['content'].strip()}")
+        if sent is not None:
+            key = chunk_key(c)
+            if key in sent.labels:
+                parts.append(f"{header}\n(same chunk as {sent.labels[key]} — content omitted)")
+                continue
+        parts.append(header)
+        new.append((len(parts) - 1, i, c))
+    included = []
+    if not compact:
+        for j, i, c in new:
+            parts[j] += f"\n{c['content'].strip()}"
+            included.append((i, c))
+    else:
+        # fair share of what is left per new chunk, so chunks that compact well leave room for later ones
+        left = budget - sum(approx_tokens(p) + 2 for p in parts)
+        for n, (j, i, c) in enumerate(new):
+            share = left // (len(new) - n)
+            if share < 16:
+                parts[j] += "\n(omitted: tool result token budget spent)"
+                continue
+            body      = compact_chunk(c, terms, share)
+            parts[j] += f"\n{body}"
+            left     -= approx_tokens(body) + 1
+            included.append((i, c))
+    if sent is not None:
+        for i, c in included:
+            sent.labels[chunk_key(c)] = f"[{i}] of search {sent.searches}"
+    text = "\n\n---\n\n".join(parts)
+    if sent is not None:   # what the conversation actually sends
+        raw_tokens, tokens = approx_tokens("\n\n---\n\n".join(raw)), approx_tokens(text)
+        METRICS.inc("rag_tool_result_tokens_total", raw_tokens, form="raw")
+        METRICS.inc("rag_tool_result_tokens_total", tokens, form="sent")
+        sent.raw_tokens += raw_tokens
+        sent.tokens     += tokens
+        sent.round_left -= tokens
+        sent.remaining  -= tokens
+    return text
+
+
+def tool_result_text(name, chunks, sent=None, query=""):
+    """tool_result content for a tool call that returned chunks (format_chunks), or why it has none."""
+    if name not in TOOL_CONTENT_TYPES:
+        return f"Unknown tool: {name}"
+    if not chunks:
+        return "No relevant content found."
+    return format_chunks(chunks, sent, query)
+
+
+def item_label(item):
+    """Canonical "Item 7" / "Item 1A" for an item as chunking.py stores it ("Item 7"), as older
+    collections and the model write it ("7", "item 1a."), or "" if there is none."""
+    item = str(item or "").strip().upper().removeprefix("ITEM").strip().rstrip(".")
+    return f"Item {item}" if item else ""
+
+
+def tool_filters(tool_input):
+    """Filing filters from a search tool's optional ticker / fiscal_year / item arguments."""
+    item = item_label(tool_input.get("item"))
+    year = re.search(r"\d+", str(tool_input.get("fiscal_year") or ""))   # 2025, "2025", "FY2025"
+    year = year and year.group()
+    return {
+        "ticker":      (tool_input.get("ticker") or "").strip().upper() or None,
+        "fiscal_year": int(year) if year else None,
+        "item_number": item or None,
+    }
+
+
+def tool_searches(name, tool_input):
+    """(content_type, filters) searches for a tool call, tried in order until one finds chunks: as
+    asked, then, if filing filters were set, without them (a year or ticker the collection does not
+    carry, e.g. a collection ingested without filing metadata), then without the content type."""
+    flt   = tool_filters(tool_input)
+    steps = [(TOOL_CONTENT_TYPES[name], flt)]
+    if any(v is not None for v in flt.values()):
+        steps.append((TOOL_CONTENT_TYPES[name], None))
+    return steps + [(None, None)]